@@ -2,14 +2,25 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import os
+import re
 import time
+import hashlib
 import subprocess
-from typing import Any, Dict, Iterable, Optional, Set
-from datetime import datetime, date
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, Optional, Set
+from datetime import datetime, date, timedelta
 from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Connection, make_url
 from sqlalchemy.exc import OperationalError
 
+from import_sheets import (
+    IMPORT_COLUMN_ALIASES, IMPORT_ISSUE_COLUMNS, IMPORT_PREVIEW_ROWS, _DAY_FIRST_DATE_RE, _YEAR_FIRST_DATE_RE,
+    _fold_text, _import_content, _import_fingerprint, _import_frame, _import_frame_rows, _import_sheet_kind,
+    _no_import_issues, _parse_amounts, _parse_dates, auto_map_import_columns, prepare_import_sheet,
+    validate_import_frame,
+)
+
 
 # --- Build / Debug stamp ---
 # Helps verify that the running Streamlit instance is using THIS file and that edits are being picked up.
@@ -91,15 +102,15 @@ def _resolve_db_file() -> str:
 DB_FILE = _resolve_db_file()
 
 
-def _resolve_database_url() -> Optional[str]:
+def _resolve_database_url(key: str = "DATABASE_URL") -> Optional[str]:
     # Prefer Streamlit secrets when available.
     try:
-        if hasattr(st, "secrets") and "DATABASE_URL" in st.secrets:
-            v = str(st.secrets["DATABASE_URL"]).strip()
+        if hasattr(st, "secrets") and key in st.secrets:
+            v = str(st.secrets[key]).strip()
             return v or None
     except Exception:
         pass
-    v = os.getenv("DATABASE_URL")
+    v = os.getenv(key)
     return v.strip() if v else None
 
 
@@ -154,6 +165,12 @@ DB_DIALECT = "sqlite"
 if DATABASE_URL and DATABASE_URL.startswith(("postgres://", "postgresql://")):
     DB_DIALECT = "postgres"
 
+# Optional read replica (e.g. a Postgres hot standby, or `sqlite:///copy.db` for local tests).
+# Report loaders read from it while it has caught up with the primary (see `_choose_read_engine`).
+DATABASE_READ_URL = _resolve_database_url("DATABASE_READ_URL")
+if DATABASE_READ_URL:
+    DATABASE_READ_URL = _normalize_database_url(DATABASE_READ_URL)
+
 # Optional safety gate: prevent accidental writes to local SQLite when you expect Supabase.
 ERP_REQUIRE_POSTGRES = os.getenv("ERP_REQUIRE_POSTGRES", "").strip().lower() in {"1", "true", "yes", "y"}
 if ERP_REQUIRE_POSTGRES and DB_DIALECT != "postgres":
@@ -164,19 +181,163 @@ if ERP_REQUIRE_POSTGRES and DB_DIALECT != "postgres":
     st.stop()
 
 
-def _build_engine():
-    if DB_DIALECT == "postgres":
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, "")).strip())
+    except ValueError:
+        return default
+
+
+# SQLite performance profile (local/single-node). Applied to every new pooled connection.
+# Set ERP_SQLITE_PROFILE=off to fall back to SQLite defaults.
+SQLITE_PROFILE: Dict[str, Any] = {
+    "enabled": os.getenv("ERP_SQLITE_PROFILE", "on").strip().lower() not in {"0", "false", "no", "off"},
+    "journal_mode": os.getenv("ERP_SQLITE_JOURNAL_MODE", "WAL").strip().upper() or "WAL",
+    "synchronous": os.getenv("ERP_SQLITE_SYNCHRONOUS", "NORMAL").strip().upper() or "NORMAL",
+    "cache_size_kb": _env_int("ERP_SQLITE_CACHE_SIZE_KB", 65536),
+    "mmap_size_mb": _env_int("ERP_SQLITE_MMAP_SIZE_MB", 256),
+    "busy_timeout_ms": _env_int("ERP_SQLITE_BUSY_TIMEOUT_MS", 5000),
+    "checkpoint_seconds": _env_int("ERP_SQLITE_CHECKPOINT_SECONDS", 300),
+}
+
+
+def _apply_sqlite_pragmas(dbapi_conn, _conn_record) -> None:
+    cur = dbapi_conn.cursor()
+    try:
+        # WAL lets readers proceed while a writer commits (the default rollback journal blocks them).
+        cur.execute(f"PRAGMA journal_mode={SQLITE_PROFILE['journal_mode']}")
+        cur.execute(f"PRAGMA synchronous={SQLITE_PROFILE['synchronous']}")
+        # Negative cache_size is in KiB rather than pages.
+        cur.execute(f"PRAGMA cache_size=-{max(0, SQLITE_PROFILE['cache_size_kb'])}")
+        cur.execute(f"PRAGMA mmap_size={max(0, SQLITE_PROFILE['mmap_size_mb']) * 1024 * 1024}")
+        cur.execute(f"PRAGMA busy_timeout={max(0, SQLITE_PROFILE['busy_timeout_ms'])}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cur.close()
+
+
+def _search_fold_text(value: str) -> str:
+    """Case folding of the Archive / export search: Unicode lower case, final sigma as σ
+    (what Postgres `LOWER` gives, see `SEARCH_FOLD_SQL`)."""
+    return value.lower().replace("ς", "σ")
+
+
+def _register_sqlite_functions(dbapi_conn, _conn_record) -> None:
+    # SQLite's LOWER() folds ASCII only; `search_fold()` folds Greek (any Unicode) text too.
+    dbapi_conn.create_function(
+        "search_fold", 1, lambda v: None if v is None else _search_fold_text(str(v)), deterministic=True
+    )
+
+
+# An unreachable replica must not stall every rerun: connects give up after
+# ERP_REPLICA_CONNECT_TIMEOUT seconds, and after a failure the replica is skipped (reads go
+# to the primary) for ERP_REPLICA_BACKOFF_SECONDS.
+REPLICA_CONNECT_TIMEOUT = max(1, _env_int("ERP_REPLICA_CONNECT_TIMEOUT", 3))
+REPLICA_BACKOFF_SECONDS = max(0, _env_int("ERP_REPLICA_BACKOFF_SECONDS", 30))
+
+
+# Query counters per engine role ("primary", "replica", "mirror"), per process. Shown in
+# Ρυθμίσεις → Σύστημα so it is visible where report reads were routed.
+@st.cache_resource(show_spinner=False)
+def _query_stats() -> Dict[str, Any]:
+    import threading
+
+    return {"lock": threading.Lock(), "roles": {}}
+
+
+def _instrument_engine(engine, role: str) -> None:
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("query_started") or [time.perf_counter()]
+        elapsed_ms = (time.perf_counter() - started.pop()) * 1000.0
+        stats = _query_stats()
+        with stats["lock"]:
+            row = stats["roles"].setdefault(role, {"queries": 0, "total_ms": 0.0, "last": ""})
+            row["queries"] += 1
+            row["total_ms"] += elapsed_ms
+            row["last"] = " ".join(statement.split())[:80]
+
+    def failed(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", after)
+    event.listen(engine, "handle_error", failed)
+
+
+# Cached per process: a new Engine on every rerun would throw away the connection pool
+# (and re-run the connect-time PRAGMAs for each session interaction).
+@st.cache_resource(show_spinner=False)
+def _build_engine(database_url: Optional[str], db_file: str, role: str = "primary"):
+    if database_url and database_url.startswith(("postgres://", "postgresql://")):
         # Supabase provides a Postgres URL.
-        return create_engine(DATABASE_URL, pool_pre_ping=True)
+        connect_args = {"connect_timeout": REPLICA_CONNECT_TIMEOUT} if role == "replica" else {}
+        engine = create_engine(database_url, pool_pre_ping=True, connect_args=connect_args)
+        _instrument_engine(engine, role)
+        return engine
     # SQLite (local/dev). Use SQLAlchemy so code paths match Postgres.
-    return create_engine(
-        f"sqlite+pysqlite:///{DB_FILE}",
-        connect_args={"check_same_thread": False},
+    engine = create_engine(
+        f"sqlite+pysqlite:///{db_file}",
+        connect_args={
+            "check_same_thread": False,
+            # Driver-level lock wait (seconds); mirrors busy_timeout.
+            "timeout": max(0, SQLITE_PROFILE["busy_timeout_ms"]) / 1000.0,
+        },
         pool_pre_ping=True,
     )
+    if SQLITE_PROFILE["enabled"]:
+        event.listen(engine, "connect", _apply_sqlite_pragmas)
+    event.listen(engine, "connect", _register_sqlite_functions)
+    _instrument_engine(engine, role)
+    return engine
+
+
+ENGINE = _build_engine(DATABASE_URL if DB_DIALECT == "postgres" else None, DB_FILE)
+
+
+def _build_replica_engine(url: Optional[str]):
+    if not url:
+        return None
+    if url.startswith(("postgres://", "postgresql://")):
+        return _build_engine(url, "", role="replica")
+    if url.startswith("sqlite"):
+        return _build_engine(None, make_url(url).database or "", role="replica")
+    return None
+
+
+REPLICA_ENGINE = _build_replica_engine(DATABASE_READ_URL)
+
+
+@st.cache_resource(show_spinner=False)
+def _sqlite_maintenance_state() -> Dict[str, float]:
+    return {"last_run": time.monotonic()}
 
 
-ENGINE = _build_engine()
+def sqlite_maintenance(force: bool = False) -> bool:
+    """Periodic WAL checkpoint + `PRAGMA optimize` (SQLite only, throttled per process).
+
+    Keeps the -wal file from growing without bound under steady write load.
+    Returns True when maintenance actually ran.
+    """
+    if DB_DIALECT != "sqlite" or not SQLITE_PROFILE["enabled"]:
+        return False
+    state = _sqlite_maintenance_state()
+    now = time.monotonic()
+    if not force and now - state["last_run"] < max(1, SQLITE_PROFILE["checkpoint_seconds"]):
+        return False
+    state["last_run"] = now
+    try:
+        with ENGINE.connect() as conn:
+            # PASSIVE never blocks readers/writers; it checkpoints whatever it can.
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)")
+            conn.exec_driver_sql("PRAGMA optimize")
+        return True
+    except Exception:
+        return False
 
 
 def db_execute(sql: str, params: Optional[Dict[str, Any]] = None) -> None:
@@ -198,6 +359,71 @@ def db_scalar(sql: str, params: Optional[Dict[str, Any]] = None, default: Any =
     except Exception:
         return default
 
+
+# Threads for `fetch_concurrently`. Keep it at or below the engine pool size (5) so the
+# fan-out does not wait on pool overflow; 1 runs the tasks one after another.
+FETCH_WORKERS = _env_int("ERP_FETCH_WORKERS", 4)
+
+
+@st.cache_resource(show_spinner=False)
+def _fetch_executor():
+    from concurrent.futures import ThreadPoolExecutor
+
+    return ThreadPoolExecutor(max_workers=max(1, FETCH_WORKERS), thread_name_prefix="erp-fetch")
+
+
+def fetch_concurrently(tasks: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a page's independent reads ({name: zero-argument callable}) in parallel and join them.
+
+    Each task checks out its own pooled connection, so the page waits for the slowest query
+    rather than the sum. Tasks run with this run's script context, so cached loaders work
+    from the pool threads; they must not render anything. The first error is re-raised here.
+    """
+    if FETCH_WORKERS <= 1 or len(tasks) < 2:
+        return {name: fn() for name, fn in tasks.items()}
+    import threading
+
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+
+    def run(fn):
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return fn()
+
+    pool = _fetch_executor()
+    futures = {name: pool.submit(run, fn) for name, fn in tasks.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+
+@contextmanager
+def db_unit_of_work(bump_version: bool = True) -> Iterator[Connection]:
+    """Run a group of related writes in ONE transaction (single BEGIN/COMMIT).
+
+    The data version is bumped inside the same transaction, so cached loaders keyed
+    by `DATA_VERSION` pick up the change on the next rerun (in every session).
+    """
+    with ENGINE.begin() as conn:
+        yield conn
+        if bump_version:
+            bump_data_version(conn)
+
+
+def bump_data_version(conn: Connection) -> None:
+    conn.execute(text("UPDATE app_meta SET value = value + 1 WHERE key = 'data_version'"))
+
+
+def get_data_version() -> int:
+    return int(db_scalar("SELECT value FROM app_meta WHERE key = 'data_version'", default=0) or 0)
+
+
+# Company of this session (sidebar switcher); checked against `companies` after `init_db`.
+# Write helpers and uncached reads filter on it. Cached loaders take it as an argument
+# instead, so it is part of their cache key (like DATA_VERSION).
+DEFAULT_COMPANY_ID = 1
+COMPANY_ID = int(st.session_state.get("company_id") or DEFAULT_COMPANY_ID)
+
 # Theme management
 if 'theme' not in st.session_state:
     st.session_state.theme = 'light'  # default to light
@@ -653,22 +879,105 @@ def init_db():
                 status TEXT
             )"""
         )
+        db_execute(
+            """CREATE TABLE IF NOT EXISTS companies (
+                id SERIAL PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE,
+                closed_through INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
         db_execute(
             """CREATE TABLE IF NOT EXISTS gl_codes (
-                code TEXT PRIMARY KEY,
-                description TEXT
+                company_id INTEGER NOT NULL DEFAULT 1,
+                code TEXT NOT NULL,
+                description TEXT,
+                PRIMARY KEY (company_id, code)
             )"""
         )
         db_execute(
             """CREATE TABLE IF NOT EXISTS counterparties (
-                name TEXT PRIMARY KEY,
-                kind TEXT NOT NULL DEFAULT 'other'
+                company_id INTEGER NOT NULL DEFAULT 1,
+                name TEXT NOT NULL,
+                kind TEXT NOT NULL DEFAULT 'other',
+                PRIMARY KEY (company_id, name)
             )"""
         )
         db_execute(
             """CREATE TABLE IF NOT EXISTS bank_accounts (
-                name TEXT PRIMARY KEY,
-                kind TEXT NOT NULL DEFAULT 'bank'
+                company_id INTEGER NOT NULL DEFAULT 1,
+                name TEXT NOT NULL,
+                kind TEXT NOT NULL DEFAULT 'bank',
+                PRIMARY KEY (company_id, name)
+            )"""
+        )
+        db_execute(
+            """CREATE TABLE IF NOT EXISTS app_meta (
+                key TEXT PRIMARY KEY,
+                value BIGINT NOT NULL DEFAULT 0
+            )"""
+        )
+        for table in JOURNAL_ENUMS.values():
+            db_execute(
+                f"""CREATE TABLE IF NOT EXISTS {table} (
+                    id SMALLSERIAL PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE
+                )"""
+            )
+        db_execute(
+            """CREATE TABLE IF NOT EXISTS period_snapshots (
+                company_id INTEGER NOT NULL DEFAULT 1,
+                fiscal_year SMALLINT NOT NULL,
+                period_month SMALLINT NOT NULL,
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL DEFAULT '',
+                doc_type TEXT NOT NULL DEFAULT '',
+                status TEXT NOT NULL DEFAULT '',
+                n INTEGER NOT NULL DEFAULT 0,
+                amount_net DOUBLE PRECISION,
+                vat_amount DOUBLE PRECISION,
+                amount_gross DOUBLE PRECISION,
+                last_date DATE
+            )"""
+        )
+        db_execute(
+            """CREATE TABLE IF NOT EXISTS recurring_templates (
+                id SERIAL PRIMARY KEY,
+                company_id INTEGER NOT NULL DEFAULT 1,
+                active SMALLINT NOT NULL DEFAULT 1,
+                description TEXT,
+                doc_type TEXT,
+                counterparty TEXT,
+                gl_code TEXT,
+                amount_net DOUBLE PRECISION,
+                vat_rate DOUBLE PRECISION,
+                bank_account TEXT,
+                status TEXT,
+                frequency TEXT NOT NULL DEFAULT 'monthly',
+                day_of_month SMALLINT,
+                start_date DATE,
+                end_date DATE
+            )"""
+        )
+        db_execute(
+            """CREATE TABLE IF NOT EXISTS recurring_skips (
+                company_id INTEGER NOT NULL DEFAULT 1,
+                recurring_key TEXT NOT NULL,
+                PRIMARY KEY (company_id, recurring_key)
+            )"""
+        )
+        db_execute(
+            """CREATE TABLE IF NOT EXISTS bank_statement_lines (
+                id BIGSERIAL PRIMARY KEY,
+                company_id INTEGER NOT NULL DEFAULT 1,
+                bank_account TEXT NOT NULL,
+                txn_date DATE NOT NULL,
+                amount DOUBLE PRECISION NOT NULL,
+                description TEXT,
+                reference TEXT,
+                counterparty TEXT,
+                fingerprint TEXT NOT NULL,
+                journal_id BIGINT,
+                UNIQUE (company_id, fingerprint)
             )"""
         )
     else:
@@ -682,69 +991,139 @@ def init_db():
             )"""
         )
         db_execute(
-            """CREATE TABLE IF NOT EXISTS gl_codes (
-                code TEXT PRIMARY KEY, description TEXT
+            """CREATE TABLE IF NOT EXISTS companies (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
+                closed_through INTEGER NOT NULL DEFAULT 0
             )"""
         )
+        for table, columns in SQLITE_COMPANY_KEYED_TABLES.items():
+            db_execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
         db_execute(
-            """CREATE TABLE IF NOT EXISTS counterparties (
-                name TEXT PRIMARY KEY,
-                kind TEXT NOT NULL DEFAULT 'other'
+            """CREATE TABLE IF NOT EXISTS app_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        for table in JOURNAL_ENUMS.values():
+            db_execute(
+                f"""CREATE TABLE IF NOT EXISTS {table} (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE
+                )"""
+            )
+        db_execute(
+            """CREATE TABLE IF NOT EXISTS period_snapshots (
+                company_id INTEGER NOT NULL DEFAULT 1,
+                fiscal_year INTEGER NOT NULL, period_month INTEGER NOT NULL,
+                kind TEXT NOT NULL, name TEXT NOT NULL DEFAULT '',
+                doc_type TEXT NOT NULL DEFAULT '', status TEXT NOT NULL DEFAULT '',
+                n INTEGER NOT NULL DEFAULT 0,
+                amount_net REAL, vat_amount REAL, amount_gross REAL, last_date DATE
             )"""
         )
         db_execute(
-            """CREATE TABLE IF NOT EXISTS bank_accounts (
-                name TEXT PRIMARY KEY,
-                kind TEXT NOT NULL DEFAULT 'bank'
+            """CREATE TABLE IF NOT EXISTS recurring_templates (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                company_id INTEGER NOT NULL DEFAULT 1,
+                active INTEGER NOT NULL DEFAULT 1,
+                description TEXT, doc_type TEXT, counterparty TEXT, gl_code TEXT,
+                amount_net REAL, vat_rate REAL, bank_account TEXT, status TEXT,
+                frequency TEXT NOT NULL DEFAULT 'monthly', day_of_month INTEGER,
+                start_date DATE, end_date DATE
+            )"""
+        )
+        db_execute(
+            """CREATE TABLE IF NOT EXISTS recurring_skips (
+                company_id INTEGER NOT NULL DEFAULT 1,
+                recurring_key TEXT NOT NULL,
+                PRIMARY KEY (company_id, recurring_key)
             )"""
         )
 
+    # Shared cache key: bumped by every unit of work (see `db_unit_of_work`).
+    db_execute("INSERT INTO app_meta (key, value) VALUES ('data_version', 0) ON CONFLICT (key) DO NOTHING")
+    _ensure_default_company()
+
     _ensure_journal_schema()
+    _ensure_counterparty_ids()
+    _ensure_company_columns()
+    _ensure_change_tracking()
     
-    # Create indices for common queries
+    # Create indices for common queries. Every query filters on one company, so the
+    # indexes lead with `company_id` (the single-company versions are dropped).
     for stmt in [
-        "CREATE INDEX IF NOT EXISTS idx_doc_date ON journal(doc_date)",
-        "CREATE INDEX IF NOT EXISTS idx_counterparty ON journal(counterparty)",
-        "CREATE INDEX IF NOT EXISTS idx_doc_type ON journal(doc_type)",
-        "CREATE INDEX IF NOT EXISTS idx_bank_account ON journal(bank_account)",
-        "CREATE INDEX IF NOT EXISTS idx_status ON journal(status)",
+        *(f"DROP INDEX IF EXISTS {name}" for name in COMPANY_REPLACED_INDEXES),
+        "CREATE INDEX IF NOT EXISTS idx_journal_company_date ON journal(company_id, doc_date)",
+        # Partner lookups go through the integer FK; the old free-text index is dropped.
+        # Partner ids are per company already, so this one needs no company prefix.
+        "DROP INDEX IF EXISTS idx_counterparty",
+        "CREATE INDEX IF NOT EXISTS idx_counterparty_id ON journal(counterparty_id)",
+        # doc_type/status filters use the small-integer enum ids (see `JOURNAL_ENUMS`).
+        "DROP INDEX IF EXISTS idx_doc_type",
+        "DROP INDEX IF EXISTS idx_status",
+        "CREATE INDEX IF NOT EXISTS idx_journal_company_type ON journal(company_id, doc_type_id)",
+        # Open items by status / doc_type / age; covers the aging query (see `AGING_SQL`)
+        # and replaces the plain status_id index (its prefix).
+        "DROP INDEX IF EXISTS idx_status_id",
+        "CREATE INDEX IF NOT EXISTS idx_journal_company_aging ON journal(company_id, status_id, doc_type_id, doc_date, "
+        "counterparty_id, counterparty, amount_net, vat_amount, amount_gross)",
+        # Payment history of the cash forecast (see `FORECAST_DAYS_TO_PAY_SQL`): only paid-late rows.
+        "CREATE INDEX IF NOT EXISTS idx_journal_company_paid ON journal(company_id, doc_type_id, counterparty_id, "
+        "doc_date, paid_date) WHERE paid_date IS NOT NULL",
+        # One row per recurring template and period (see `generate_recurring`); NULLs never clash.
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_journal_company_recurring ON journal(company_id, recurring_key)",
+        # Excel re-imports (see `_import_excel_to_db`): seen rows are skipped by fingerprint,
+        # edited ones are found by their source position.
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_journal_company_import_fp ON journal(company_id, import_fingerprint)",
+        "CREATE INDEX IF NOT EXISTS idx_journal_company_import_source ON journal(company_id, import_source) "
+        "WHERE import_source IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS idx_journal_company_account ON journal(company_id, bank_account)",
+        # Reference check before a GL code is deleted (see `save_gl_codes_diff`).
+        "CREATE INDEX IF NOT EXISTS idx_journal_company_gl ON journal(company_id, gl_code)",
+        # Period keys: month x doc_type totals read this index in GROUP BY order
+        # (see `REPORT_MONTHLY_TOTALS_SQL`); quarter filters use the second one.
+        "DROP INDEX IF EXISTS idx_journal_month_type",
+        "CREATE INDEX IF NOT EXISTS idx_journal_company_period ON journal(company_id, fiscal_year, period_month, "
+        "doc_type_id, doc_type, amount_net)",
+        "CREATE INDEX IF NOT EXISTS idx_journal_company_quarter ON journal(company_id, fiscal_year, period_quarter)",
+        "CREATE INDEX IF NOT EXISTS idx_period_snapshots_company ON period_snapshots(company_id, kind, fiscal_year, period_month)",
+        "CREATE INDEX IF NOT EXISTS idx_recurring_company ON recurring_templates(company_id)",
+        # Unreconciled statement lines per account (see `load_unmatched_lines`).
+        "CREATE INDEX IF NOT EXISTS idx_statement_company_account ON bank_statement_lines(company_id, bank_account, "
+        "journal_id, txn_date)",
     ]:
         try:
             db_execute(stmt)
         except Exception:
             pass
 
-    # Normalize legacy mixed-type values (SQLite-only; Postgres enforces types)
-    if DB_DIALECT == "sqlite":
-        try:
-            db_execute("UPDATE journal SET doc_type = '' WHERE doc_type IS NULL")
-            mixed_doc_type = db_scalar(
-                "SELECT count(*) FROM journal WHERE doc_type IS NOT NULL AND typeof(doc_type) != 'text'",
-                default=0,
-            )
-            if mixed_doc_type and mixed_doc_type > 0:
-                db_execute(
-                    "UPDATE journal SET doc_type = CAST(doc_type AS TEXT) WHERE doc_type IS NOT NULL AND typeof(doc_type) != 'text'"
-                )
-        except Exception:
-            pass
-
-    defaults = [
-        {"code": "100", "description": "Πωλήσεις"},
-        {"code": "200", "description": "Αγορές"},
-        {"code": "300", "description": "Ταμείο"},
-        {"code": "400", "description": "Τράπεζες"},
-        {"code": "600", "description": "Γενικά Έξοδα"},
-    ]
-    for row in defaults:
-        try:
-            db_execute(
-                "INSERT INTO gl_codes (code, description) VALUES (:code, :description)",
-                row,
-            )
-        except Exception:
-            # Ignore duplicates
-            pass
+    with db_unit_of_work(bump_version=False) as conn:
+        insert_default_gl_codes(conn, DEFAULT_COMPANY_ID)
+
+    backfill_counterparty_ids()
+    # The view must resolve enum ids before the backfill starts clearing the text columns.
+    _ensure_journal_view()
+    backfill_journal_enums()
+    normalize_journal_dates()
+
+
+# Period keys derived from `doc_date` by the database (generated columns), so every
+# write path (forms, imports, COPY, mirror) gets them for free. SQLite stores dates
+# as ISO text (see `normalize_doc_date`); anything else yields NULL keys.
+_SQLITE_ISO_DATE = "doc_date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'"
+JOURNAL_PERIOD_SQL = {
+    "postgres": {
+        "fiscal_year": "EXTRACT(YEAR FROM doc_date)::smallint",
+        "period_month": "EXTRACT(MONTH FROM doc_date)::smallint",
+        "period_quarter": "EXTRACT(QUARTER FROM doc_date)::smallint",
+    },
+    "sqlite": {
+        "fiscal_year": f"CASE WHEN {_SQLITE_ISO_DATE} THEN CAST(substr(doc_date, 1, 4) AS INTEGER) END",
+        "period_month": f"CASE WHEN {_SQLITE_ISO_DATE} THEN CAST(substr(doc_date, 6, 2) AS INTEGER) END",
+        "period_quarter": f"CASE WHEN {_SQLITE_ISO_DATE} THEN (CAST(substr(doc_date, 6, 2) AS INTEGER) + 2) / 3 END",
+    },
+}
 
 
 def _journal_expected_columns() -> Dict[str, str]:
@@ -762,6 +1141,16 @@ def _journal_expected_columns() -> Dict[str, str]:
             "payment_method": "TEXT",
             "bank_account": "TEXT",
             "status": "TEXT",
+            "counterparty_id": "BIGINT",
+            "doc_type_id": "SMALLINT",
+            "status_id": "SMALLINT",
+            "payment_method_id": "SMALLINT",
+            "paid_date": "DATE",
+            "recurring_key": "TEXT",
+            "import_source": "TEXT",
+            "import_fingerprint": "TEXT",
+            "company_id": "INTEGER NOT NULL DEFAULT 1",
+            **{col: f"SMALLINT GENERATED ALWAYS AS ({expr}) STORED" for col, expr in JOURNAL_PERIOD_SQL["postgres"].items()},
         }
     return {
         "doc_date": "DATE",
@@ -776,23 +1165,40 @@ def _journal_expected_columns() -> Dict[str, str]:
         "payment_method": "TEXT",
         "bank_account": "TEXT",
         "status": "TEXT",
+        "counterparty_id": "INTEGER",
+        "doc_type_id": "INTEGER",
+        "status_id": "INTEGER",
+        "payment_method_id": "INTEGER",
+        "paid_date": "DATE",
+        "recurring_key": "TEXT",
+        "import_source": "TEXT",
+        "import_fingerprint": "TEXT",
+        "company_id": "INTEGER NOT NULL DEFAULT 1",
+        # VIRTUAL: SQLite cannot ALTER TABLE ADD a STORED column; indexes still store the values.
+        **{col: f"INTEGER GENERATED ALWAYS AS ({expr}) VIRTUAL" for col, expr in JOURNAL_PERIOD_SQL["sqlite"].items()},
     }
 
 
-def _get_journal_columns() -> Set[str]:
+def _get_table_columns(table: str) -> Set[str]:
     try:
         if DB_DIALECT == "postgres":
             cols_df = pd.read_sql_query(
-                "SELECT column_name FROM information_schema.columns WHERE table_name = 'journal'",
+                text("SELECT column_name FROM information_schema.columns WHERE table_name = :t"),
                 ENGINE,
+                params={"t": table},
             )
             return set(cols_df["column_name"].tolist())
-        cols_df = pd.read_sql_query("PRAGMA table_info(journal)", ENGINE)
+        # table_xinfo also lists generated columns (table_info hides them).
+        cols_df = pd.read_sql_query(f"PRAGMA table_xinfo({table})", ENGINE)
         return set(cols_df["name"].tolist())
     except Exception:
         return set()
 
 
+def _get_journal_columns() -> Set[str]:
+    return _get_table_columns("journal")
+
+
 def _ensure_journal_schema() -> None:
     expected_cols = _journal_expected_columns()
     existing_cols = _get_journal_columns()
@@ -807,6 +1213,595 @@ def _ensure_journal_schema() -> None:
             db_execute(f"ALTER TABLE journal ADD COLUMN {col} {col_type}")
 
 
+def _ensure_counterparty_ids() -> None:
+    """Give `counterparties` an integer surrogate key that `journal.counterparty_id` references.
+
+    `name` stays the primary key (upserts keep working unchanged); `id` is unique and
+    assigned automatically (SERIAL on Postgres, trigger on SQLite).
+    """
+    if "id" not in _get_table_columns("counterparties"):
+        if DB_DIALECT == "postgres":
+            # Existing rows get sequence values immediately.
+            db_execute("ALTER TABLE counterparties ADD COLUMN IF NOT EXISTS id BIGSERIAL")
+        else:
+            db_execute("ALTER TABLE counterparties ADD COLUMN id INTEGER")
+            db_execute("UPDATE counterparties SET id = rowid WHERE id IS NULL")
+    if DB_DIALECT == "sqlite":
+        db_execute(
+            """CREATE TRIGGER IF NOT EXISTS trg_counterparties_id
+               AFTER INSERT ON counterparties WHEN NEW.id IS NULL
+               BEGIN
+                   UPDATE counterparties
+                   SET id = (SELECT COALESCE(MAX(id), 0) + 1 FROM counterparties)
+                   WHERE rowid = NEW.rowid;
+               END"""
+        )
+    db_execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_counterparties_id ON counterparties(id)")
+
+
+# Multi-company: these tables hold one company's rows each (`company_id` -> `companies.id`).
+# Rows from before the column existed belong to company 1 (the column default).
+COMPANY_TABLES = (
+    "journal", "gl_codes", "counterparties", "bank_accounts",
+    "period_snapshots", "recurring_templates", "recurring_skips", "bank_statement_lines",
+)
+# table -> (single-company key constraint on Postgres, its per-company replacement).
+COMPANY_KEYS = {
+    "gl_codes": ("gl_codes_pkey", "PRIMARY KEY (company_id, code)"),
+    "counterparties": ("counterparties_pkey", "PRIMARY KEY (company_id, name)"),
+    "bank_accounts": ("bank_accounts_pkey", "PRIMARY KEY (company_id, name)"),
+    "bank_statement_lines": ("bank_statement_lines_fingerprint_key", "UNIQUE (company_id, fingerprint)"),
+}
+# SQLite cannot change a table's key in place: these are created (and migrated by a
+# table rebuild) from this definition.
+SQLITE_COMPANY_KEYED_TABLES = {
+    "gl_codes": "company_id INTEGER NOT NULL DEFAULT 1, code TEXT NOT NULL, description TEXT, "
+    "PRIMARY KEY (company_id, code)",
+    "counterparties": "company_id INTEGER NOT NULL DEFAULT 1, name TEXT NOT NULL, "
+    "kind TEXT NOT NULL DEFAULT 'other', id INTEGER, PRIMARY KEY (company_id, name)",
+    "bank_accounts": "company_id INTEGER NOT NULL DEFAULT 1, name TEXT NOT NULL, "
+    "kind TEXT NOT NULL DEFAULT 'bank', PRIMARY KEY (company_id, name)",
+    "bank_statement_lines": "id INTEGER PRIMARY KEY AUTOINCREMENT, company_id INTEGER NOT NULL DEFAULT 1, "
+    "bank_account TEXT NOT NULL, txn_date DATE NOT NULL, amount REAL NOT NULL, "
+    "description TEXT, reference TEXT, counterparty TEXT, fingerprint TEXT NOT NULL, journal_id INTEGER, "
+    "UNIQUE (company_id, fingerprint)",
+}
+# Single-company indexes superseded by the company-leading ones in `init_db`.
+COMPANY_REPLACED_INDEXES = (
+    "idx_doc_date", "idx_doc_type_id", "idx_journal_aging", "idx_journal_paid_date", "idx_journal_recurring_key",
+    "idx_journal_import_fingerprint", "idx_journal_import_source", "idx_bank_account", "idx_gl_code",
+    "idx_journal_period_type", "idx_journal_period_quarter", "idx_period_snapshots", "idx_statement_account",
+)
+
+
+def _ensure_default_company() -> None:
+    """Create company 1 on first run; it takes over the pre-multi-company lock date."""
+    db_execute(
+        """INSERT INTO companies (id, name, closed_through)
+           SELECT 1, :name, COALESCE((SELECT value FROM app_meta WHERE key = 'closed_through'), 0)
+           WHERE NOT EXISTS (SELECT 1 FROM companies)""",
+        {"name": DEFAULT_COMPANY_NAME},
+    )
+    if DB_DIALECT == "postgres":
+        # Explicit id: move the SERIAL sequence past it.
+        db_execute("SELECT setval(pg_get_serial_sequence('companies', 'id'), (SELECT MAX(id) FROM companies))")
+
+
+def _rebuild_sqlite_table(conn: Connection, table: str) -> None:
+    """Recreate `table` from `SQLITE_COMPANY_KEYED_TABLES`, keeping its rows, indexes and triggers."""
+    old_cols = [r[1] for r in conn.exec_driver_sql(f"PRAGMA table_info({table})").fetchall()]
+    extras = conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE tbl_name = :t AND type IN ('index', 'trigger') AND sql IS NOT NULL"),
+        {"t": table},
+    ).scalars().all()
+    conn.exec_driver_sql(f"DROP TABLE IF EXISTS {table}_rekeyed")
+    conn.exec_driver_sql(f"CREATE TABLE {table}_rekeyed ({SQLITE_COMPANY_KEYED_TABLES[table]})")
+    new_cols = {r[1] for r in conn.exec_driver_sql(f"PRAGMA table_info({table}_rekeyed)").fetchall()}
+    cols = ", ".join(c for c in old_cols if c in new_cols)
+    conn.exec_driver_sql(f"INSERT INTO {table}_rekeyed ({cols}) SELECT {cols} FROM {table}")
+    conn.exec_driver_sql(f"DROP TABLE {table}")
+    conn.exec_driver_sql(f"ALTER TABLE {table}_rekeyed RENAME TO {table}")
+    for ddl in extras:
+        conn.exec_driver_sql(ddl)
+
+
+def _ensure_company_columns() -> None:
+    """Online migration: add `company_id` to the `COMPANY_TABLES` and make the `COMPANY_KEYS` per company.
+
+    `journal` gets the column through `_journal_expected_columns`. On SQLite `journal_v` is
+    dropped first (a table rename would fail on it) and recreated by `_ensure_journal_view`.
+    """
+    pending = [t for t in COMPANY_TABLES if "company_id" not in _get_table_columns(t)]
+    if not pending:
+        return
+    with db_unit_of_work(bump_version=False) as conn:
+        if DB_DIALECT == "sqlite":
+            conn.execute(text("DROP VIEW IF EXISTS journal_v"))
+            conn.execute(text("DELETE FROM app_meta WHERE key = 'journal_view_rev'"))
+        for table in pending:
+            if DB_DIALECT == "sqlite" and table in SQLITE_COMPANY_KEYED_TABLES:
+                _rebuild_sqlite_table(conn, table)
+                continue
+            if DB_DIALECT == "postgres":
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS company_id INTEGER NOT NULL DEFAULT 1"))
+            else:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN company_id INTEGER NOT NULL DEFAULT 1"))
+            if table in COMPANY_KEYS:
+                old_key, new_key = COMPANY_KEYS[table]
+                conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {old_key}"))
+                conn.execute(text(f"ALTER TABLE {table} ADD {new_key}"))
+
+
+COUNTERPARTY_BACKFILL_BATCH = 5000
+
+
+def backfill_counterparty_ids(batch_size: int = COUNTERPARTY_BACKFILL_BATCH) -> int:
+    """Online migration: point journal rows at `counterparties.id`.
+
+    Missing partner names are first added to the lookup (kind 'other', so the
+    Customers/Suppliers tabs are unaffected). Rows are then linked in small
+    batches, each in its own short transaction, so concurrent sessions are not
+    blocked for the duration of a large backfill. Returns the rows linked.
+    """
+    pending = int(
+        db_scalar(
+            "SELECT count(*) FROM journal WHERE counterparty_id IS NULL AND counterparty IS NOT NULL AND counterparty != ''",
+            default=0,
+        )
+        or 0
+    )
+    if not pending:
+        return 0
+    db_execute(
+        """INSERT INTO counterparties (company_id, name, kind)
+           SELECT DISTINCT company_id, TRIM(counterparty), 'other' FROM journal
+           WHERE counterparty_id IS NULL AND counterparty IS NOT NULL AND TRIM(counterparty) != ''
+           ON CONFLICT (company_id, name) DO NOTHING"""
+    )
+    linked = 0
+    while linked < pending:
+        with db_unit_of_work(bump_version=False) as conn:
+            res = conn.execute(
+                text(
+                    """UPDATE journal
+                       SET counterparty_id = (
+                           SELECT c.id FROM counterparties c
+                           WHERE c.company_id = journal.company_id AND c.name = TRIM(journal.counterparty)
+                       )
+                       WHERE id IN (
+                           SELECT j.id FROM journal j
+                           JOIN counterparties c ON c.company_id = j.company_id AND c.name = TRIM(j.counterparty)
+                           WHERE j.counterparty_id IS NULL
+                           LIMIT :n
+                       )"""
+                ),
+                {"n": int(batch_size)},
+            )
+            n = res.rowcount or 0
+            if n:
+                bump_data_version(conn)
+        if n <= 0:
+            break
+        linked += n
+    return linked
+
+
+# Low-cardinality journal columns stored as small-integer ids into lookup tables
+# (column -> lookup table). The legacy text column is only filled for values the
+# lookup does not know yet; `journal_v` returns COALESCE(lookup name, text).
+JOURNAL_ENUMS: Dict[str, str] = {
+    "doc_type": "doc_types",
+    "status": "statuses",
+    "payment_method": "payment_methods",
+}
+
+
+def _enum_id_sql(col: str, param: Optional[str] = None) -> str:
+    return f"(SELECT id FROM {JOURNAL_ENUMS[col]} WHERE name = :{param or col})"
+
+
+def _enum_text_sql(col: str, param: Optional[str] = None) -> str:
+    p = param or col
+    return f"CASE WHEN EXISTS (SELECT 1 FROM {JOURNAL_ENUMS[col]} WHERE name = :{p}) THEN NULL ELSE :{p} END"
+
+
+def ensure_journal_enums(rows: Iterable[Dict[str, Any]], conn: Connection) -> None:
+    """Add unseen doc_type/status/payment_method values of `rows` to their lookup tables.
+
+    The NOT EXISTS guard (rather than relying on ON CONFLICT alone) keeps Postgres
+    from burning SMALLSERIAL values on every save of an already-known value.
+    """
+    rows = list(rows)
+    for col, table in JOURNAL_ENUMS.items():
+        values = {r.get(col) for r in rows} - {None}
+        if not values:
+            continue
+        conn.execute(
+            text(
+                f"""INSERT INTO {table} (name)
+                    SELECT :name WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE name = :name)
+                    ON CONFLICT (name) DO NOTHING"""
+            ),
+            [{"name": v} for v in sorted(values)],
+        )
+
+
+def backfill_journal_enums(batch_size: int = COUNTERPARTY_BACKFILL_BATCH) -> int:
+    """Online migration: move legacy doc_type/status/payment_method text into the `*_id` columns.
+
+    Values are cast to text first (older SQLite files hold some numeric doc_types), so
+    this also replaces the former mixed-type repair. Batched like
+    `backfill_counterparty_ids`; `journal_v` output is unchanged, so no version bump.
+    Returns the rows migrated.
+    """
+    moved = 0
+    for col, table in JOURNAL_ENUMS.items():
+        pending = db_scalar(f"SELECT 1 FROM journal WHERE {col} IS NOT NULL AND {col}_id IS NULL LIMIT 1", default=None)
+        if pending is None:
+            continue
+        db_execute(
+            f"""INSERT INTO {table} (name)
+               SELECT DISTINCT CAST({col} AS TEXT) FROM journal
+               WHERE {col} IS NOT NULL AND {col}_id IS NULL
+                 AND NOT EXISTS (SELECT 1 FROM {table} t WHERE t.name = CAST(journal.{col} AS TEXT))
+               ON CONFLICT (name) DO NOTHING"""
+        )
+        while True:
+            with db_unit_of_work(bump_version=False) as conn:
+                res = conn.execute(
+                    text(
+                        f"""UPDATE journal
+                           SET {col}_id = (SELECT t.id FROM {table} t WHERE t.name = CAST(journal.{col} AS TEXT)),
+                               {col} = NULL
+                           WHERE id IN (
+                               SELECT j.id FROM journal j
+                               JOIN {table} t ON t.name = CAST(j.{col} AS TEXT)
+                               WHERE j.{col} IS NOT NULL AND j.{col}_id IS NULL
+                               LIMIT :n
+                           )"""
+                    ),
+                    {"n": int(batch_size)},
+                )
+                n = res.rowcount or 0
+            if n <= 0:
+                break
+            moved += n
+    return moved
+
+
+def normalize_journal_dates(batch_size: int = COUNTERPARTY_BACKFILL_BATCH) -> int:
+    """SQLite only: rewrite legacy `doc_date` text (time part, dd/mm/yyyy, yyyy/mm/dd, ...) as ISO.
+
+    Values that cannot be parsed, and ambiguous ones (`_ambiguous_doc_date`: 03/05/2024 may
+    be either month), are left untouched (their period keys stay NULL). Returns the rows rewritten.
+    """
+    if DB_DIALECT == "postgres":
+        return 0
+    select_sql = text(
+        "SELECT id, doc_date FROM journal WHERE id > :last AND doc_date IS NOT NULL "
+        "AND (length(doc_date) != 10 OR NOT " + _SQLITE_ISO_DATE + ") ORDER BY id LIMIT :n"
+    )
+    fixed, last_id = 0, 0
+    while True:
+        with ENGINE.connect() as conn:
+            rows = conn.execute(select_sql, {"last": last_id, "n": int(batch_size)}).fetchall()
+        if not rows:
+            break
+        last_id = int(rows[-1][0])
+        updates = []
+        for rid, value in rows:
+            if _ambiguous_doc_date(str(value)):
+                continue
+            try:
+                iso = normalize_doc_date(value)
+            except ValueError:
+                continue
+            if iso and iso != value:
+                updates.append({"id": int(rid), "doc_date": iso})
+        if updates:
+            with db_unit_of_work() as conn:
+                conn.execute(text("UPDATE journal SET doc_date = :doc_date WHERE id = :id"), updates)
+            fixed += len(updates)
+    return fixed
+
+
+# Bump when the view definition changes; `_ensure_journal_view` recreates it once.
+JOURNAL_VIEW_REV = 5
+JOURNAL_VIEW_SQL = """CREATE VIEW journal_v AS
+    SELECT
+        j.id, j.doc_date, j.doc_no,
+        COALESCE(dt.name, j.doc_type) AS doc_type,
+        COALESCE(c.name, j.counterparty) AS counterparty,
+        j.description, j.gl_code,
+        j.amount_net, j.vat_amount, j.amount_gross,
+        COALESCE(pm.name, j.payment_method) AS payment_method,
+        j.bank_account,
+        COALESCE(st.name, j.status) AS status,
+        j.counterparty_id,
+        j.fiscal_year, j.period_month, j.period_quarter,
+        j.company_id, j.paid_date
+    FROM journal j
+    LEFT JOIN counterparties c ON c.id = j.counterparty_id
+    LEFT JOIN doc_types dt ON dt.id = j.doc_type_id
+    LEFT JOIN statuses st ON st.id = j.status_id
+    LEFT JOIN payment_methods pm ON pm.id = j.payment_method_id"""
+
+
+def _ensure_journal_view() -> None:
+    """(Re)create `journal_v`: the journal as reports see it (partner names resolved by FK)."""
+    current = db_scalar("SELECT value FROM app_meta WHERE key = 'journal_view_rev'", default=None)
+    if current is not None and int(current) == JOURNAL_VIEW_REV:
+        return
+    with db_unit_of_work(bump_version=False) as conn:
+        conn.execute(text("DROP VIEW IF EXISTS journal_v"))
+        conn.execute(text(JOURNAL_VIEW_SQL))
+        conn.execute(
+            text(
+                "INSERT INTO app_meta (key, value) VALUES ('journal_view_rev', :v) "
+                "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value"
+            ),
+            {"v": JOURNAL_VIEW_REV},
+        )
+
+
+def _ensure_change_tracking() -> None:
+    """Postgres only: stamp every journal insert/update with `change_seq` and log deletes.
+
+    Feeds the incremental sync of the optional local read mirror (`sync_read_mirror`).
+    """
+    if DB_DIALECT != "postgres":
+        return
+    db_execute("ALTER TABLE journal ADD COLUMN IF NOT EXISTS change_seq BIGINT")
+    db_execute("CREATE SEQUENCE IF NOT EXISTS journal_change_seq")
+    db_execute(
+        """CREATE TABLE IF NOT EXISTS journal_deletions (
+            id BIGINT PRIMARY KEY,
+            change_seq BIGINT NOT NULL
+        )"""
+    )
+    with db_unit_of_work(bump_version=False) as conn:
+        conn.execute(
+            text(
+                """CREATE OR REPLACE FUNCTION journal_track_change() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'DELETE' THEN
+                        INSERT INTO journal_deletions (id, change_seq)
+                        VALUES (OLD.id, nextval('journal_change_seq'))
+                        ON CONFLICT (id) DO UPDATE SET change_seq = EXCLUDED.change_seq;
+                        RETURN OLD;
+                    END IF;
+                    NEW.change_seq := nextval('journal_change_seq');
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql"""
+            )
+        )
+        conn.execute(text("DROP TRIGGER IF EXISTS trg_journal_change ON journal"))
+        conn.execute(
+            text(
+                "CREATE TRIGGER trg_journal_change BEFORE INSERT OR UPDATE OR DELETE ON journal "
+                "FOR EACH ROW EXECUTE FUNCTION journal_track_change()"
+            )
+        )
+    # Rows from before change tracking.
+    db_execute("UPDATE journal SET change_seq = nextval('journal_change_seq') WHERE change_seq IS NULL")
+    db_execute("CREATE INDEX IF NOT EXISTS idx_journal_change_seq ON journal(change_seq)")
+
+
+# --- Optional local read mirror (Postgres deployments) ---
+# ERP_READ_MIRROR=<path.db> (or "on" for a file next to the local DB) keeps a SQLite copy
+# of journal + lookups. Report reads go to the mirror (`READ_ENGINE`); writes stay on Postgres.
+def _resolve_read_mirror_file() -> Optional[str]:
+    v = os.getenv("ERP_READ_MIRROR", "").strip()
+    if DB_DIALECT != "postgres" or not v or v.lower() in {"0", "false", "no", "off"}:
+        return None
+    if v.lower() in {"1", "true", "yes", "on"}:
+        return os.path.join(os.path.dirname(os.path.abspath(DB_FILE)), "read_mirror.db")
+    return v
+
+
+READ_MIRROR_FILE = _resolve_read_mirror_file()
+READ_MIRROR_SYNC_SECONDS = _env_int("ERP_READ_MIRROR_SYNC_SECONDS", 60)
+READ_MIRROR_BATCH = 5000
+# change_seq is taken inside the writing transaction, so a slow transaction can commit a
+# lower value after a higher one was already synced. Re-reading this many sequence values
+# behind the last one seen picks those rows up (upserts are idempotent).
+READ_MIRROR_LOOKBACK = _env_int("ERP_READ_MIRROR_LOOKBACK", 1000)
+# A commit later than the lookback still gets through: every ERP_READ_MIRROR_RECONCILE_SECONDS
+# (0 = off), and whenever the lookback setting changes, `_reconcile_mirror` compares row count
+# and change_seq sum per block of READ_MIRROR_BLOCK ids with the primary and re-copies the
+# blocks that differ.
+READ_MIRROR_RECONCILE_SECONDS = max(0, _env_int("ERP_READ_MIRROR_RECONCILE_SECONDS", 3600))
+READ_MIRROR_BLOCK = 10_000
+READ_MIRROR_BLOCKS_SQL = (
+    f"SELECT id / {READ_MIRROR_BLOCK} AS block, COUNT(*) AS n, SUM(COALESCE(change_seq, 0)) AS seq_sum "
+    "FROM journal GROUP BY 1"
+)
+READ_MIRROR_LOOKUPS = ["gl_codes", "counterparties", "bank_accounts", *JOURNAL_ENUMS.values()]
+
+
+@st.cache_resource(show_spinner=False)
+def _read_mirror_engine(path: str):
+    engine = create_engine(
+        f"sqlite+pysqlite:///{path}",
+        connect_args={"check_same_thread": False, "timeout": max(0, SQLITE_PROFILE["busy_timeout_ms"]) / 1000.0},
+        pool_pre_ping=True,
+    )
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
+    event.listen(engine, "connect", _register_sqlite_functions)
+    _instrument_engine(engine, "mirror")
+    return engine
+
+
+@st.cache_resource(show_spinner=False)
+def _read_mirror_state() -> Dict[str, Any]:
+    import threading
+
+    return {"lock": threading.Lock(), "last_sync": 0.0}
+
+
+def _mirror_journal_columns() -> Dict[str, str]:
+    """Journal columns (primary schema) with SQLite types for the mirror."""
+    def lite(pg_type: str) -> str:
+        # Generated columns are copied as plain values: keep only the base type.
+        t = pg_type.split()[0].upper()
+        if t == "DATE":
+            return "DATE"
+        if t in {"DOUBLE PRECISION", "REAL", "NUMERIC"}:
+            return "REAL"
+        if t in {"BIGINT", "INTEGER", "SMALLINT"}:
+            return "INTEGER"
+        return "TEXT"
+
+    return {col: lite(t) for col, t in _journal_expected_columns().items()}
+
+
+# Same read paths as the primary's indexes (see `init_db`).
+READ_MIRROR_INDEXES = [
+    *(
+        f"CREATE INDEX idx_journal_company_{col} ON journal(company_id, {col})"
+        for col in ("doc_date", "doc_type_id", "bank_account", "gl_code")
+    ),
+    "CREATE INDEX idx_counterparty_id ON journal(counterparty_id)",
+    "CREATE INDEX idx_journal_company_period ON journal(company_id, fiscal_year, period_month, "
+    "doc_type_id, doc_type, amount_net)",
+    "CREATE INDEX idx_journal_company_quarter ON journal(company_id, fiscal_year, period_quarter)",
+    "CREATE INDEX idx_journal_company_aging ON journal(company_id, status_id, doc_type_id, doc_date, "
+    "counterparty_id, counterparty, amount_net, vat_amount, amount_gross)",
+    "CREATE INDEX idx_journal_company_paid ON journal(company_id, doc_type_id, counterparty_id, doc_date, paid_date) "
+    "WHERE paid_date IS NOT NULL",
+]
+
+
+def _ensure_mirror_schema(mirror) -> Dict[str, str]:
+    """(Re)build the mirror when the journal schema, view or indexes changed; returns its meta."""
+    cols = _mirror_journal_columns()
+    signature = (
+        f"{JOURNAL_VIEW_REV}:" + ",".join(f"{c} {t}" for c, t in cols.items())
+        + ";" + ";".join(READ_MIRROR_INDEXES)
+    )
+    with mirror.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE IF NOT EXISTS mirror_meta (key TEXT PRIMARY KEY, value TEXT)")
+        meta = dict(conn.exec_driver_sql("SELECT key, value FROM mirror_meta").fetchall())
+        if meta.get("schema") == signature:
+            return meta
+        conn.exec_driver_sql("DROP VIEW IF EXISTS journal_v")
+        conn.exec_driver_sql("DROP TABLE IF EXISTS journal")
+        col_sql = ", ".join(f"{c} {t}" for c, t in cols.items())
+        conn.exec_driver_sql(f"CREATE TABLE journal (id INTEGER PRIMARY KEY, {col_sql}, change_seq INTEGER)")
+        for ddl in READ_MIRROR_INDEXES:
+            conn.exec_driver_sql(ddl)
+        conn.exec_driver_sql("DELETE FROM mirror_meta")
+        conn.exec_driver_sql("INSERT INTO mirror_meta (key, value) VALUES ('schema', ?)", (signature,))
+    return {"schema": signature}
+
+
+def _pull_mirror_changes(mirror, meta: Dict[str, str], data_version: int) -> None:
+    last_seq = int(meta.get("last_seq") or 0)
+    cols = list(_mirror_journal_columns())
+    select_sql = text(
+        f"SELECT id, {', '.join(cols)}, change_seq FROM journal "
+        "WHERE change_seq > :s ORDER BY change_seq LIMIT :n"
+    )
+    upsert_sql = (
+        f"INSERT OR REPLACE INTO journal (id, {', '.join(cols)}, change_seq) "
+        f"VALUES ({', '.join('?' for _ in range(len(cols) + 2))})"
+    )
+    since = max(0, last_seq - READ_MIRROR_LOOKBACK)
+    max_seq = last_seq
+    with ENGINE.connect() as src, mirror.begin() as dst:
+        while True:
+            rows = src.execute(select_sql, {"s": since, "n": READ_MIRROR_BATCH}).fetchall()
+            if not rows:
+                break
+            # Store dates the way the local SQLite schema does (ISO text).
+            dst.exec_driver_sql(
+                upsert_sql,
+                [tuple(v.isoformat() if isinstance(v, date) else v for v in r) for r in rows],
+            )
+            since = int(rows[-1][-1])
+            max_seq = max(max_seq, since)
+            if len(rows) < READ_MIRROR_BATCH:
+                break
+        deletions = src.execute(
+            text("SELECT id, change_seq FROM journal_deletions WHERE change_seq > :s"),
+            {"s": max(0, last_seq - READ_MIRROR_LOOKBACK)},
+        ).fetchall()
+        if deletions:
+            # Skip ids that were re-inserted after the delete (e.g. a snapshot restore).
+            dst.exec_driver_sql(
+                "DELETE FROM journal WHERE id = ? AND COALESCE(change_seq, 0) < ?",
+                [(int(i), int(s)) for i, s in deletions],
+            )
+            max_seq = max(max_seq, max(int(s) for _, s in deletions))
+        # Lookups are small: refresh them whole (the view is rebuilt on top of them).
+        dst.exec_driver_sql("DROP VIEW IF EXISTS journal_v")
+        for table in READ_MIRROR_LOOKUPS:
+            pd.read_sql_query(text(f"SELECT * FROM {table}"), src).to_sql(
+                table, dst, if_exists="replace", index=False
+            )
+        dst.exec_driver_sql(JOURNAL_VIEW_SQL)
+        dst.exec_driver_sql(
+            "INSERT OR REPLACE INTO mirror_meta (key, value) VALUES ('last_seq', ?), ('data_version', ?)",
+            (str(max_seq), str(data_version)),
+        )
+
+
+def _reconcile_mirror(mirror) -> int:
+    """Re-copy the mirror's journal id blocks that differ from the primary; returns how many."""
+    cols = list(_mirror_journal_columns())
+    select_sql = text(f"SELECT id, {', '.join(cols)}, change_seq FROM journal WHERE id >= :lo AND id < :hi")
+    insert_sql = (
+        f"INSERT OR REPLACE INTO journal (id, {', '.join(cols)}, change_seq) "
+        f"VALUES ({', '.join('?' for _ in range(len(cols) + 2))})"
+    )
+    with ENGINE.connect() as src, mirror.begin() as dst:
+        primary = {int(b): (int(n), int(s or 0)) for b, n, s in src.execute(text(READ_MIRROR_BLOCKS_SQL))}
+        local = {int(b): (int(n), int(s or 0)) for b, n, s in dst.exec_driver_sql(READ_MIRROR_BLOCKS_SQL)}
+        stale = sorted(b for b in primary.keys() | local.keys() if primary.get(b) != local.get(b))
+        for block in stale:
+            lo, hi = block * READ_MIRROR_BLOCK, (block + 1) * READ_MIRROR_BLOCK
+            rows = src.execute(select_sql, {"lo": lo, "hi": hi}).fetchall()
+            dst.exec_driver_sql("DELETE FROM journal WHERE id >= ? AND id < ?", (lo, hi))
+            if rows:
+                dst.exec_driver_sql(
+                    insert_sql, [tuple(v.isoformat() if isinstance(v, date) else v for v in r) for r in rows]
+                )
+        dst.exec_driver_sql(
+            "INSERT OR REPLACE INTO mirror_meta (key, value) VALUES ('reconciled_at', ?), ('lookback', ?)",
+            (str(time.time()), str(READ_MIRROR_LOOKBACK)),
+        )
+    return len(stale)
+
+
+def sync_read_mirror(data_version: int, force: bool = False) -> bool:
+    """Bring the read mirror up to date (when the data version moved or it is due).
+
+    Returns True when the mirror can serve this run's reads; on any error the caller
+    falls back to the primary database.
+    """
+    if not READ_MIRROR_FILE:
+        return False
+    state = _read_mirror_state()
+    mirror = _read_mirror_engine(READ_MIRROR_FILE)
+    with state["lock"]:
+        try:
+            meta = _ensure_mirror_schema(mirror)
+            due = time.monotonic() - state["last_sync"] >= max(1, READ_MIRROR_SYNC_SECONDS)
+            reconcile = meta.get("lookback") != str(READ_MIRROR_LOOKBACK) or (
+                READ_MIRROR_RECONCILE_SECONDS > 0
+                and time.time() - float(meta.get("reconciled_at") or 0) >= READ_MIRROR_RECONCILE_SECONDS
+            )
+            if force or due or reconcile or meta.get("data_version") != str(data_version):
+                _pull_mirror_changes(mirror, meta, data_version)
+                if reconcile:
+                    _reconcile_mirror(mirror)
+                state["last_sync"] = time.monotonic()
+            return True
+        except Exception:
+            return False
+
+
 def _counterparty_kind_for_doc_type(doc_type: str) -> str:
     dt = (doc_type or "").strip()
     if dt in {"Income", "Cash Deposit"}:
@@ -831,68 +1826,1187 @@ def _bank_kind_from_name(name: str) -> str:
     return "bank"
 
 
-def upsert_counterparty(name: str, kind: str) -> None:
+def _execute_on(conn: Optional[Connection], sql: str, params: Optional[Dict[str, Any]] = None) -> None:
+    """Execute on an open unit-of-work connection, or in its own (version-bumping) one."""
+    if conn is None:
+        with db_unit_of_work() as own:
+            own.execute(text(sql), params or {})
+    else:
+        conn.execute(text(sql), params or {})
+
+
+def upsert_counterparties(items: Iterable[tuple[str, str]], conn: Connection) -> None:
+    """Bulk variant of `upsert_counterparty` for (name, kind) pairs; one executemany."""
+    rows = {}
+    for name, kind in items:
+        nm = (name or "").strip()
+        if nm:
+            rows[nm] = {"company_id": COMPANY_ID, "name": nm, "kind": (kind or "other").strip() or "other"}
+    if not rows:
+        return
+    conn.execute(
+        text(
+            "INSERT INTO counterparties (company_id, name, kind) VALUES (:company_id, :name, :kind) "
+            "ON CONFLICT (company_id, name) DO UPDATE SET kind = EXCLUDED.kind"
+        ),
+        list(rows.values()),
+    )
+
+
+def upsert_bank_accounts(names: Iterable[str], conn: Connection) -> None:
+    """Bulk variant of `upsert_bank_account`; kind is inferred from the name."""
+    rows = {}
+    for name in names:
+        nm = (name or "").strip()
+        if nm:
+            rows[nm] = {"company_id": COMPANY_ID, "name": nm, "kind": _bank_kind_from_name(nm)}
+    if not rows:
+        return
+    conn.execute(
+        text(
+            "INSERT INTO bank_accounts (company_id, name, kind) VALUES (:company_id, :name, :kind) "
+            "ON CONFLICT (company_id, name) DO UPDATE SET kind = EXCLUDED.kind"
+        ),
+        list(rows.values()),
+    )
+
+
+def upsert_counterparty(name: str, kind: str, conn: Optional[Connection] = None) -> None:
     nm = (name or "").strip()
     kd = (kind or "other").strip() or "other"
     if not nm:
         return
     if DB_DIALECT == "postgres":
-        db_execute(
-            "INSERT INTO counterparties (name, kind) VALUES (:name, :kind) ON CONFLICT (name) DO UPDATE SET kind = EXCLUDED.kind",
-            {"name": nm, "kind": kd},
+        _execute_on(
+            conn,
+            "INSERT INTO counterparties (company_id, name, kind) VALUES (:company_id, :name, :kind) "
+            "ON CONFLICT (company_id, name) DO UPDATE SET kind = EXCLUDED.kind",
+            {"company_id": COMPANY_ID, "name": nm, "kind": kd},
         )
     else:
         # SQLite supports ON CONFLICT with DO UPDATE
-        db_execute(
-            "INSERT INTO counterparties (name, kind) VALUES (:name, :kind) ON CONFLICT(name) DO UPDATE SET kind=excluded.kind",
-            {"name": nm, "kind": kd},
+        _execute_on(
+            conn,
+            "INSERT INTO counterparties (company_id, name, kind) VALUES (:company_id, :name, :kind) "
+            "ON CONFLICT(company_id, name) DO UPDATE SET kind=excluded.kind",
+            {"company_id": COMPANY_ID, "name": nm, "kind": kd},
         )
 
 
-def upsert_bank_account(name: str, kind: str) -> None:
+def upsert_bank_account(name: str, kind: str, conn: Optional[Connection] = None) -> None:
     nm = (name or "").strip()
     kd = (kind or "bank").strip() or "bank"
     if not nm:
         return
     if DB_DIALECT == "postgres":
-        db_execute(
-            "INSERT INTO bank_accounts (name, kind) VALUES (:name, :kind) ON CONFLICT (name) DO UPDATE SET kind = EXCLUDED.kind",
-            {"name": nm, "kind": kd},
+        _execute_on(
+            conn,
+            "INSERT INTO bank_accounts (company_id, name, kind) VALUES (:company_id, :name, :kind) "
+            "ON CONFLICT (company_id, name) DO UPDATE SET kind = EXCLUDED.kind",
+            {"company_id": COMPANY_ID, "name": nm, "kind": kd},
         )
     else:
-        db_execute(
-            "INSERT INTO bank_accounts (name, kind) VALUES (:name, :kind) ON CONFLICT(name) DO UPDATE SET kind=excluded.kind",
-            {"name": nm, "kind": kd},
+        _execute_on(
+            conn,
+            "INSERT INTO bank_accounts (company_id, name, kind) VALUES (:company_id, :name, :kind) "
+            "ON CONFLICT(company_id, name) DO UPDATE SET kind=excluded.kind",
+            {"company_id": COMPANY_ID, "name": nm, "kind": kd},
         )
 
 
-def migrate_placeholders_to_lookups() -> None:
-    """Migrate legacy Settings 'placeholder' rows from journal into lookup tables.
+# The session company's partner id of `:counterparty` (names are unique per company).
+COUNTERPARTY_ID_SQL = "(SELECT id FROM counterparties WHERE company_id = :company_id AND name = TRIM(:counterparty))"
 
-    Older versions stored Customers/Suppliers/Bank accounts by inserting 0-amount rows
-    into `journal`. Those rows should not pollute the Archive.
+
+# `counterparty_id` resolves from the lookup at insert time; rows whose partner is not in
+# `counterparties` yet (e.g. plain imports) are linked later by `backfill_counterparty_ids`.
+# Enum ids resolve the same way (callers run `ensure_journal_enums` first).
+def normalize_doc_date(value: Any) -> Optional[str]:
+    """Journal date as ISO `YYYY-MM-DD` (None when blank); raises ValueError when invalid.
+
+    Year-first text (`_YEAR_FIRST_DATE_RE`) is read as such; other text is read day-first (dd/mm/yyyy).
     """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    raw = str(value).strip()
+    if not raw:
+        return None
+    year_first = _YEAR_FIRST_DATE_RE.match(raw)
     try:
-        df_cp = pd.read_sql_query(
-            """
-            SELECT DISTINCT counterparty AS name, doc_type
-            FROM journal
-            WHERE counterparty IS NOT NULL AND counterparty != ''
-              AND description = '(αρχικοποίηση)'
-              AND COALESCE(amount_net,0)=0 AND COALESCE(vat_amount,0)=0 AND COALESCE(amount_gross,0)=0
-            """,
-            ENGINE,
-        )
-        if not df_cp.empty:
-            for r in df_cp.itertuples(index=False):
-                upsert_counterparty(str(r.name), _counterparty_kind_for_doc_type(str(r.doc_type)))
-            db_execute(
-                """
-                DELETE FROM journal
-                WHERE description = '(αρχικοποίηση)'
-                  AND COALESCE(amount_net,0)=0 AND COALESCE(vat_amount,0)=0 AND COALESCE(amount_gross,0)=0
-                """
-            )
+        if year_first:
+            return date(*(int(part) for part in year_first.groups())).isoformat()
+        return pd.to_datetime(raw, dayfirst=True).date().isoformat()
+    except (ValueError, TypeError, OverflowError):
+        raise ValueError(f"Μη έγκυρη ημερομηνία: {raw}") from None
+
+
+def _ambiguous_doc_date(raw: str) -> bool:
+    """True for dd/mm vs mm/dd text such as 03/05/2024 (both parts 1-12 and different)."""
+    m = _DAY_FIRST_DATE_RE.match(raw.strip())
+    return bool(m) and m.group(1) != m.group(2) and int(m.group(1)) <= 12 and int(m.group(2)) <= 12
+
+
+def _journal_write_rows(rows: Iterable[Dict[str, Any]]) -> list[Dict[str, Any]]:
+    """Insert/update params with `doc_date` normalized (see `normalize_doc_date`), for the session company."""
+    return [{**r, "doc_date": normalize_doc_date(r.get("doc_date")), "company_id": COMPANY_ID} for r in rows]
+
+
+def _journal_insert_sql(extra: tuple = (), conflict_key: Optional[str] = None) -> str:
+    """Journal INSERT with :named params; `extra` columns are bound as-is (`:col`).
+
+    With `conflict_key` (columns of a unique index) rows whose key exists are skipped.
+    """
+    sql = f"""INSERT INTO journal (
+        company_id, doc_date, doc_no, doc_type, counterparty, description, gl_code,
+        amount_net, vat_amount, amount_gross, payment_method, bank_account, status,
+        counterparty_id, doc_type_id, status_id, payment_method_id{"".join(f", {c}" for c in extra)}
+    ) VALUES (
+        :company_id, :doc_date, :doc_no, {_enum_text_sql("doc_type")}, :counterparty, :description, :gl_code,
+        :amount_net, :vat_amount, :amount_gross, {_enum_text_sql("payment_method")}, :bank_account,
+        {_enum_text_sql("status")},
+        {COUNTERPARTY_ID_SQL},
+        {_enum_id_sql("doc_type")}, {_enum_id_sql("status")}, {_enum_id_sql("payment_method")}{"".join(f", :{c}" for c in extra)}
+    )"""
+    if conflict_key:
+        sql += f" ON CONFLICT ({conflict_key}) DO NOTHING"
+    return sql
+
+
+JOURNAL_INSERT_SQL = _journal_insert_sql()
+
+
+def save_journal_entry(row: Dict[str, Any]) -> None:
+    """Insert one journal row and keep the Settings lookups in sync, as one unit of work."""
+    with db_unit_of_work() as conn:
+        # Lookups first, so the insert can resolve `counterparty_id`.
+        upsert_counterparty(row.get("counterparty", ""), _counterparty_kind_for_doc_type(row.get("doc_type", "")), conn=conn)
+        bank = str(row.get("bank_account") or "").strip()
+        if bank:
+            upsert_bank_account(bank, _bank_kind_from_name(bank), conn=conn)
+        params = _journal_write_rows([row])[0]
+        assert_open_period(conn, rows=[params])
+        ensure_journal_enums([row], conn)
+        conn.execute(text(JOURNAL_INSERT_SQL), params)
+
+
+def save_journal_batch(rows: list[Dict[str, Any]], sql: str = JOURNAL_INSERT_SQL) -> int:
+    """Insert many journal rows (multi-row insert) + bulk lookup upserts, as one unit of work.
+
+    Returns the inserted row count (rows skipped by an ON CONFLICT `sql` are not counted).
+    """
+    if not rows:
+        return 0
+    rows = _journal_write_rows(rows)
+    with db_unit_of_work() as conn:
+        assert_open_period(conn, rows=rows)
+        upsert_counterparties(
+            ((r.get("counterparty", ""), _counterparty_kind_for_doc_type(r.get("doc_type", ""))) for r in rows),
+            conn,
+        )
+        upsert_bank_accounts((r.get("bank_account", "") for r in rows), conn)
+        ensure_journal_enums(rows, conn)
+        res = conn.execute(text(sql), rows)
+    return len(rows) if res.rowcount is None or res.rowcount < 0 else res.rowcount
+
+
+def _paid_date_sql(param: str = "status") -> str:
+    """SET expression for `paid_date` when the status becomes `:param`.
+
+    A row turning Paid gets today's date (kept while it stays Paid); any other status clears it.
+    Rows saved as Paid from the start have no known payment date and stay NULL.
+    """
+    paid = f"(SELECT id FROM {JOURNAL_ENUMS['status']} WHERE name = 'Paid')"
+    return (
+        f"CASE WHEN {_enum_id_sql('status', param)} = {paid} "
+        f"THEN COALESCE(paid_date, CASE WHEN status_id = {paid} THEN NULL ELSE CURRENT_DATE END) END"
+    )
+
+
+JOURNAL_UPDATE_SQL = f"""UPDATE journal SET
+        doc_date = :doc_date,
+        doc_no = :doc_no,
+        doc_type = {_enum_text_sql("doc_type")},
+        doc_type_id = {_enum_id_sql("doc_type")},
+        counterparty = :counterparty,
+        counterparty_id = {COUNTERPARTY_ID_SQL},
+        description = :description,
+        gl_code = :gl_code,
+        amount_net = :amount_net,
+        vat_amount = :vat_amount,
+        amount_gross = :amount_gross,
+        payment_method = {_enum_text_sql("payment_method")},
+        payment_method_id = {_enum_id_sql("payment_method")},
+        bank_account = :bank_account,
+        paid_date = {_paid_date_sql()},
+        status = {_enum_text_sql("status")},
+        status_id = {_enum_id_sql("status")}
+    WHERE id = :id AND company_id = :company_id"""
+
+
+def _same_value(a: Any, b: Any) -> bool:
+    if isinstance(a, (int, float)) or isinstance(b, (int, float)):
+        try:
+            return round(float(a or 0), 2) == round(float(b or 0), 2)
+        except (TypeError, ValueError):
+            return False
+    return str(a if a is not None else "").strip() == str(b if b is not None else "").strip()
+
+
+def update_journal_entry(row: Dict[str, Any]) -> None:
+    """Update one journal row (by `row['id']`), as one unit of work.
+
+    A row dated in a closed month can still be settled (status / account / payment method).
+    """
+    params = _journal_write_rows([row])[0]
+    with db_unit_of_work() as conn:
+        stored = conn.execute(
+            text(
+                f"SELECT {', '.join(JOURNAL_LOCKED_COLUMNS + JOURNAL_SETTLEMENT_COLUMNS)} FROM journal_v "
+                "WHERE id = :id AND company_id = :company_id"
+            ),
+            {"id": row["id"], "company_id": COMPANY_ID},
+        ).mappings().first()
+        if stored is None or any(not _same_value(stored[c], params.get(c)) for c in JOURNAL_LOCKED_COLUMNS):
+            # Both the stored date and the new one must be in an open period.
+            assert_open_period(conn, rows=[params], ids=[row["id"]])
+        new_status = str(params.get("status") or "").strip()
+        if stored is not None and any(
+            not _same_value(stored[c], params.get(c)) for c in ("status", "bank_account", "payment_method")
+        ):
+            paying = new_status == "Paid" and not _same_value(stored["status"], "Paid")
+            assert_open_settlement(conn, ids=[row["id"]], paid_dates=[date.today().isoformat()] if paying else ())
+            _amend_closed_status(conn, [row["id"]], new_status)
+        ensure_counterparty(row.get("counterparty", ""), _counterparty_kind_for_doc_type(row.get("doc_type", "")), conn)
+        ensure_journal_enums([row], conn)
+        conn.execute(text(JOURNAL_UPDATE_SQL), params)
+
+
+def ensure_counterparty(name: str, kind: str, conn: Connection) -> None:
+    """Insert the partner if missing (never changes the kind of an existing one)."""
+    nm = (name or "").strip()
+    if nm:
+        conn.execute(
+            text(
+                "INSERT INTO counterparties (company_id, name, kind) VALUES (:company_id, :name, :kind) "
+                "ON CONFLICT (company_id, name) DO NOTHING"
+            ),
+            {"company_id": COMPANY_ID, "name": nm, "kind": (kind or "other").strip() or "other"},
+        )
+
+
+COUNTERPARTY_BY_NAME_SQL = "SELECT id FROM counterparties WHERE company_id = :company_id AND name = :n"
+
+
+def rename_counterparty(old: str, new: str, kind: str) -> None:
+    """Rename (or merge into an existing partner) via the surrogate key.
+
+    A plain rename is a single-row update of `counterparties`; journal rows follow
+    through `counterparty_id`. Merging repoints rows on the integer index only.
+    """
+    old_nm, new_nm = (old or "").strip(), (new or "").strip()
+    with db_unit_of_work() as conn:
+        old_id = conn.execute(text(COUNTERPARTY_BY_NAME_SQL), {"company_id": COMPANY_ID, "n": old_nm}).scalar()
+        if old_nm != new_nm:
+            new_id = conn.execute(text(COUNTERPARTY_BY_NAME_SQL), {"company_id": COMPANY_ID, "n": new_nm}).scalar()
+            if old_id is not None and new_id is None:
+                conn.execute(text("UPDATE counterparties SET name = :nn WHERE id = :id"), {"nn": new_nm, "id": old_id})
+            elif old_id is not None:
+                conn.execute(
+                    text("UPDATE journal SET counterparty_id = :keep WHERE counterparty_id = :drop"),
+                    {"keep": new_id, "drop": old_id},
+                )
+                conn.execute(text("DELETE FROM counterparties WHERE id = :id"), {"id": old_id})
+            rename_snapshot_name("counterparty", old_nm, new_nm, conn)
+            # Rows not linked yet still carry the name as text.
+            conn.execute(
+                text(
+                    "UPDATE journal SET counterparty = :nn "
+                    "WHERE company_id = :company_id AND counterparty_id IS NULL AND counterparty = :old"
+                ),
+                {"company_id": COMPANY_ID, "nn": new_nm, "old": old_nm},
+            )
+        upsert_counterparty(new_nm, kind, conn=conn)
+
+
+def delete_counterparty(name: str) -> None:
+    """Remove a partner from the lookup; its journal rows keep the current name as text."""
+    nm = (name or "").strip()
+    with db_unit_of_work() as conn:
+        cid = conn.execute(text(COUNTERPARTY_BY_NAME_SQL), {"company_id": COMPANY_ID, "n": nm}).scalar()
+        if cid is not None:
+            conn.execute(
+                text("UPDATE journal SET counterparty = :n, counterparty_id = NULL WHERE counterparty_id = :id"),
+                {"n": nm, "id": cid},
+            )
+        conn.execute(
+            text("DELETE FROM counterparties WHERE company_id = :company_id AND name = :n"), {"company_id": COMPANY_ID, "n": nm}
+        )
+
+
+def rename_bank_account(old: str, new: str, kind: str) -> None:
+    """Rename (or merge into an existing account) in one transaction.
+
+    Journal rows, statement lines, the lookup and the frozen `period_snapshots` names move
+    together, so a failure leaves none of them pointing at a name the others no longer use.
+    """
+    old_nm, new_nm = (old or "").strip(), (new or "").strip()
+    rename = {"company_id": COMPANY_ID, "nn": new_nm, "old": old_nm}
+    with db_unit_of_work() as conn:
+        if old_nm != new_nm:
+            for table in ("journal", "bank_statement_lines"):
+                conn.execute(
+                    text(f"UPDATE {table} SET bank_account = :nn WHERE company_id = :company_id AND bank_account = :old"),
+                    rename,
+                )
+            conn.execute(text("DELETE FROM bank_accounts WHERE company_id = :company_id AND name = :old"), rename)
+            rename_snapshot_name("account", old_nm, new_nm, conn)
+        upsert_bank_account(new_nm, kind, conn=conn)
+
+
+# Keeps each IN (...) list well below driver/SQLite bound-parameter limits.
+BULK_ID_CHUNK = 500
+BULK_EDITABLE_COLUMNS = ("status", "bank_account", "gl_code")
+
+
+def _id_chunks(ids: Iterable[int]) -> Iterator[Dict[str, int]]:
+    uniq = sorted({int(i) for i in ids})
+    for start in range(0, len(uniq), BULK_ID_CHUNK):
+        yield {f"id{i}": rid for i, rid in enumerate(uniq[start:start + BULK_ID_CHUNK])}
+
+
+def bulk_update_journal(ids: Iterable[int], changes: Dict[str, Any]) -> int:
+    """Set-based `UPDATE journal ... WHERE id IN (...)` for many rows, as one unit of work.
+
+    Only columns in `BULK_EDITABLE_COLUMNS` can be changed. Returns the number of updated rows.
+    """
+    cols = [c for c in changes if c in BULK_EDITABLE_COLUMNS]
+    if not cols:
+        return 0
+    set_sql = ", ".join(
+        f"{c} = {_enum_text_sql(c, f'set_{c}')}, {c}_id = {_enum_id_sql(c, f'set_{c}')}"
+        if c in JOURNAL_ENUMS
+        else f"{c} = :set_{c}"
+        for c in cols
+    )
+    if "status" in cols:
+        set_sql += f", paid_date = {_paid_date_sql('set_status')}"
+    set_params = {f"set_{c}": changes[c] for c in cols}
+    ids = list(ids)
+    updated = 0
+    with db_unit_of_work() as conn:
+        # The GL code is locked in closed months; status / account are settlement fields.
+        if "gl_code" in cols:
+            assert_open_period(conn, ids=ids)
+        if "status" in cols or "bank_account" in cols:
+            paying = "status" in cols and str(changes["status"] or "").strip() == "Paid"
+            assert_open_settlement(conn, ids=ids, paid_dates=[date.today().isoformat()] if paying else ())
+        if "status" in cols:
+            _amend_closed_status(conn, ids, str(changes["status"] or ""))
+        ensure_journal_enums([{c: changes[c] for c in cols if c in JOURNAL_ENUMS}], conn)
+        for params in _id_chunks(ids):
+            placeholders = ", ".join(f":{k}" for k in params)
+            res = conn.execute(
+                text(f"UPDATE journal SET {set_sql} WHERE company_id = :company_id AND id IN ({placeholders})"),
+                {**params, **set_params, "company_id": COMPANY_ID},
+            )
+            updated += res.rowcount or 0
+        if "bank_account" in cols:
+            upsert_bank_accounts([str(changes["bank_account"] or "")], conn)
+    return updated
+
+
+def bulk_delete_journal(ids: Iterable[int]) -> int:
+    """Set-based `DELETE ... WHERE id IN (...)`, as one unit of work. Returns deleted rows."""
+    ids = list(ids)
+    deleted = 0
+    with db_unit_of_work() as conn:
+        assert_open_period(conn, ids=ids)
+        for params in _id_chunks(ids):
+            placeholders = ", ".join(f":{k}" for k in params)
+            # A deleted recurring occurrence is skipped from then on (see `pending_recurring`).
+            conn.execute(
+                text(
+                    "INSERT INTO recurring_skips (company_id, recurring_key) SELECT company_id, recurring_key "
+                    f"FROM journal WHERE company_id = :company_id AND id IN ({placeholders}) "
+                    "AND recurring_key IS NOT NULL ON CONFLICT (company_id, recurring_key) DO NOTHING"
+                ),
+                {**params, "company_id": COMPANY_ID},
+            )
+            res = conn.execute(
+                text(f"DELETE FROM journal WHERE company_id = :company_id AND id IN ({placeholders})"),
+                {**params, "company_id": COMPANY_ID},
+            )
+            deleted += res.rowcount or 0
+    return deleted
+
+
+def _gl_code_map(df: pd.DataFrame) -> Dict[str, str]:
+    """{code: description} of a GL editor frame; blank codes are ignored, duplicates rejected."""
+    out: Dict[str, str] = {}
+    if df is None or df.empty:
+        return out
+    codes = df.get("code", pd.Series(dtype=object)).fillna("").astype(str).str.strip()
+    descs = df.get("description", pd.Series(dtype=object)).fillna("").astype(str).str.strip()
+    for code, desc in zip(codes, descs):
+        if not code:
+            continue
+        if code in out:
+            raise ValueError(f"Ο κωδικός GL {code} εμφανίζεται περισσότερες από μία φορές.")
+        out[code] = desc
+    return out
+
+
+def diff_gl_codes(original: pd.DataFrame, edited: pd.DataFrame) -> Dict[str, list]:
+    """Compare the GL editor state with the loaded frame.
+
+    Returns `insert` / `update` rows ({code, description}) and `delete` codes. Editing a
+    code cell counts as delete of the old code + insert of the new one.
+    """
+    before, after = _gl_code_map(original), _gl_code_map(edited)
+    return {
+        "insert": [{"code": c, "description": d} for c, d in after.items() if c not in before],
+        "update": [{"code": c, "description": d} for c, d in after.items() if c in before and before[c] != d],
+        "delete": sorted(c for c in before if c not in after),
+    }
+
+
+GL_CODE_UPSERT_SQL = """INSERT INTO gl_codes (company_id, code, description) VALUES (:company_id, :code, :description)
+    ON CONFLICT (company_id, code) DO UPDATE SET description = EXCLUDED.description"""
+
+
+def save_gl_codes_diff(original: pd.DataFrame, edited: pd.DataFrame) -> Dict[str, int]:
+    """Apply only the GL changes made in the editor, as one unit of work.
+
+    Raises ValueError (nothing is written) if a removed code is still used by `journal.gl_code`.
+    Returns the number of inserted/updated/deleted codes.
+    """
+    diff = diff_gl_codes(original, edited)
+    counts = {k: len(v) for k, v in diff.items()}
+    if not any(counts.values()):
+        return counts
+    company = {"company_id": COMPANY_ID}
+    with db_unit_of_work() as conn:
+        deletes = diff["delete"]
+        for start in range(0, len(deletes), BULK_ID_CHUNK):
+            params = {**company, **{f"c{i}": c for i, c in enumerate(deletes[start:start + BULK_ID_CHUNK])}}
+            placeholders = ", ".join(f":{k}" for k in params if k != "company_id")
+            used = conn.execute(
+                text(f"SELECT DISTINCT gl_code FROM journal WHERE company_id = :company_id AND gl_code IN ({placeholders})"),
+                params,
+            ).scalars().all()
+            if used:
+                raise ValueError(
+                    "Δεν διαγράφονται κωδικοί GL που χρησιμοποιούνται σε εγγραφές: " + ", ".join(sorted(used))
+                )
+            conn.execute(text(f"DELETE FROM gl_codes WHERE company_id = :company_id AND code IN ({placeholders})"), params)
+        if diff["update"]:
+            conn.execute(
+                text("UPDATE gl_codes SET description = :description WHERE company_id = :company_id AND code = :code"),
+                [{**company, **r} for r in diff["update"]],
+            )
+        if diff["insert"]:
+            # A code added meanwhile by another session is overwritten, not a PK error.
+            conn.execute(text(GL_CODE_UPSERT_SQL), [{**company, **r} for r in diff["insert"]])
+    return counts
+
+
+# --- Journal export (streamed from SQL in chunks to a temp file) ---
+EXPORT_CHUNK_ROWS = 5000
+XLSX_MAX_ROWS = 1_048_576
+# (journal_v column, header, cell kind)
+EXPORT_COLUMNS = [
+    ("doc_date", "Ημερ/νία", "date"),
+    ("doc_no", "Αρ. Παρ/κου", "text"),
+    ("doc_type", "Τύπος", "text"),
+    ("counterparty", "Συναλλασσόμενος", "text"),
+    ("description", "Περιγραφή", "text"),
+    ("gl_code", "GL", "text"),
+    ("amount_net", "Καθαρό", "money"),
+    ("vat_amount", "ΦΠΑ", "money"),
+    ("amount_gross", "Σύνολο", "money"),
+    ("payment_method", "Πληρωμή", "text"),
+    ("bank_account", "Λογαριασμός", "text"),
+    ("status", "Κατάσταση", "text"),
+]
+EXPORT_ORDER_BY = {
+    "Πιο Πρόσφατες": "doc_date DESC, id DESC",
+    "Πιο Παλιές": "doc_date ASC, id ASC",
+    "Μεγαλύτερα Ποσά": "amount_gross DESC, id DESC",
+    "Μικρότερα Ποσά": "amount_gross ASC, id ASC",
+}
+# Archive search: case-insensitive plain substring (no wildcards, no regex) in these columns,
+# applied the same way in pandas (`journal_search_mask`) and SQL (`journal_export_query`).
+SEARCH_COLUMNS = ("counterparty", "description", "doc_no")
+SEARCH_FOLD_SQL = {"sqlite": "search_fold({col})", "postgres": "TRANSLATE(LOWER({col}), 'ς', 'σ')"}
+
+
+def journal_search_mask(df: pd.DataFrame, term: str) -> pd.Series:
+    """Rows of `df` whose `SEARCH_COLUMNS` contain `term` (see `_search_fold_text`)."""
+    needle = _search_fold_text(str(term))
+    mask = pd.Series(False, index=df.index)
+    for col in SEARCH_COLUMNS:
+        mask |= df[col].fillna("").astype(str).map(_search_fold_text).str.contains(needle, regex=False)
+    return mask
+
+
+def journal_export_query(filters: Optional[Dict[str, Any]] = None) -> tuple[str, Dict[str, Any]]:
+    """SELECT over `journal_v` for the given filters (same keys/semantics as the Archive filters).
+
+    Supported keys: date_from, date_to, amount_min, amount_max, doc_types, search, sort_by.
+    Rows of the session company only.
+    """
+    f = filters or {}
+    where, params = ["company_id = :company_id"], {"company_id": COMPANY_ID}
+    if f.get("date_from"):
+        where.append("doc_date >= :date_from")
+        params["date_from"] = pd.Timestamp(f["date_from"]).strftime("%Y-%m-%d")
+    if f.get("date_to"):
+        # Half-open range so SQLite dates stored with a time part are still included.
+        where.append("doc_date < :date_to")
+        params["date_to"] = (pd.Timestamp(f["date_to"]) + pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+    if f.get("amount_min") is not None:
+        where.append("COALESCE(amount_gross, 0) >= :amount_min")
+        params["amount_min"] = float(f["amount_min"])
+    if f.get("amount_max") is not None:
+        where.append("COALESCE(amount_gross, 0) <= :amount_max")
+        params["amount_max"] = float(f["amount_max"])
+    if f.get("doc_types") is not None:
+        types = [str(t) for t in f["doc_types"]]
+        if not types:
+            where.append("1 = 0")
+        else:
+            params.update({f"dt{i}": t for i, t in enumerate(types)})
+            where.append("TRIM(doc_type) IN (" + ", ".join(f":dt{i}" for i in range(len(types))) + ")")
+    if f.get("search"):
+        fold = SEARCH_FOLD_SQL["sqlite" if READ_ENGINE.dialect.name == "sqlite" else "postgres"]
+        where.append(
+            "(" + " OR ".join(f"{fold.format(col=c)} LIKE :q ESCAPE '\\'" for c in SEARCH_COLUMNS) + ")"
+        )
+        needle = _search_fold_text(str(f["search"]))
+        params["q"] = "%" + needle.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    cols = ", ".join(c for c, _, _ in EXPORT_COLUMNS)
+    sql = f"SELECT {cols} FROM journal_v WHERE " + " AND ".join(where)
+    sql += " ORDER BY " + EXPORT_ORDER_BY.get(f.get("sort_by"), "doc_date ASC, id ASC")
+    return sql, params
+
+
+def iter_export_chunks(sql: str, params: Dict[str, Any], chunksize: int = EXPORT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Yield typed export frames; `stream_results` uses a server-side cursor on Postgres."""
+    with READ_ENGINE.connect().execution_options(stream_results=True) as conn:
+        for chunk in pd.read_sql_query(text(sql), conn, params=params, chunksize=chunksize):
+            for col, _, kind in EXPORT_COLUMNS:
+                if kind == "date":
+                    chunk[col] = pd.to_datetime(chunk[col], errors="coerce")
+                elif kind == "money":
+                    chunk[col] = pd.to_numeric(chunk[col], errors="coerce").fillna(0.0).round(2)
+                else:
+                    chunk[col] = chunk[col].fillna("").astype(str).str.strip()
+            yield chunk
+
+
+def _write_export_csv(chunks: Iterable[pd.DataFrame], path: str) -> int:
+    rows = 0
+    headers = [h for _, h, _ in EXPORT_COLUMNS]
+    # utf-8-sig: Excel opens the Greek headers correctly.
+    with open(path, "w", encoding="utf-8-sig", newline="") as fh:
+        for chunk in chunks:
+            chunk.to_csv(fh, header=headers if rows == 0 else False, index=False, date_format="%Y-%m-%d")
+            rows += len(chunk)
+        if rows == 0:
+            pd.DataFrame(columns=headers).to_csv(fh, index=False)
+    return rows
+
+
+def _write_export_xlsx(chunks: Iterable[pd.DataFrame], path: str) -> int:
+    """xlsxwriter `constant_memory`: rows are flushed as written, so memory stays flat."""
+    import xlsxwriter
+
+    wb = xlsxwriter.Workbook(path, {"constant_memory": True})
+    fmt_header = wb.add_format({"bold": True, "bg_color": "#E8EEF7", "border": 1})
+    fmt_date = wb.add_format({"num_format": "dd/mm/yyyy"})
+    fmt_money = wb.add_format({"num_format": "#,##0.00"})
+    widths = {"date": 12, "money": 14, "text": 22}
+
+    def new_sheet(n: int):
+        ws = wb.add_worksheet("Ημερολόγιο" if n == 1 else f"Ημερολόγιο ({n})")
+        for c, (_, header, kind) in enumerate(EXPORT_COLUMNS):
+            ws.set_column(c, c, widths[kind])
+            ws.write_string(0, c, header, fmt_header)
+        ws.freeze_panes(1, 0)
+        return ws
+
+    sheets = 1
+    ws = new_sheet(sheets)
+    r = 1
+    rows = 0
+    try:
+        for chunk in chunks:
+            for values in chunk.itertuples(index=False, name=None):
+                if r >= XLSX_MAX_ROWS:
+                    sheets += 1
+                    ws = new_sheet(sheets)
+                    r = 1
+                for c, ((_, _, kind), v) in enumerate(zip(EXPORT_COLUMNS, values)):
+                    if kind == "money":
+                        ws.write_number(r, c, float(v), fmt_money)
+                    elif kind == "date":
+                        if pd.isna(v):
+                            ws.write_blank(r, c, None)
+                        else:
+                            ws.write_datetime(r, c, v.to_pydatetime(), fmt_date)
+                    else:
+                        # write_string: text starting with '=' is never treated as a formula.
+                        ws.write_string(r, c, v)
+                r += 1
+                rows += 1
+    finally:
+        wb.close()
+    return rows
+
+
+def export_journal(filters: Optional[Dict[str, Any]] = None, fmt: str = "xlsx") -> str:
+    """Stream the (filtered) journal to a temp .csv/.xlsx file and return its path."""
+    import tempfile
+
+    fd, path = tempfile.mkstemp(prefix="erp_export_", suffix=f".{fmt}")
+    os.close(fd)
+    sql, params = journal_export_query(filters)
+    chunks = iter_export_chunks(sql, params)
+    try:
+        if fmt == "csv":
+            _write_export_csv(chunks, path)
+        else:
+            _write_export_xlsx(chunks, path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def _read_and_remove(path: str) -> bytes:
+    """A temp export's bytes; the file is deleted. (Streamlit reads download data whole and
+    never closes a returned file object, so bytes are returned rather than a handle.)"""
+    try:
+        with open(path, "rb") as fh:
+            return fh.read()
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def journal_export_download(filters: Optional[Dict[str, Any]] = None, fmt: str = "xlsx"):
+    """Deferred `st.download_button` data: the export runs only when the button is clicked,
+    on Streamlit's download thread rather than in the page script."""
+    def _build():
+        return _read_and_remove(export_journal(filters, fmt))
+
+    return _build
+
+
+# --- Parquet snapshot (journal + lookups) for analytics / disaster recovery ---
+SNAPSHOT_FORMAT = "erp-finance-snapshot"
+# v2 added `paid_date`, `recurring_key`, `import_source` / `import_fingerprint` and the
+# `recurring_skips`; v3 the closed books (`closed_through` in the manifest, `period_snapshots`)
+# and `recurring_templates`. Older snapshots still load, with those parts empty (books open).
+SNAPSHOT_VERSION = 3
+SNAPSHOT_BATCH_ROWS = 50_000
+SNAPSHOT_LOOKUPS = {
+    "gl_codes": ["code", "description"],
+    "counterparties": ["name", "kind"],
+    "bank_accounts": ["name", "kind"],
+    "recurring_skips": ["recurring_key"],
+    **{table: ["name"] for table in JOURNAL_ENUMS.values()},
+}
+# Company tables kept with their own column types: columns, date columns, integer columns.
+SNAPSHOT_TABLES = {
+    "period_snapshots": (
+        [
+            "fiscal_year", "period_month", "kind", "name", "doc_type", "status",
+            "n", "amount_net", "vat_amount", "amount_gross", "last_date",
+        ],
+        ["last_date"],
+        ["fiscal_year", "period_month", "n"],
+    ),
+    "recurring_templates": (
+        [
+            "id", "active", "description", "doc_type", "counterparty", "gl_code", "amount_net", "vat_rate",
+            "bank_account", "status", "frequency", "day_of_month", "start_date", "end_date",
+        ],
+        ["start_date", "end_date"],
+        ["id", "active", "day_of_month"],
+    ),
+}
+SNAPSHOT_AMOUNTS = ["amount_net", "vat_amount", "amount_gross"]
+SNAPSHOT_CATEGORIES = ["doc_type", "counterparty", "gl_code", "payment_method", "bank_account", "status"]
+# Written as-is; kept on restore so recurring periods and Excel re-imports are not duplicated.
+SNAPSHOT_KEYS = ["recurring_key", "import_source", "import_fingerprint"]
+# A snapshot holds one company (the lookups are filtered on `company_id` as well).
+SNAPSHOT_JOURNAL_SQL = (
+    "SELECT v.id, v.doc_date, v.doc_no, v.doc_type, v.counterparty, v.description, v.gl_code, "
+    "v.amount_net, v.vat_amount, v.amount_gross, v.payment_method, v.bank_account, v.status, v.paid_date, "
+    "j.recurring_key, j.import_source, j.import_fingerprint "
+    "FROM journal_v v JOIN journal j ON j.id = v.id WHERE v.company_id = :company_id ORDER BY v.id"
+)
+# Target columns of the bulk load (ids resolved against the lookups of the target DB).
+SNAPSHOT_LOAD_COLUMNS = [
+    "id", "company_id", "doc_date", "doc_no", "doc_type", "counterparty", "description", "gl_code",
+    "amount_net", "vat_amount", "amount_gross", "payment_method", "bank_account", "status",
+    "counterparty_id", "doc_type_id", "status_id", "payment_method_id", "paid_date", *SNAPSHOT_KEYS,
+]
+
+
+def _snapshot_schema():
+    import pyarrow as pa
+
+    cat = pa.dictionary(pa.int32(), pa.string())
+    fields = [("id", pa.int64()), ("doc_date", pa.date32()), ("doc_no", pa.string())]
+    fields += [(c, cat) for c in ("doc_type", "counterparty")]
+    fields += [("description", pa.string()), ("gl_code", cat)]
+    fields += [(f"{a}_cents", pa.int64()) for a in SNAPSHOT_AMOUNTS]
+    fields += [(c, cat) for c in ("payment_method", "bank_account", "status")]
+    fields += [("paid_date", pa.date32())]
+    fields += [(c, pa.string()) for c in SNAPSHOT_KEYS]
+    return pa.schema(fields)
+
+
+def _snapshot_journal_table(chunk: pd.DataFrame, schema):
+    """journal_v chunk -> Arrow table: date32, integer cents, dictionary-encoded categories."""
+    import pyarrow as pa
+
+    def strings(col):
+        s = chunk[col].astype(object)
+        return pa.array(s.where(s.notna(), None), type=pa.string())
+
+    def dates(col):
+        values = pd.to_datetime(chunk[col], errors="coerce").dt.normalize()
+        return pa.array(values, from_pandas=True).cast(pa.date32())
+
+    columns = {
+        "id": pa.array(chunk["id"].astype("int64")),
+        "doc_date": dates("doc_date"),
+        "doc_no": strings("doc_no"),
+        "description": strings("description"),
+        "paid_date": dates("paid_date"),
+        **{c: strings(c) for c in SNAPSHOT_KEYS},
+    }
+    for a in SNAPSHOT_AMOUNTS:
+        cents = (pd.to_numeric(chunk[a], errors="coerce").fillna(0.0) * 100).round().astype("int64")
+        columns[f"{a}_cents"] = pa.array(cents)
+    for c in SNAPSHOT_CATEGORIES:
+        columns[c] = strings(c).dictionary_encode()
+    return pa.Table.from_arrays([columns[f.name] for f in schema], schema=schema)
+
+
+def _write_snapshot_journal(path: str, engine, company_id: int) -> int:
+    """Stream one company's `journal_v` rows from `engine` into one Parquet file; returns the row count."""
+    import pyarrow.parquet as pq
+
+    rows = 0
+    schema = _snapshot_schema()
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        with engine.connect().execution_options(stream_results=True) as conn:
+            for chunk in pd.read_sql_query(
+                text(SNAPSHOT_JOURNAL_SQL), conn, params={"company_id": company_id}, chunksize=SNAPSHOT_BATCH_ROWS
+            ):
+                writer.write_table(_snapshot_journal_table(chunk, schema))
+                rows += len(chunk)
+    return rows
+
+
+def export_snapshot() -> str:
+    """Write the session company's journal, lookups, recurring templates and closed books
+    (`period_snapshots`, `closed_through`) as Parquet files in one zip; returns the zip path.
+
+    The journal is streamed in `SNAPSHOT_BATCH_ROWS` row groups, so memory stays flat.
+    """
+    import json
+    import shutil
+    import tempfile
+    import zipfile
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    workdir = tempfile.mkdtemp(prefix="erp_snapshot_")
+    try:
+        counts = {"journal": _write_snapshot_journal(os.path.join(workdir, "journal.parquet"), ENGINE, COMPANY_ID)}
+        for table, cols in SNAPSHOT_LOOKUPS.items():
+            where = " WHERE company_id = :company_id" if table in COMPANY_TABLES else ""
+            df = pd.read_sql_query(
+                text(f"SELECT {', '.join(cols)} FROM {table}{where} ORDER BY {cols[0]}"),
+                ENGINE,
+                params={"company_id": COMPANY_ID},
+            )
+            arrow = pa.Table.from_arrays(
+                [pa.array(df[c].astype(object), type=pa.string()) for c in cols], names=cols
+            )
+            pq.write_table(arrow, os.path.join(workdir, f"{table}.parquet"), compression="zstd")
+            counts[table] = len(df)
+        for table, (cols, dates, ints) in SNAPSHOT_TABLES.items():
+            df = pd.read_sql_query(
+                text(f"SELECT {', '.join(cols)} FROM {table} WHERE company_id = :company_id ORDER BY {cols[0]}"),
+                ENGINE,
+                params={"company_id": COMPANY_ID},
+            )
+            for c in dates:
+                df[c] = pd.to_datetime(df[c], errors="coerce").dt.date
+            df = df.astype({c: "Int64" for c in ints})
+            pq.write_table(
+                pa.Table.from_pandas(df, preserve_index=False), os.path.join(workdir, f"{table}.parquet"),
+                compression="zstd",
+            )
+            counts[table] = len(df)
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "dialect": DB_DIALECT,
+            "company": COMPANIES.get(COMPANY_ID),
+            "closed_through": get_closed_through(),
+            "rows": counts,
+        }
+        fd, zip_path = tempfile.mkstemp(prefix="erp_snapshot_", suffix=".zip")
+        os.close(fd)
+        # Parquet is already compressed: store the members as-is.
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as zf:
+            zf.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+            for table in counts:
+                zf.write(os.path.join(workdir, f"{table}.parquet"), f"{table}.parquet")
+        return zip_path
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def snapshot_download():
+    """Deferred `st.download_button` data for `export_snapshot` (see `journal_export_download`)."""
+    def _build():
+        return _read_and_remove(export_snapshot())
+
+    return _build
+
+
+def _remap_recurring_keys(keys: pd.Series, template_ids: Dict[int, int]) -> pd.Series:
+    """'<template id>:<YYYY-MM>' keys onto the ids the templates got on restore.
+
+    Keys of templates not in the snapshot (deleted ones) become NULL: their ids could be
+    reused by a new template in the target database, which would then skip those months.
+    """
+    keys = keys.astype(object)
+    parts = keys.str.split(":", n=1)
+    new_ids = pd.to_numeric(parts.str[0], errors="coerce").map(template_ids)
+    remapped = new_ids.map(lambda v: "" if pd.isna(v) else str(int(v))) + ":" + parts.str[1].fillna("")
+    return remapped.where(new_ids.notna(), None)
+
+
+def _snapshot_load_frame(
+    df: pd.DataFrame,
+    counterparty_ids: Dict[str, int],
+    enum_ids: Dict[str, Dict[str, int]],
+    company_id: int,
+    template_ids: Optional[Dict[int, int]] = None,
+) -> pd.DataFrame:
+    """Snapshot batch -> rows in `SNAPSHOT_LOAD_COLUMNS` order, with FK/enum ids resolved.
+
+    Columns a v1 snapshot lacks (`paid_date`, `SNAPSHOT_KEYS`) are loaded as NULL; recurring
+    keys follow the restored template ids (`template_ids`).
+    """
+    out = pd.DataFrame({"id": df["id"].astype("int64"), "company_id": company_id})
+    for c in ("doc_date", "paid_date"):
+        out[c] = pd.to_datetime(df[c], errors="coerce").dt.strftime("%Y-%m-%d") if c in df else None
+    for c in ("doc_no", "counterparty", "description", "gl_code", "bank_account"):
+        out[c] = df[c].astype(object)
+    for c in SNAPSHOT_KEYS:
+        out[c] = df[c].astype(object) if c in df else None
+    out["recurring_key"] = _remap_recurring_keys(out["recurring_key"], template_ids or {})
+    for a in SNAPSHOT_AMOUNTS:
+        out[a] = df[f"{a}_cents"].astype("int64") / 100.0
+    out["counterparty_id"] = out["counterparty"].str.strip().map(counterparty_ids).astype("Int64")
+    for col in JOURNAL_ENUMS:
+        values = df[col].astype(object)
+        ids = values.map(enum_ids[col]).astype("Int64")
+        out[f"{col}_id"] = ids
+        out[col] = values.where(ids.isna(), None)
+    out = out[SNAPSHOT_LOAD_COLUMNS].astype(object)
+    return out.where(out.notna(), None)
+
+
+def _bulk_load_journal(conn: Connection, frame: pd.DataFrame) -> None:
+    cols = ", ".join(frame.columns)
+    if DB_DIALECT == "postgres":
+        import io
+
+        buf = io.StringIO()
+        frame.to_csv(buf, index=False, header=False, na_rep="\\N")
+        buf.seek(0)
+        copy_sql = f"COPY journal ({cols}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+        cur = conn.connection.cursor()
+        try:
+            if hasattr(cur, "copy_expert"):  # psycopg2
+                cur.copy_expert(copy_sql, buf)
+            else:  # psycopg 3
+                with cur.copy(copy_sql) as copy:
+                    copy.write(buf.getvalue())
+        finally:
+            cur.close()
+    else:
+        placeholders = ", ".join("?" for _ in frame.columns)
+        conn.exec_driver_sql(
+            f"INSERT INTO journal ({cols}) VALUES ({placeholders})",
+            list(frame.itertuples(index=False, name=None)),
+        )
+
+
+def _journal_secondary_indexes(conn: Connection) -> list[tuple[str, str]]:
+    """(name, CREATE statement) of the journal's secondary indexes."""
+    if DB_DIALECT == "postgres":
+        sql = (
+            "SELECT i.indexname, i.indexdef FROM pg_indexes i "
+            "WHERE i.tablename = 'journal' AND i.schemaname = current_schema() "
+            "AND i.indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = 'journal'::regclass)"
+        )
+    else:
+        sql = "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'journal' AND sql IS NOT NULL"
+    return [(r[0], r[1]) for r in conn.execute(text(sql)).fetchall()]
+
+
+def import_snapshot(source) -> int:
+    """Bulk-load a snapshot zip (from `export_snapshot`) into the session company, as one unit of work.
+
+    The company must have no journal rows. Lookups are upserted first; journal rows are
+    loaded with COPY (Postgres) or a driver-level executemany (SQLite). They keep their ids
+    only when the whole journal is empty (ids are shared by all companies); otherwise new
+    ids are assigned. Recurring templates always get new ids (their keys follow). The closed
+    books (`closed_through`, `period_snapshots`) replace the company's; a snapshot older than
+    v3 has none and leaves every period open. Returns the company's journal row count.
+    """
+    import json
+    import shutil
+    import tempfile
+    import zipfile
+
+    import pyarrow.parquet as pq
+
+    company = {"company_id": COMPANY_ID}
+    if int(db_scalar("SELECT count(*) FROM journal WHERE company_id = :company_id", company, default=0) or 0):
+        raise ValueError("Η φόρτωση snapshot γίνεται μόνο σε εταιρεία χωρίς εγγραφές.")
+    workdir = tempfile.mkdtemp(prefix="erp_snapshot_")
+    try:
+        with zipfile.ZipFile(source) as zf:
+            names = set(zf.namelist())
+            if "manifest.json" not in names or "journal.parquet" not in names:
+                raise ValueError("Το αρχείο δεν είναι snapshot της εφαρμογής.")
+            manifest = json.loads(zf.read("manifest.json"))
+            if manifest.get("format") != SNAPSHOT_FORMAT or int(manifest.get("version", 0)) > SNAPSHOT_VERSION:
+                raise ValueError("Μη υποστηριζόμενη έκδοση snapshot.")
+            # Only the known members (no paths from the archive are trusted).
+            for table in ["journal", *SNAPSHOT_LOOKUPS, *SNAPSHOT_TABLES]:
+                if f"{table}.parquet" in names:
+                    zf.extract(f"{table}.parquet", workdir)
+
+        def lookup(table: str) -> pd.DataFrame:
+            path = os.path.join(workdir, f"{table}.parquet")
+            cols = SNAPSHOT_LOOKUPS[table]
+            if not os.path.exists(path):
+                return pd.DataFrame(columns=cols)
+            return pq.read_table(path, columns=cols).to_pandas().dropna(subset=[cols[0]])
+
+        def table_rows(table: str) -> list[Dict[str, Any]]:
+            path = os.path.join(workdir, f"{table}.parquet")
+            if not os.path.exists(path):
+                return []
+            cols, dates, ints = SNAPSHOT_TABLES[table]
+            df = pq.read_table(path, columns=cols).to_pandas()
+            for c in dates:
+                df[c] = pd.to_datetime(df[c], errors="coerce").dt.strftime("%Y-%m-%d")
+            df = df.astype({c: "Int64" for c in ints}).astype(object)
+            return df.where(df.notna(), None).to_dict("records")
+
+        journal_path = os.path.join(workdir, "journal.parquet")
+        used = pq.read_table(journal_path, columns=["counterparty", "bank_account", *JOURNAL_ENUMS]).to_pandas()
+
+        def distinct(col: str) -> list[str]:
+            return [str(v) for v in used[col].dropna().unique()]
+
+        with db_unit_of_work() as conn:
+            gl = lookup("gl_codes")
+            if not gl.empty:
+                conn.execute(
+                    text(GL_CODE_UPSERT_SQL),
+                    [{**company, **r} for r in gl.astype(object).where(gl.notna(), None).to_dict("records")],
+                )
+            cps = lookup("counterparties")
+            upsert_counterparties(zip(cps["name"], cps["kind"]), conn)
+            journal_partners = {nm.strip() for nm in distinct("counterparty")} - {""}
+            if journal_partners:
+                conn.execute(
+                    text(
+                        "INSERT INTO counterparties (company_id, name, kind) VALUES (:company_id, :name, 'other') "
+                        "ON CONFLICT (company_id, name) DO NOTHING"
+                    ),
+                    [{**company, "name": nm} for nm in sorted(journal_partners)],
+                )
+            upsert_bank_accounts(distinct("bank_account"), conn)
+            banks = lookup("bank_accounts")
+            if not banks.empty:
+                conn.execute(
+                    text(
+                        "INSERT INTO bank_accounts (company_id, name, kind) VALUES (:company_id, :name, :kind) "
+                        "ON CONFLICT (company_id, name) DO UPDATE SET kind = EXCLUDED.kind"
+                    ),
+                    [{**company, **r} for r in banks.fillna("bank").to_dict("records")],
+                )
+            for col, table in JOURNAL_ENUMS.items():
+                values = set(distinct(col)) | set(lookup(table)["name"])
+                ensure_journal_enums([{col: v} for v in values], conn)
+            template_ids = {}
+            template_cols = [c for c in SNAPSHOT_TABLES["recurring_templates"][0] if c != "id"]
+            for row in table_rows("recurring_templates"):
+                template_ids[int(row.pop("id"))] = conn.execute(
+                    text(
+                        f"INSERT INTO recurring_templates (company_id, {', '.join(template_cols)}) "
+                        f"VALUES (:company_id, {', '.join(f':{c}' for c in template_cols)}) RETURNING id"
+                    ),
+                    {**company, **row},
+                ).scalar()
+            skips = lookup("recurring_skips")
+            skip_keys = _remap_recurring_keys(skips["recurring_key"], template_ids).dropna() if not skips.empty else []
+            if len(skip_keys):
+                conn.execute(
+                    text(
+                        "INSERT INTO recurring_skips (company_id, recurring_key) VALUES (:company_id, :recurring_key) "
+                        "ON CONFLICT (company_id, recurring_key) DO NOTHING"
+                    ),
+                    [{**company, "recurring_key": str(k)} for k in skip_keys],
+                )
+
+            counterparty_ids = dict(
+                conn.execute(text("SELECT name, id FROM counterparties WHERE company_id = :company_id"), company).fetchall()
+            )
+            enum_ids = {
+                col: dict(conn.execute(text(f"SELECT name, id FROM {table}")).fetchall())
+                for col, table in JOURNAL_ENUMS.items()
+            }
+            del used
+            # Into an empty journal: keep the ids and build the indexes once after the load
+            # (much faster than maintaining them per row). Next to other companies' rows the
+            # ids could clash and the indexes are in use, so new ids and a plain insert.
+            keep_ids = not conn.execute(text("SELECT 1 FROM journal LIMIT 1")).first()
+            indexes = _journal_secondary_indexes(conn) if keep_ids else []
+            for name, _ in indexes:
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+            for batch in pq.ParquetFile(journal_path).iter_batches(batch_size=SNAPSHOT_BATCH_ROWS):
+                frame = _snapshot_load_frame(batch.to_pandas(), counterparty_ids, enum_ids, COMPANY_ID, template_ids)
+                _bulk_load_journal(conn, frame if keep_ids else frame.drop(columns="id"))
+            for _, create_sql in indexes:
+                conn.execute(text(create_sql))
+            if keep_ids and DB_DIALECT == "postgres":
+                # Explicit ids were loaded: move the SERIAL sequence past them.
+                conn.execute(
+                    text("SELECT setval(pg_get_serial_sequence('journal', 'id'), (SELECT COALESCE(MAX(id), 1) FROM journal))")
+                )
+            # Closed books last: the frozen totals and the lock date come back together.
+            conn.execute(text("DELETE FROM period_snapshots WHERE company_id = :company_id"), company)
+            snapshot_cols = SNAPSHOT_TABLES["period_snapshots"][0]
+            snapshot_rows = table_rows("period_snapshots")
+            if snapshot_rows:
+                conn.execute(
+                    text(
+                        f"INSERT INTO period_snapshots (company_id, {', '.join(snapshot_cols)}) "
+                        f"VALUES (:company_id, {', '.join(f':{c}' for c in snapshot_cols)})"
+                    ),
+                    [{**company, **r} for r in snapshot_rows],
+                )
+            conn.execute(text(COMPANY_CLOSED_THROUGH_SQL), {**company, "v": int(manifest.get("closed_through") or 0)})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return int(db_scalar("SELECT count(*) FROM journal WHERE company_id = :company_id", company, default=0) or 0)
+
+
+# --- Companies ---
+# Every company has its own journal, lookups, lock date and snapshots (see `COMPANY_TABLES`);
+# the session works on one at a time (`COMPANY_ID`, sidebar switcher).
+DEFAULT_COMPANY_NAME = "Εταιρεία"
+GL_DEFAULT_CODES = [
+    {"code": "100", "description": "Πωλήσεις"},
+    {"code": "200", "description": "Αγορές"},
+    {"code": "300", "description": "Ταμείο"},
+    {"code": "400", "description": "Τράπεζες"},
+    {"code": "600", "description": "Γενικά Έξοδα"},
+]
+
+
+def insert_default_gl_codes(conn: Connection, company_id: int) -> None:
+    """Seed the company's chart with `GL_DEFAULT_CODES` (existing codes are kept)."""
+    conn.execute(
+        text(
+            "INSERT INTO gl_codes (company_id, code, description) VALUES (:company_id, :code, :description) "
+            "ON CONFLICT (company_id, code) DO NOTHING"
+        ),
+        [{"company_id": company_id, **row} for row in GL_DEFAULT_CODES],
+    )
+
+
+def create_company(name: str) -> int:
+    """Add a company with the default GL codes, as one unit of work; returns its id.
+
+    Raises ValueError for a blank or already used name.
+    """
+    nm = (name or "").strip()
+    if not nm:
+        raise ValueError("Δώστε όνομα εταιρείας.")
+    with db_unit_of_work() as conn:
+        if conn.execute(text("SELECT 1 FROM companies WHERE name = :name"), {"name": nm}).first():
+            raise ValueError(f"Υπάρχει ήδη εταιρεία με το όνομα {nm}.")
+        company_id = conn.execute(
+            text("INSERT INTO companies (name) VALUES (:name) RETURNING id"), {"name": nm}
+        ).scalar()
+        insert_default_gl_codes(conn, company_id)
+    return int(company_id)
+
+
+@st.cache_data(ttl=300)
+def load_companies(data_version: int = 0) -> Dict[int, str]:
+    """{id: name} of every company, in creation order."""
+    with ENGINE.connect() as conn:
+        return dict(conn.execute(text("SELECT id, name FROM companies ORDER BY id")).fetchall())
+
+
+def migrate_placeholders_to_lookups() -> None:
+    """Migrate legacy Settings 'placeholder' rows from journal into lookup tables.
+
+    Older versions stored Customers/Suppliers/Bank accounts by inserting 0-amount rows
+    into `journal`. Those rows should not pollute the Archive.
+    """
+    try:
+        df_cp = pd.read_sql_query(
+            """
+            SELECT DISTINCT counterparty AS name, doc_type
+            FROM journal_v
+            WHERE counterparty IS NOT NULL AND counterparty != ''
+              AND description = '(αρχικοποίηση)'
+              AND COALESCE(amount_net,0)=0 AND COALESCE(vat_amount,0)=0 AND COALESCE(amount_gross,0)=0
+            """,
+            ENGINE,
+        )
+        if not df_cp.empty:
+            with db_unit_of_work() as conn:
+                for r in df_cp.itertuples(index=False):
+                    upsert_counterparty(str(r.name), _counterparty_kind_for_doc_type(str(r.doc_type)), conn=conn)
+                conn.execute(
+                    text(
+                        """
+                        DELETE FROM journal
+                        WHERE description = '(αρχικοποίηση)'
+                          AND COALESCE(amount_net,0)=0 AND COALESCE(vat_amount,0)=0 AND COALESCE(amount_gross,0)=0
+                        """
+                    )
+                )
     except Exception:
         pass
 
@@ -908,16 +3022,19 @@ def migrate_placeholders_to_lookups() -> None:
             ENGINE,
         )
         if not df_ba.empty:
-            for r in df_ba.itertuples(index=False):
-                nm = str(r.name)
-                upsert_bank_account(nm, _bank_kind_from_name(nm))
-            db_execute(
-                """
-                DELETE FROM journal
-                WHERE description = '(άνοιγμα λογαριασμού)'
-                  AND COALESCE(amount_net,0)=0 AND COALESCE(vat_amount,0)=0 AND COALESCE(amount_gross,0)=0
-                """
-            )
+            with db_unit_of_work() as conn:
+                for r in df_ba.itertuples(index=False):
+                    nm = str(r.name)
+                    upsert_bank_account(nm, _bank_kind_from_name(nm), conn=conn)
+                conn.execute(
+                    text(
+                        """
+                        DELETE FROM journal
+                        WHERE description = '(άνοιγμα λογαριασμού)'
+                          AND COALESCE(amount_net,0)=0 AND COALESCE(vat_amount,0)=0 AND COALESCE(amount_gross,0)=0
+                        """
+                    )
+                )
     except Exception:
         pass
 
@@ -946,6 +3063,73 @@ except Exception as e:
     st.write(f"Type: {type(e).__name__}")
     st.stop()
 
+# Throttled WAL checkpoint / optimize (no-op on Postgres).
+sqlite_maintenance()
+
+# Read once per rerun; passed to the cached loaders as part of their cache key.
+DATA_VERSION = get_data_version()
+
+@st.cache_resource(show_spinner=False)
+def _replica_state() -> Dict[str, Any]:
+    # Monotonic time of the last failed replica check (None = healthy); shared by all sessions.
+    return {"failed_at": None}
+
+
+def replica_data_version() -> Optional[int]:
+    """`data_version` as the read replica sees it; None when it is unset, unreachable, or was
+    unreachable less than REPLICA_BACKOFF_SECONDS ago."""
+    if REPLICA_ENGINE is None:
+        return None
+    state = _replica_state()
+    failed_at = state["failed_at"]
+    if failed_at is not None and time.monotonic() - failed_at < REPLICA_BACKOFF_SECONDS:
+        return None
+    try:
+        with REPLICA_ENGINE.connect() as conn:
+            v = conn.execute(text("SELECT value FROM app_meta WHERE key = 'data_version'")).scalar()
+    except Exception:
+        state["failed_at"] = time.monotonic()
+        return None
+    state["failed_at"] = None
+    return int(v or 0)
+
+
+def _choose_read_engine(data_version: int) -> tuple[Any, str]:
+    """(engine, role) for this run's report reads.
+
+    The version is bumped inside every write transaction, so a replica at (or past) the
+    primary's version has every committed write, including this session's own. A lagging
+    or unreachable replica sends reads to the primary until it catches up.
+    """
+    if sync_read_mirror(data_version):
+        return _read_mirror_engine(READ_MIRROR_FILE), "mirror"
+    replica_version = replica_data_version()
+    if replica_version is not None and replica_version >= data_version:
+        return REPLICA_ENGINE, "replica"
+    return ENGINE, "primary"
+
+
+# Report reads: the local mirror or the read replica when configured and in sync, otherwise
+# the primary. Writes, and reads that feed a write, always use ENGINE.
+READ_ENGINE, READ_ROUTE = _choose_read_engine(DATA_VERSION)
+
+COMPANIES = load_companies(DATA_VERSION)
+if COMPANY_ID not in COMPANIES:
+    # Unknown id (e.g. a reset database): fall back to the first company.
+    COMPANY_ID = next(iter(COMPANIES), DEFAULT_COMPANY_ID)
+    st.session_state["company_id"] = COMPANY_ID
+
+# --- 3.5 FLASH MESSAGES ---
+def flash(message: str, icon: str = "✅") -> None:
+    """Queue a toast to show after the next `st.rerun()` (no blocking sleep needed)."""
+    st.session_state.setdefault("flash_messages", []).append((message, icon))
+
+
+def show_flash_messages() -> None:
+    for message, icon in st.session_state.pop("flash_messages", []):
+        st.toast(message, icon=icon)
+
+
 # --- 4. CALCULATOR LOGIC ---
 if 'calc_net' not in st.session_state: st.session_state.calc_net = 0.0
 if 'calc_vat_rate' not in st.session_state: st.session_state.calc_vat_rate = 24
@@ -963,27 +3147,37 @@ def calculate_vat():
 
 # --- 4.5 CACHED DATA LOADERS ---
 @st.cache_data
-def load_gl_codes():
+def load_gl_codes(company_id: int = DEFAULT_COMPANY_ID, data_version: int = 0):
     """Load GL codes with caching (rarely changes)"""
-    gl_df = pd.read_sql_query(text("SELECT code, description FROM gl_codes ORDER BY code"), ENGINE)
+    gl_df = pd.read_sql_query(
+        text("SELECT code, description FROM gl_codes WHERE company_id = :company_id ORDER BY code"),
+        READ_ENGINE,
+        params={"company_id": company_id},
+    )
     return gl_df.apply(lambda x: f"{x['code']} - {x['description']}", axis=1).tolist()
 
-@st.cache_data(ttl=300)  # Cache for 5 minutes
-def load_journal_data():
-    """Load journal data with short-term caching"""
-    return pd.read_sql_query(text("SELECT * FROM journal"), ENGINE)
+@st.cache_data(ttl=300, max_entries=4)  # Cache for 5 minutes
+def load_journal_data(company_id: int = DEFAULT_COMPANY_ID, data_version: int = 0):
+    """Load journal data with short-term caching (keyed by data version); doc_date is parsed once here."""
+    df = pd.read_sql_query(
+        text("SELECT * FROM journal_v WHERE company_id = :company_id"), READ_ENGINE, params={"company_id": company_id}
+    )
+    df["doc_date"] = pd.to_datetime(df["doc_date"], errors="coerce", format="ISO8601")
+    return df
 
 
 @st.cache_data(ttl=300)
-def load_counterparties(doc_types: Optional[tuple[str, ...]] = None) -> list[str]:
+def load_counterparties(
+    doc_types: Optional[tuple[str, ...]] = None, company_id: int = DEFAULT_COMPANY_ID, data_version: int = 0
+) -> list[str]:
     """Load distinct counterparties, optionally filtered by doc_type."""
     # From journal — use parameterized query to prevent SQL injection
     base = (
         "SELECT DISTINCT counterparty AS name "
-        "FROM journal "
-        "WHERE counterparty IS NOT NULL AND counterparty != ''"
+        "FROM journal_v "
+        "WHERE company_id = :company_id AND counterparty IS NOT NULL AND counterparty != ''"
     )
-    params: Dict[str, Any] = {}
+    params: Dict[str, Any] = {"company_id": company_id}
     if doc_types:
         placeholders = ", ".join([f":dt{i}" for i in range(len(doc_types))])
         sql_j = f"{base} AND doc_type IN ({placeholders})"
@@ -993,25 +3187,23 @@ def load_counterparties(doc_types: Optional[tuple[str, ...]] = None) -> list[str
         sql_j = base
 
     # From lookup table (filtered by inferred kind when doc_types provided)
-    kind_filter_sql = ""
+    kind_filter_sql = "WHERE company_id = :company_id"
     if doc_types:
         kinds = {_counterparty_kind_for_doc_type(t) for t in doc_types}
         # Only narrow when the inferred kinds are meaningful
         if kinds <= {"customer"}:
-            kind_filter_sql = "WHERE kind = :k"
+            kind_filter_sql += " AND kind = :k"
             params["k"] = "customer"
         elif kinds <= {"supplier"}:
-            kind_filter_sql = "WHERE kind = :k"
+            kind_filter_sql += " AND kind = :k"
             params["k"] = "supplier"
-        else:
-            kind_filter_sql = ""
 
     sql = (
         f"SELECT name FROM ({sql_j} UNION SELECT name FROM counterparties {kind_filter_sql}) u "
         "ORDER BY name"
     )
     # Use SQLAlchemy `text()` so named parameters (e.g. :k) work on Postgres.
-    df = pd.read_sql_query(text(sql), ENGINE, params=params)
+    df = pd.read_sql_query(text(sql), READ_ENGINE, params=params)
     if df.empty:
         return []
     vals = [str(x).strip() for x in df["name"].tolist() if str(x).strip()]
@@ -1020,22 +3212,25 @@ def load_counterparties(doc_types: Optional[tuple[str, ...]] = None) -> list[str
 
 
 @st.cache_data(ttl=300)
-def load_bank_accounts() -> list[str]:
+def load_bank_accounts(company_id: int = DEFAULT_COMPANY_ID, data_version: int = 0) -> list[str]:
     """Load distinct bank accounts for dropdowns."""
     df = pd.read_sql_query(
-        """
-        SELECT name FROM (
-            SELECT DISTINCT bank_account AS name
-            FROM journal
-            WHERE bank_account IS NOT NULL AND bank_account != ''
-            UNION
-            SELECT name
-            FROM bank_accounts
-            WHERE name IS NOT NULL AND name != ''
-        ) u
-        ORDER BY name
-        """,
-        ENGINE,
+        text(
+            """
+            SELECT name FROM (
+                SELECT DISTINCT bank_account AS name
+                FROM journal
+                WHERE company_id = :company_id AND bank_account IS NOT NULL AND bank_account != ''
+                UNION
+                SELECT name
+                FROM bank_accounts
+                WHERE company_id = :company_id AND name IS NOT NULL AND name != ''
+            ) u
+            ORDER BY name
+            """
+        ),
+        READ_ENGINE,
+        params={"company_id": company_id},
     )
     if df.empty:
         return []
@@ -1043,6 +3238,975 @@ def load_bank_accounts() -> list[str]:
     vals = sorted(set(vals), key=str.casefold)
     return vals
 
+# --- 4.5.1 REPORT AGGREGATES ---
+# Dashboard / VAT / Treasury totals are computed by the database (GROUP BY) and come back
+# result-sized. ERP_ANALYTICS_ENGINE=duckdb runs the same SQL in DuckDB over a Parquet
+# copy of `journal_v`. A data version (or `JOURNAL_VIEW_REV`) change rebuilds the copy in a
+# background thread; until it is in place, and without the package or on any DuckDB error,
+# the read engine answers instead.
+ANALYTICS_ENGINE = os.getenv("ERP_ANALYTICS_ENGINE", "sql").strip().lower()
+
+# Same rule as `clean_dataframe`: a missing/zero gross amount is net + VAT.
+REPORT_GROSS_SQL = (
+    "CASE WHEN COALESCE(amount_gross, 0) = 0 "
+    "THEN COALESCE(amount_net, 0) + COALESCE(vat_amount, 0) ELSE amount_gross END"
+)
+# Totals aggregate the base table on the period keys (`idx_journal_company_period`) and
+# resolve doc_type names on the small result, so ten years cost little more than one.
+# `{where}` is a `_period_filter` condition.
+REPORT_PERIOD_TOTALS_SQL = f"""SELECT COALESCE(TRIM(COALESCE(dt.name, t.doc_type)), '') AS doc_type,
+        SUM(t.n) AS n, SUM(t.amount_net) AS amount_net,
+        SUM(t.vat_amount) AS vat_amount, SUM(t.amount_gross) AS amount_gross
+    FROM (
+        SELECT doc_type_id, doc_type, COUNT(*) AS n,
+            SUM(COALESCE(amount_net, 0)) AS amount_net,
+            SUM(COALESCE(vat_amount, 0)) AS vat_amount,
+            SUM({REPORT_GROSS_SQL}) AS amount_gross
+        FROM journal
+        WHERE {{where}}
+        GROUP BY doc_type_id, doc_type
+    ) t
+    LEFT JOIN doc_types dt ON dt.id = t.doc_type_id
+    GROUP BY 1 ORDER BY 1"""
+REPORT_MONTHLY_TOTALS_SQL = """SELECT t.fiscal_year, t.period_month,
+        COALESCE(TRIM(COALESCE(dt.name, t.doc_type)), '') AS doc_type, SUM(t.amount_net) AS amount_net
+    FROM (
+        SELECT fiscal_year, period_month, doc_type_id, doc_type, SUM(COALESCE(amount_net, 0)) AS amount_net
+        FROM journal
+        WHERE company_id = :company_id AND fiscal_year BETWEEN :year_from AND :year_to
+        GROUP BY fiscal_year, period_month, doc_type_id, doc_type
+    ) t
+    LEFT JOIN doc_types dt ON dt.id = t.doc_type_id
+    GROUP BY 1, 2, 3 ORDER BY 1, 2, 3"""
+# Closed months (up to `closed_through`, YYYYMM) are read from `period_snapshots`;
+# the live queries below only see the open ones (and undated rows).
+REPORT_PERIOD_KEY_SQL = "fiscal_year * 100 + period_month"
+REPORT_OPEN_SQL = f"(fiscal_year IS NULL OR {REPORT_PERIOD_KEY_SQL} > :closed_through)"
+# Cash totals (per account, cash flow) are keyed by the payment month: `paid_date` when it is
+# known, else the document month (rows saved as Paid). A payment made in an open month then
+# counts there, even for a document dated in a closed one (see `assert_open_settlement`).
+# Text slicing keeps it portable across Postgres, SQLite and DuckDB (ISO dates on all three).
+REPORT_PAID_PERIOD_KEY_SQL = (
+    "COALESCE(CAST(REPLACE(SUBSTR(CAST(paid_date AS VARCHAR(10)), 1, 7), '-', '') AS INTEGER), "
+    f"{REPORT_PERIOD_KEY_SQL})"
+)
+REPORT_PAID_OPEN_SQL = f"({REPORT_PAID_PERIOD_KEY_SQL} IS NULL OR {REPORT_PAID_PERIOD_KEY_SQL} > :closed_through)"
+REPORT_CASH_POSITIONS_SQL = f"""SELECT COALESCE(TRIM(bank_account), '') AS bank_account,
+        COALESCE(TRIM(doc_type), '') AS doc_type, COUNT(*) AS n,
+        SUM({REPORT_GROSS_SQL}) AS amount_gross, MAX(doc_date) AS last_date
+    FROM journal_v
+    WHERE company_id = :company_id AND TRIM(status) = 'Paid' AND {REPORT_PAID_OPEN_SQL}
+    GROUP BY 1, 2 ORDER BY 1, 2"""
+REPORT_MONTHLY_CASH_FLOW_SQL = f"""SELECT {REPORT_PAID_PERIOD_KEY_SQL} AS period_key,
+        SUM(CASE WHEN TRIM(doc_type) = 'Income' THEN 1 ELSE -1 END * ({REPORT_GROSS_SQL})) AS flow
+    FROM journal_v
+    WHERE company_id = :company_id AND TRIM(status) = 'Paid' AND {REPORT_PAID_PERIOD_KEY_SQL} > :closed_through
+    GROUP BY 1 ORDER BY 1"""
+REPORT_TOTAL_COLUMNS = ["n", "amount_net", "vat_amount", "amount_gross"]
+REPORT_ROW_COLUMNS = [
+    "id", "doc_date", "doc_no", "doc_type", "counterparty", "description",
+    "amount_net", "vat_amount", "amount_gross", "payment_method", "bank_account", "status",
+]
+
+
+@st.cache_resource(show_spinner=False)
+def _analytics_state() -> Dict[str, Any]:
+    import threading
+
+    # company_id -> {"key", "con", "path", "building", "failed"}: one Parquet copy per company,
+    # keyed on (data_version, JOURNAL_VIEW_REV); "building" / "failed" hold the key of the
+    # rebuild in progress / of the last one that raised (not retried for the same key).
+    return {"lock": threading.Lock(), "copies": {}, "dir": None}
+
+
+def _build_duckdb_copy(company_id: int, key: tuple[int, int], engine) -> None:
+    """Background thread: write the company's Parquet copy for `key` and swap it in."""
+    import tempfile
+
+    import duckdb
+
+    state = _analytics_state()
+    path, con = None, None
+    try:
+        with state["lock"]:
+            state["dir"] = state["dir"] or tempfile.mkdtemp(prefix="erp_analytics_")
+        path = os.path.join(state["dir"], f"journal_{company_id}_{key[0]}_{key[1]}.parquet")
+        # The export runs outside the lock: reports keep answering from the read engine meanwhile.
+        _write_snapshot_journal(path, engine, company_id)
+        con = duckdb.connect()
+        amounts = ", ".join(f"{a}_cents / 100 AS {a}" for a in SNAPSHOT_AMOUNTS)
+        quoted = path.replace("'", "''")
+        con.execute(
+            "CREATE VIEW journal_v AS SELECT id, doc_date, doc_no, doc_type, counterparty, "
+            f"description, gl_code, {amounts}, payment_method, bank_account, status, paid_date, "
+            "year(doc_date) AS fiscal_year, month(doc_date) AS period_month, "
+            f"quarter(doc_date) AS period_quarter, {int(company_id)} AS company_id "
+            f"FROM read_parquet('{quoted}')"
+        )
+        # Names are already resolved in the copy; these keep the base-table queries portable.
+        con.execute("CREATE VIEW journal AS SELECT *, CAST(NULL AS INTEGER) AS doc_type_id FROM journal_v")
+        con.execute("CREATE TABLE doc_types (id INTEGER, name VARCHAR)")
+    except Exception:
+        with state["lock"]:
+            state["copies"][company_id].update(building=None, failed=key)
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return
+    with state["lock"]:
+        copy = state["copies"][company_id]
+        old_path = copy["path"]
+        copy.update(key=key, con=con, path=path, building=None)
+    if old_path:
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass
+
+
+def _duckdb_cursor(company_id: int, data_version: int):
+    """DuckDB cursor over the company's Parquet copy for `data_version`, or None while it is (re)built."""
+    import threading
+
+    state = _analytics_state()
+    key = (int(data_version), JOURNAL_VIEW_REV)
+    with state["lock"]:
+        copy = state["copies"].setdefault(
+            company_id, {"key": None, "con": None, "path": None, "building": None, "failed": None}
+        )
+        if copy["key"] == key:
+            # One cursor per query: DuckDB connections are not shared across threads.
+            return copy["con"].cursor()
+        if copy["building"] is None and copy["failed"] != key:
+            copy["building"] = key
+            threading.Thread(
+                target=_build_duckdb_copy, args=(company_id, key, READ_ENGINE), daemon=True,
+                name=f"erp-analytics-{company_id}",
+            ).start()
+        return None
+
+
+def _report_query(sql: str, params: Dict[str, Any], data_version: int) -> pd.DataFrame:
+    """Run a report aggregate on the analytics engine (`:name` params on every engine, incl. `company_id`)."""
+    import re
+
+    if ANALYTICS_ENGINE == "duckdb":
+        try:
+            cur = _duckdb_cursor(int(params["company_id"]), data_version)
+            if cur is not None:
+                return cur.execute(re.sub(r"(?<!:):(\w+)", r"$\1", sql), params).df()
+        except Exception:
+            pass
+    # SQLite stores dates as ISO text; Postgres compares the literal against DATE.
+    bound = {k: v.isoformat() if isinstance(v, date) else v for k, v in params.items()}
+    return pd.read_sql_query(text(sql), READ_ENGINE, params=bound)
+
+
+def _period_filter(
+    company_id: int,
+    year: int,
+    month: Optional[int] = None,
+    quarter: Optional[int] = None,
+    before: Optional[date] = None,
+) -> tuple[str, Dict[str, Any]]:
+    """WHERE condition on the company's period keys (an index range scan), optionally cut at `before`."""
+    where, params = ["company_id = :company_id", "fiscal_year = :year"], {"company_id": int(company_id), "year": int(year)}
+    if month:
+        where.append("period_month = :month")
+        params["month"] = int(month)
+    if quarter:
+        where.append("period_quarter = :quarter")
+        params["quarter"] = int(quarter)
+    if before:
+        where.append("doc_date < :before")
+        params["before"] = before
+    return " AND ".join(where), params
+
+
+def _period_months(month: Optional[int] = None, quarter: Optional[int] = None) -> tuple[int, int]:
+    """First and last month of a month / quarter / whole-year selection."""
+    if month:
+        return int(month), int(month)
+    if quarter:
+        return 3 * int(quarter) - 2, 3 * int(quarter)
+    return 1, 12
+
+
+def _month_labels(df: pd.DataFrame) -> pd.Series:
+    """'YYYY-MM' from the fiscal_year / period_month columns."""
+    return df["fiscal_year"].astype(int).astype(str) + "-" + df["period_month"].astype(int).astype(str).str.zfill(2)
+
+
+@st.cache_data(ttl=300, max_entries=32)
+def load_period_totals(
+    year: int,
+    month: Optional[int] = None,
+    quarter: Optional[int] = None,
+    before: Optional[date] = None,
+    company_id: int = DEFAULT_COMPANY_ID,
+    data_version: int = 0,
+) -> pd.DataFrame:
+    """Per doc_type: rows (`n`), net, VAT and gross for a year / month / quarter.
+
+    Closed months come from their VAT snapshot, the open rest from the journal.
+    """
+    where, params = _period_filter(company_id, year, month, quarter, before)
+    first, last = _period_months(month, quarter)
+    closed_to = 0 if before else closed_month_of(year, company_id)
+    frames = []
+    if closed_to >= first:
+        frames.append(load_vat_snapshot(year, first, min(last, closed_to), company_id))
+    if closed_to < last:
+        if closed_to >= first:
+            where += " AND period_month > :closed_month"
+            params["closed_month"] = closed_to
+        frames.append(_report_query(REPORT_PERIOD_TOTALS_SQL.format(where=where), params, data_version))
+    df = frames[0] if len(frames) == 1 else (
+        pd.concat(frames, ignore_index=True).groupby("doc_type", as_index=False)[REPORT_TOTAL_COLUMNS].sum()
+    )
+    return df[["doc_type", *REPORT_TOTAL_COLUMNS]].astype(
+        {"n": "int64", "amount_net": "float64", "vat_amount": "float64", "amount_gross": "float64"}
+    )
+
+
+@st.cache_data(ttl=300, max_entries=16)
+def load_monthly_totals(
+    year_from: int, year_to: int, company_id: int = DEFAULT_COMPANY_ID, data_version: int = 0
+) -> pd.DataFrame:
+    """Net amount per month (`mo`, 'YYYY-MM') and doc_type for the years in range."""
+    df = _report_query(
+        REPORT_MONTHLY_TOTALS_SQL,
+        {"company_id": company_id, "year_from": int(year_from), "year_to": int(year_to)},
+        data_version,
+    )
+    df.insert(0, "mo", _month_labels(df))
+    return df.drop(columns=["fiscal_year", "period_month"]).astype({"amount_net": "float64"})
+
+
+@st.cache_data(ttl=300, max_entries=4)
+def load_cash_positions(company_id: int = DEFAULT_COMPANY_ID, data_version: int = 0) -> pd.DataFrame:
+    """Paid entries per bank_account and doc_type: rows, gross amount, latest date.
+
+    Closed periods contribute their opening-balance snapshot instead of their rows.
+    """
+    closed = get_closed_through(company_id=company_id)
+    df = _report_query(REPORT_CASH_POSITIONS_SQL, {"company_id": company_id, "closed_through": closed}, data_version)
+    df["last_date"] = pd.to_datetime(df["last_date"], errors="coerce")
+    if closed:
+        opening = load_opening_balances("account", company_id=company_id).rename(columns={"name": "bank_account"})
+        opening["last_date"] = pd.to_datetime(opening["last_date"], errors="coerce")
+        df = (
+            pd.concat([opening[df.columns], df], ignore_index=True)
+            .groupby(["bank_account", "doc_type"], as_index=False)
+            .agg(n=("n", "sum"), amount_gross=("amount_gross", "sum"), last_date=("last_date", "max"))
+        )
+    return df.astype({"n": "int64", "amount_gross": "float64"})
+
+
+@st.cache_data(ttl=300, max_entries=4)
+def load_monthly_cash_flow(company_id: int = DEFAULT_COMPANY_ID, data_version: int = 0) -> pd.DataFrame:
+    """Signed flow of paid entries per payment month (Income in, everything else out)."""
+    closed = get_closed_through(company_id=company_id)
+    df = _report_query(REPORT_MONTHLY_CASH_FLOW_SQL, {"company_id": company_id, "closed_through": closed}, data_version)
+    key = df.pop("period_key").astype("int64")
+    df.insert(0, "fiscal_year", key // 100)
+    df.insert(1, "period_month", key % 100)
+    if closed:
+        frozen = pd.read_sql_query(text(PERIOD_CASH_FLOW_SQL), ENGINE, params={"company_id": company_id})
+        df = pd.concat([frozen, df], ignore_index=True).sort_values(["fiscal_year", "period_month"])
+    df.insert(0, "month", _month_labels(df))
+    return df.drop(columns=["fiscal_year", "period_month"]).astype({"flow": "float64"})
+
+
+@st.cache_data(ttl=300, max_entries=16)
+def load_journal_rows(
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    quarter: Optional[int] = None,
+    status: Optional[str] = None,
+    limit: Optional[int] = None,
+    company_id: int = DEFAULT_COMPANY_ID,
+    data_version: int = 0,
+) -> pd.DataFrame:
+    """Journal rows for the report detail tables, newest first (cleaned like `clean_dataframe`)."""
+    where, params = ["company_id = :company_id"], {"company_id": company_id}
+    if year:
+        period_sql, params = _period_filter(company_id, year, month, quarter)
+        where = [period_sql]
+    if status:
+        where.append("TRIM(status) = :status")
+        params["status"] = status
+    sql = f"SELECT {', '.join(REPORT_ROW_COLUMNS)} FROM journal_v WHERE " + " AND ".join(where)
+    # Undated rows last on both dialects (Postgres sorts NULLs first in DESC order).
+    sql += " ORDER BY CASE WHEN doc_date IS NULL THEN 1 ELSE 0 END, doc_date DESC, id DESC"
+    if limit:
+        sql += " LIMIT :limit"
+        params["limit"] = int(limit)
+    df = pd.read_sql_query(text(sql), READ_ENGINE, params=params)
+    df["doc_date"] = pd.to_datetime(df["doc_date"], errors="coerce", format="ISO8601")
+    return clean_dataframe(df)
+
+
+# Aging of open items: one pass over the Unpaid Income / Expense / Bill rows, bucketed by
+# conditional sums. `idx_journal_company_aging` covers every column the inner query reads, and the
+# GROUP BY leads with doc_type_id so the planner keeps that index-only range scan (grouping
+# by counterparty first makes it walk `idx_counterparty_id` over the whole table instead).
+AGING_BUCKETS = {"d0_30": "0–30", "d31_60": "31–60", "d61_90": "61–90", "d90_plus": "90+"}
+AGING_SIDES = {"receivable": ("Income",), "payable": ("Expense", "Bill")}
+_AGING_SIDE_OF = {t: side for side, types in AGING_SIDES.items() for t in types}
+_AGING_TYPES_SQL = ", ".join(f"'{t}'" for types in AGING_SIDES.values() for t in types)
+_AGING_PARTNER_SQL = "CASE WHEN counterparty_id IS NULL THEN TRIM(counterparty) END"
+_AGING_WHERE_SQL = (
+    "company_id = :company_id "
+    f"AND status_id = (SELECT id FROM {JOURNAL_ENUMS['status']} WHERE name = 'Unpaid') "
+    f"AND doc_type_id IN (SELECT id FROM {JOURNAL_ENUMS['doc_type']} WHERE name IN ({_AGING_TYPES_SQL}))"
+)
+AGING_SQL = f"""SELECT COALESCE(dt.name, '') AS doc_type, a.counterparty_id,
+        COALESCE(c.name, a.counterparty, '') AS counterparty,
+        a.n, a.oldest, a.total, a.d0_30, a.d31_60, a.d61_90, a.d90_plus
+    FROM (
+        SELECT doc_type_id, counterparty_id, {_AGING_PARTNER_SQL} AS counterparty,
+            COUNT(*) AS n, MIN(doc_date) AS oldest, SUM(g) AS total,
+            SUM(CASE WHEN doc_date >= :c30 THEN g ELSE 0 END) AS d0_30,
+            SUM(CASE WHEN doc_date >= :c60 AND doc_date < :c30 THEN g ELSE 0 END) AS d31_60,
+            SUM(CASE WHEN doc_date >= :c90 AND doc_date < :c60 THEN g ELSE 0 END) AS d61_90,
+            SUM(CASE WHEN doc_date >= :c90 THEN 0 ELSE g END) AS d90_plus
+        FROM (
+            SELECT doc_type_id, counterparty_id, counterparty, doc_date, {REPORT_GROSS_SQL} AS g
+            FROM journal
+            WHERE {_AGING_WHERE_SQL}
+        ) j
+        GROUP BY doc_type_id, counterparty_id, {_AGING_PARTNER_SQL}
+    ) a
+    LEFT JOIN {JOURNAL_ENUMS["doc_type"]} dt ON dt.id = a.doc_type_id
+    LEFT JOIN counterparties c ON c.id = a.counterparty_id"""
+# Drill-down of one AGING_SQL line: same `_AGING_WHERE_SQL` on `journal` (the aging index),
+# narrowed to one side's `{types}` and one partner (`{who}`, on the `_AGING_PARTNER_SQL` key).
+OPEN_ITEMS_SQL = f"""SELECT o.id, o.doc_date, o.doc_no, COALESCE(dt.name, '') AS doc_type, o.description,
+        o.amount_gross
+    FROM (
+        SELECT id, doc_date, doc_no, doc_type_id, description, {REPORT_GROSS_SQL} AS amount_gross
+        FROM journal
+        WHERE {_AGING_WHERE_SQL}
+            AND doc_type_id IN (SELECT id FROM {JOURNAL_ENUMS["doc_type"]} WHERE name IN ({{types}})) AND {{who}}
+    ) o
+    LEFT JOIN {JOURNAL_ENUMS["doc_type"]} dt ON dt.id = o.doc_type_id
+    ORDER BY CASE WHEN o.doc_date IS NULL THEN 0 ELSE 1 END, o.doc_date, o.id"""
+
+
+@st.cache_data(ttl=300, max_entries=8)
+def load_aging(as_of: date, company_id: int = DEFAULT_COMPANY_ID, data_version: int = 0) -> pd.DataFrame:
+    """Open amounts per side ('receivable' / 'payable') and counterparty, in `AGING_BUCKETS` by age on `as_of`.
+
+    Undated rows count as 90+.
+    """
+    params = {f"c{days}": (as_of - timedelta(days=days)).isoformat() for days in (30, 60, 90)}
+    params["company_id"] = company_id
+    df = pd.read_sql_query(text(AGING_SQL), READ_ENGINE, params=params)
+    df["side"] = df["doc_type"].map(_AGING_SIDE_OF)
+    df["oldest"] = pd.to_datetime(df["oldest"], errors="coerce", format="ISO8601")
+    # Expense and Bill rows of the same partner become one line.
+    df = (
+        df.groupby(["side", "counterparty_id", "counterparty"], dropna=False, as_index=False)
+        .agg(
+            n=("n", "sum"), oldest=("oldest", "min"), total=("total", "sum"),
+            **{col: (col, "sum") for col in AGING_BUCKETS},
+        )
+        .sort_values(["side", "total"], ascending=[True, False], ignore_index=True)
+    )
+    return df.astype({"n": "int64", "total": "float64", **{col: "float64" for col in AGING_BUCKETS}})
+
+
+@st.cache_data(ttl=300, max_entries=16)
+def load_open_items(
+    side: str,
+    counterparty_id: Optional[int],
+    counterparty: str,
+    company_id: int = DEFAULT_COMPANY_ID,
+    data_version: int = 0,
+) -> pd.DataFrame:
+    """Unpaid rows of one counterparty on one aging side, oldest first."""
+    types = AGING_SIDES[side]
+    params: Dict[str, Any] = {f"t{i}": t for i, t in enumerate(types)}
+    params["company_id"] = company_id
+    if counterparty_id is not None and not pd.isna(counterparty_id):
+        who = "counterparty_id = :cid"
+        params["cid"] = int(counterparty_id)
+    else:
+        who = "counterparty_id IS NULL AND TRIM(counterparty) = :cp"
+        params["cp"] = counterparty
+    sql = OPEN_ITEMS_SQL.format(types=", ".join(f":t{i}" for i in range(len(types))), who=who)
+    df = pd.read_sql_query(text(sql), READ_ENGINE, params=params)
+    df["doc_date"] = pd.to_datetime(df["doc_date"], errors="coerce", format="ISO8601")
+    return df.astype({"amount_gross": "float64"})
+
+# Cash forecast per bank account: today's balances (`load_cash_positions`) plus the open
+# items on their expected payment date and the detected recurring flows, over 13 weeks or
+# 12 months. The journal has no due date, so an open item is expected on doc_date + the
+# partner's average days-to-pay, learned from `journal.paid_date` (stamped when a row turns
+# Paid). Partners without that history use their side's average, then FORECAST_TERMS_DAYS.
+# Open items rarely carry a bank_account; they go to the account the partner was most often
+# paid through (`FORECAST_ACCOUNTS_SQL`), else to the FORECAST_UNALLOCATED line, which has
+# no real balance and so gets no negative-balance warning.
+FORECAST_TERMS_DAYS = _env_int("ERP_FORECAST_TERMS_DAYS", 30)
+FORECAST_HORIZONS = {"weeks": 13, "months": 12}
+FORECAST_SOURCES = {"open": "Ανοιχτό παραστατικό", "recurring": "Επαναλαμβανόμενη ροή"}
+FORECAST_UNALLOCATED = "Χωρίς λογαριασμό"
+# Recurring: same account / partner / doc_type paid in at least FORECAST_RECURRING_MIN of
+# the last FORECAST_RECURRING_MONTHS full months, each month within ±FORECAST_RECURRING_SPREAD
+# of the median. Projected from next month on (this month's open items are already counted).
+FORECAST_RECURRING_MONTHS = 6
+FORECAST_RECURRING_MIN = 4
+FORECAST_RECURRING_SPREAD = 0.25
+FORECAST_OPEN_SQL = f"""SELECT f.bank_account, COALESCE(dt.name, '') AS doc_type, f.counterparty_id,
+        COALESCE(c.name, f.counterparty, '') AS counterparty, f.doc_date, f.amount
+    FROM (
+        SELECT COALESCE(TRIM(bank_account), '') AS bank_account, doc_type_id, counterparty_id,
+            {_AGING_PARTNER_SQL} AS counterparty, doc_date, SUM({REPORT_GROSS_SQL}) AS amount
+        FROM journal
+        WHERE {_AGING_WHERE_SQL}
+        GROUP BY 1, doc_type_id, counterparty_id, {_AGING_PARTNER_SQL}, doc_date
+    ) f
+    LEFT JOIN {JOURNAL_ENUMS["doc_type"]} dt ON dt.id = f.doc_type_id
+    LEFT JOIN counterparties c ON c.id = f.counterparty_id"""
+# `{days}` is the dialect's date difference (`FORECAST_DAYS_SQL`, by read engine).
+FORECAST_DAYS_SQL = {
+    "postgres": "paid_date - doc_date",
+    "sqlite": "julianday(paid_date) - julianday(doc_date)",
+}
+FORECAST_DAYS_TO_PAY_SQL = f"""SELECT COALESCE(dt.name, '') AS doc_type, p.counterparty_id, p.n, p.days
+    FROM (
+        SELECT doc_type_id, counterparty_id, COUNT(*) AS n, AVG({{days}}) AS days
+        FROM journal
+        WHERE company_id = :company_id AND paid_date IS NOT NULL AND doc_date IS NOT NULL AND paid_date >= doc_date
+            AND doc_type_id IN (SELECT id FROM {JOURNAL_ENUMS["doc_type"]} WHERE name IN ({_AGING_TYPES_SQL}))
+        GROUP BY doc_type_id, counterparty_id
+    ) p
+    LEFT JOIN {JOURNAL_ENUMS["doc_type"]} dt ON dt.id = p.doc_type_id"""
+FORECAST_ACCOUNTS_SQL = f"""SELECT COALESCE(dt.name, '') AS doc_type, a.counterparty_id, a.bank_account, a.n
+    FROM (
+        SELECT doc_type_id, counterparty_id, TRIM(bank_account) AS bank_account, COUNT(*) AS n
+        FROM journal
+        WHERE company_id = :company_id AND status_id = (SELECT id FROM {JOURNAL_ENUMS["status"]} WHERE name = 'Paid')
+            AND doc_type_id IN (SELECT id FROM {JOURNAL_ENUMS["doc_type"]} WHERE name IN ({_AGING_TYPES_SQL}))
+            AND counterparty_id IS NOT NULL AND COALESCE(TRIM(bank_account), '') <> ''
+        GROUP BY doc_type_id, counterparty_id, TRIM(bank_account)
+    ) a
+    LEFT JOIN {JOURNAL_ENUMS["doc_type"]} dt ON dt.id = a.doc_type_id"""
+FORECAST_RECURRING_SQL = f"""SELECT r.bank_account, COALESCE(dt.name, '') AS doc_type, r.counterparty_id,
+        COALESCE(c.name, r.counterparty, '') AS counterparty, r.fiscal_year, r.period_month,
+        r.amount, r.last_date
+    FROM (
+        SELECT COALESCE(TRIM(bank_account), '') AS bank_account, doc_type_id, counterparty_id,
+            {_AGING_PARTNER_SQL} AS counterparty, fiscal_year, period_month,
+            SUM({REPORT_GROSS_SQL}) AS amount, MAX(doc_date) AS last_date
+        FROM journal
+        WHERE company_id = :company_id AND status_id = (SELECT id FROM {JOURNAL_ENUMS["status"]} WHERE name = 'Paid')
+            AND doc_type_id IN (SELECT id FROM {JOURNAL_ENUMS["doc_type"]} WHERE name IN ({_AGING_TYPES_SQL}))
+            AND fiscal_year BETWEEN :first_year AND :last_year
+            AND {REPORT_PERIOD_KEY_SQL} BETWEEN :first AND :last
+        GROUP BY 1, doc_type_id, counterparty_id, {_AGING_PARTNER_SQL}, fiscal_year, period_month
+    ) r
+    LEFT JOIN {JOURNAL_ENUMS["doc_type"]} dt ON dt.id = r.doc_type_id
+    LEFT JOIN counterparties c ON c.id = r.counterparty_id"""
+FORECAST_EVENT_COLUMNS = ["date", "bank_account", "source", "doc_type", "counterparty", "amount"]
+
+
+def _forecast_bounds(horizon: str, as_of: date) -> pd.DatetimeIndex:
+    """Bucket start dates (weeks from this Monday, months from the 1st) plus the end bound."""
+    if horizon == "weeks":
+        return pd.date_range(as_of - timedelta(days=as_of.weekday()), periods=FORECAST_HORIZONS["weeks"] + 1, freq="7D")
+    return pd.date_range(as_of.replace(day=1), periods=FORECAST_HORIZONS["months"] + 1, freq="MS")
+
+
+def _forecast_days_to_pay(open_items: pd.DataFrame, company_id: int) -> pd.Series:
+    """Expected days from doc_date to payment for each open item (see FORECAST_TERMS_DAYS)."""
+    dialect = "sqlite" if READ_ENGINE.dialect.name == "sqlite" else "postgres"
+    hist = pd.read_sql_query(
+        text(FORECAST_DAYS_TO_PAY_SQL.format(days=FORECAST_DAYS_SQL[dialect])),
+        READ_ENGINE,
+        params={"company_id": company_id},
+    )
+    hist = hist.assign(side=hist["doc_type"].map(_AGING_SIDE_OF)).astype(
+        {"counterparty_id": "float64", "n": "int64", "days": "float64"}
+    )
+    hist["total"] = hist["days"] * hist["n"]
+    partner = hist.groupby(["side", "counterparty_id"])[["total", "n"]].sum()
+    side = hist.groupby("side")[["total", "n"]].sum()
+    keys = pd.MultiIndex.from_arrays([open_items["side"], open_items["counterparty_id"].astype("float64")])
+    by_partner = (partner["total"] / partner["n"]).reindex(keys).to_numpy()
+    by_side = (side["total"] / side["n"]).reindex(open_items["side"]).to_numpy()
+    return pd.Series(by_partner, index=open_items.index).fillna(pd.Series(by_side, index=open_items.index)).fillna(
+        float(FORECAST_TERMS_DAYS)
+    )
+
+
+def _forecast_accounts(open_items: pd.DataFrame, company_id: int) -> pd.Series:
+    """Bank account each open item is expected on: its own, else the partner's usual paying one, else ""."""
+    hist = pd.read_sql_query(text(FORECAST_ACCOUNTS_SQL), READ_ENGINE, params={"company_id": company_id})
+    hist = hist.assign(side=hist["doc_type"].map(_AGING_SIDE_OF)).astype({"counterparty_id": "float64", "n": "int64"})
+    usual = (
+        hist.groupby(["side", "counterparty_id", "bank_account"], as_index=False)["n"].sum()
+        .sort_values(["n", "bank_account"], ascending=[False, True])
+        .drop_duplicates(["side", "counterparty_id"])
+        .set_index(["side", "counterparty_id"])["bank_account"]
+    )
+    keys = pd.MultiIndex.from_arrays([open_items["side"], open_items["counterparty_id"].astype("float64")])
+    by_partner = pd.Series(usual.reindex(keys).to_numpy(), index=open_items.index)
+    return open_items["bank_account"].where(open_items["bank_account"] != "", by_partner.fillna(""))
+
+
+@st.cache_data(ttl=300, max_entries=8)
+def load_forecast_events(as_of: date, company_id: int = DEFAULT_COMPANY_ID, data_version: int = 0) -> pd.DataFrame:
+    """Expected cash movements from `as_of` on (`FORECAST_EVENT_COLUMNS`), up to the longest horizon.
+
+    `amount` is signed (Income in, Expense / Bill out); `source` is a `FORECAST_SOURCES` key.
+    Overdue and undated open items are expected on `as_of`; open items without a bank_account
+    take the partner's usual one (`_forecast_accounts`) or stay on "".
+    """
+    today = pd.Timestamp(as_of)
+    end = _forecast_bounds("months", as_of)[-1]
+
+    items = pd.read_sql_query(text(FORECAST_OPEN_SQL), READ_ENGINE, params={"company_id": company_id}).astype(
+        {"amount": "float64"}
+    )
+    items["side"] = items["doc_type"].map(_AGING_SIDE_OF)
+    due = pd.to_datetime(items["doc_date"], errors="coerce", format="ISO8601") + pd.to_timedelta(
+        _forecast_days_to_pay(items, company_id).round(), unit="D"
+    )
+    items = items.assign(
+        date=due.fillna(today).clip(lower=today), source="open", bank_account=_forecast_accounts(items, company_id)
+    )
+
+    last = today.to_period("M") - 1
+    first = last - (FORECAST_RECURRING_MONTHS - 1)
+    paid = pd.read_sql_query(
+        text(FORECAST_RECURRING_SQL),
+        READ_ENGINE,
+        params={
+            "company_id": company_id,
+            "first_year": first.year, "last_year": last.year,
+            "first": first.year * 100 + first.month, "last": last.year * 100 + last.month,
+        },
+    ).astype({"amount": "float64"})
+    paid["day"] = pd.to_datetime(paid["last_date"], errors="coerce", format="ISO8601").dt.day
+    series = (
+        paid.groupby(["bank_account", "doc_type", "counterparty_id", "counterparty"], dropna=False, as_index=False)
+        .agg(months=("amount", "size"), amount=("amount", "median"), low=("amount", "min"),
+             high=("amount", "max"), day=("day", "median"))
+    )
+    spread = FORECAST_RECURRING_SPREAD * series["amount"].abs()
+    series = series[
+        (series["months"] >= FORECAST_RECURRING_MIN)
+        & (series["low"] >= series["amount"] - spread)
+        & (series["high"] <= series["amount"] + spread)
+    ]
+    months = pd.DataFrame({"month": pd.date_range(today.to_period("M").to_timestamp(), end, freq="MS")[1:-1]})
+    recurring = series.merge(months, how="cross")
+    # Day of month capped at 28 so every month has it.
+    recurring["date"] = recurring["month"] + pd.to_timedelta(recurring["day"].fillna(1).clip(1, 28).round() - 1, unit="D")
+    recurring["source"] = "recurring"
+
+    events = pd.concat(
+        [items[FORECAST_EVENT_COLUMNS], recurring[FORECAST_EVENT_COLUMNS]], ignore_index=True
+    )
+    events = events[events["date"] < end]
+    events["amount"] = events["amount"].where(events["doc_type"] == "Income", -events["amount"])
+    return events.sort_values(["date", "bank_account"], ignore_index=True)
+
+
+@st.cache_data(ttl=300, max_entries=8)
+def load_cash_forecast(
+    horizon: str, as_of: date, company_id: int = DEFAULT_COMPANY_ID, data_version: int = 0
+) -> pd.DataFrame:
+    """Projected inflow / outflow / closing balance per bank_account and period.
+
+    `horizon` is a `FORECAST_HORIZONS` key; one row per account and period (`start` date).
+    """
+    bounds = _forecast_bounds(horizon, as_of)
+    events = load_forecast_events(as_of, company_id, data_version)
+    events = events[events["date"] < bounds[-1]]
+    positions = load_cash_positions(company_id, data_version)
+    opening = (
+        positions["amount_gross"].where(positions["doc_type"] == "Income", -positions["amount_gross"])
+        .groupby(positions["bank_account"]).sum()
+    )
+    accounts = sorted(set(opening.index) | set(events["bank_account"]))
+    grid = pd.MultiIndex.from_product([accounts, range(len(bounds) - 1)], names=["bank_account", "period"])
+    flows = (
+        events.assign(
+            period=bounds[:-1].searchsorted(events["date"], side="right") - 1,
+            inflow=events["amount"].clip(lower=0),
+            outflow=(-events["amount"]).clip(lower=0),
+        )
+        .groupby(["bank_account", "period"])[["inflow", "outflow"]].sum()
+        .reindex(grid, fill_value=0.0)
+        .reset_index()
+    )
+    flows["start"] = bounds[:-1][flows["period"]]
+    flows["net"] = flows["inflow"] - flows["outflow"]
+    flows["opening"] = opening.reindex(flows["bank_account"]).fillna(0.0).to_numpy()
+    flows["balance"] = flows["opening"] + flows.groupby("bank_account")["net"].cumsum()
+    return flows.astype({"inflow": "float64", "outflow": "float64", "net": "float64", "balance": "float64"})
+
+# --- 4.5.2 PERIOD CLOSE ---
+# Closing works like a lock date: `companies.closed_through` (YYYYMM, 0 = none) is the
+# company's last closed month and every month up to it is closed. A close freezes per-month
+# aggregates in `period_snapshots` (VAT per doc_type, paid totals per account, totals per
+# counterparty) plus `opening_*` balances for the first open month. Reports read those
+# for closed months; the write helpers refuse rows dated in a closed month. Paid totals per
+# account are filed under the payment month (`REPORT_PAID_PERIOD_KEY_SQL`), so a later
+# settlement of a closed-month document lands in an open month.
+PERIOD_SNAPSHOT_COLUMNS = (
+    "company_id, fiscal_year, period_month, kind, name, doc_type, status, "
+    "n, amount_net, vat_amount, amount_gross, last_date"
+)
+PERIOD_BALANCE_COLUMNS = ["name", "doc_type", "status", "n", "amount_net", "vat_amount", "amount_gross", "last_date"]
+_PERIOD_RANGE_SQL = f"{REPORT_PERIOD_KEY_SQL} > :after AND {REPORT_PERIOD_KEY_SQL} <= :through"
+_PERIOD_AGG_SQL = (
+    f"COUNT(*), SUM(COALESCE(amount_net, 0)), SUM(COALESCE(vat_amount, 0)), SUM({REPORT_GROSS_SQL}), MAX(doc_date)"
+)
+# kind -> (name, status, extra condition) over journal_v; constants are left out of
+# the GROUP BY (Postgres rejects them there).
+PERIOD_SNAPSHOT_KINDS = {
+    "vat": ("''", "''", ""),
+    "counterparty": ("COALESCE(TRIM(counterparty), '')", "COALESCE(TRIM(status), '')", ""),
+}
+PERIOD_SNAPSHOT_SQL = {}
+for _kind, (_name, _status, _cond) in PERIOD_SNAPSHOT_KINDS.items():
+    _group = ["fiscal_year", "period_month", _name, "COALESCE(TRIM(doc_type), '')", _status]
+    PERIOD_SNAPSHOT_SQL[_kind] = f"""INSERT INTO period_snapshots ({PERIOD_SNAPSHOT_COLUMNS})
+        SELECT CAST(:company_id AS INTEGER), fiscal_year, period_month, '{_kind}', {_name},
+            COALESCE(TRIM(doc_type), ''), {_status}, {_PERIOD_AGG_SQL}
+        FROM journal_v
+        WHERE company_id = :company_id AND {_PERIOD_RANGE_SQL} {_cond}
+        GROUP BY {", ".join(g for g in _group if not g.startswith("'"))}"""
+PERIOD_SNAPSHOT_SQL["account"] = f"""INSERT INTO period_snapshots ({PERIOD_SNAPSHOT_COLUMNS})
+    SELECT CAST(:company_id AS INTEGER), paid_key / 100, paid_key % 100, 'account', bank_account, doc_type, 'Paid',
+        COUNT(*), SUM(COALESCE(amount_net, 0)), SUM(COALESCE(vat_amount, 0)), SUM(amount_gross), MAX(doc_date)
+    FROM (
+        SELECT {REPORT_PAID_PERIOD_KEY_SQL} AS paid_key, COALESCE(TRIM(bank_account), '') AS bank_account,
+            COALESCE(TRIM(doc_type), '') AS doc_type, amount_net, vat_amount, {REPORT_GROSS_SQL} AS amount_gross, doc_date
+        FROM journal_v
+        WHERE company_id = :company_id AND TRIM(status) = 'Paid'
+    ) paid
+    WHERE paid_key > :after AND paid_key <= :through
+    GROUP BY paid_key, bank_account, doc_type"""
+# Settling a closed-month row moves it between the status groups of its frozen counterparty
+# totals (its month and the opening balance); the totals themselves do not change.
+_AMEND_STATUS_SQL = f"""INSERT INTO period_snapshots ({PERIOD_SNAPSHOT_COLUMNS})
+    SELECT CAST(:company_id AS INTEGER), {{year}}, {{month}}, '{{kind}}', name, doc_type, {{status}},
+        {{sign}} * COUNT(*), {{sign}} * SUM(amount_net), {{sign}} * SUM(vat_amount), {{sign}} * SUM(amount_gross),
+        MAX(doc_date)
+    FROM (
+        SELECT fiscal_year, period_month, COALESCE(TRIM(counterparty), '') AS name,
+            COALESCE(TRIM(doc_type), '') AS doc_type, COALESCE(TRIM(status), '') AS status,
+            COALESCE(amount_net, 0) AS amount_net, COALESCE(vat_amount, 0) AS vat_amount,
+            {REPORT_GROSS_SQL} AS amount_gross, doc_date
+        FROM journal_v
+        WHERE company_id = :company_id AND id IN ({{ids}}) AND {REPORT_PERIOD_KEY_SQL} <= :closed_through
+            AND COALESCE(TRIM(status), '') <> :new_status {{from_status}}
+    ) moved
+    GROUP BY {{group}}"""
+# Opening balances: everything frozen up to `through`, summed from the month snapshots.
+PERIOD_OPENING_KINDS = ("account", "counterparty")
+PERIOD_OPENING_SQL = f"""INSERT INTO period_snapshots ({PERIOD_SNAPSHOT_COLUMNS})
+    SELECT CAST(:company_id AS INTEGER), CAST(:open_year AS INTEGER), CAST(:open_month AS INTEGER),
+        'opening_{{kind}}', name, doc_type, status,
+        SUM(n), SUM(amount_net), SUM(vat_amount), SUM(amount_gross), MAX(last_date)
+    FROM period_snapshots
+    WHERE company_id = :company_id AND kind = '{{kind}}' AND {REPORT_PERIOD_KEY_SQL} <= :through
+    GROUP BY name, doc_type, status"""
+PERIOD_VAT_TOTALS_SQL = """SELECT doc_type, SUM(n) AS n, SUM(amount_net) AS amount_net,
+        SUM(vat_amount) AS vat_amount, SUM(amount_gross) AS amount_gross
+    FROM period_snapshots
+    WHERE company_id = :company_id AND kind = 'vat' AND fiscal_year = :year AND period_month BETWEEN :first AND :last
+    GROUP BY doc_type ORDER BY doc_type"""
+PERIOD_CASH_FLOW_SQL = """SELECT fiscal_year, period_month,
+        SUM(CASE WHEN doc_type = 'Income' THEN 1 ELSE -1 END * amount_gross) AS flow
+    FROM period_snapshots
+    WHERE company_id = :company_id AND kind = 'account'
+    GROUP BY fiscal_year, period_month"""
+
+
+def _period_key(year: Any, month: Any) -> int:
+    return int(year) * 100 + int(month)
+
+
+def _next_period(key: int) -> tuple[int, int]:
+    year, month = divmod(int(key), 100)
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def format_period_key(key: int) -> str:
+    """'MM/YYYY' for a YYYYMM period key."""
+    year, month = divmod(int(key), 100)
+    return f"{month:02d}/{year}"
+
+
+def get_closed_through(
+    conn: Optional[Connection] = None, for_update: bool = False, company_id: Optional[int] = None
+) -> int:
+    """Last closed month of the company (default: the session's) as YYYYMM (0 when nothing is closed).
+
+    Inside a unit of work the `companies` row is locked on Postgres (shared for writes that
+    check it, exclusive for close/reopen), so the check and the write cannot interleave.
+    """
+    sql = "SELECT closed_through FROM companies WHERE id = :company_id"
+    params = {"company_id": COMPANY_ID if company_id is None else company_id}
+    if conn is None:
+        return int(db_scalar(sql, params, default=0) or 0)
+    if DB_DIALECT == "postgres":
+        sql += " FOR UPDATE" if for_update else " FOR SHARE"
+    return int(conn.execute(text(sql), params).scalar() or 0)
+
+
+def closed_month_of(year: int, company_id: Optional[int] = None) -> int:
+    """Last closed month (0-12) of `year`."""
+    closed_year, closed_month = divmod(get_closed_through(company_id=company_id), 100)
+    if closed_year > int(year):
+        return 12
+    return closed_month if closed_year == int(year) else 0
+
+
+def assert_open_period(conn: Connection, rows: Iterable[Dict[str, Any]] = (), ids: Iterable[int] = ()) -> None:
+    """Raise ValueError when a write touches a closed month.
+
+    `rows` are write params (ISO `doc_date`, see `_journal_write_rows`); `ids` are existing
+    journal rows that would be changed or deleted.
+    """
+    closed = get_closed_through(conn)
+    if not closed:
+        return
+    for r in rows:
+        d = r.get("doc_date")
+        if d and _period_key(d[:4], d[5:7]) <= closed:
+            raise ValueError(f"Η περίοδος {d[5:7]}/{d[:4]} είναι κλειστή.")
+    for params in _id_chunks(ids):
+        placeholders = ", ".join(f":{k}" for k in params)
+        locked = conn.execute(
+            text(
+                f"SELECT COUNT(*) FROM journal WHERE company_id = :company_id AND id IN ({placeholders}) "
+                f"AND {REPORT_PERIOD_KEY_SQL} <= :closed_through"
+            ),
+            {**params, "company_id": COMPANY_ID, "closed_through": closed},
+        ).scalar()
+        if locked:
+            raise ValueError(
+                f"{locked} εγγραφές ανήκουν σε κλειστή περίοδο (έως {format_period_key(closed)}) και δεν αλλάζουν."
+            )
+
+
+# Settlement fields of a row. Changing only these is allowed on rows dated in a closed month
+# (see `assert_open_settlement`); the other journal columns feed the frozen VAT and partner totals.
+JOURNAL_SETTLEMENT_COLUMNS = ("status", "bank_account", "payment_method", "paid_date")
+JOURNAL_LOCKED_COLUMNS = ("doc_date", "doc_type", "counterparty", "gl_code", "amount_net", "vat_amount", "amount_gross")
+
+
+def assert_open_settlement(conn: Connection, ids: Iterable[int] = (), paid_dates: Iterable[str] = ()) -> None:
+    """Raise ValueError when a settlement change would touch a payment in a closed month.
+
+    `paid_dates` are new payment dates (ISO); `ids` are rows whose status / account change,
+    which must not already be paid in a closed month.
+    """
+    closed = get_closed_through(conn)
+    if not closed:
+        return
+    for d in paid_dates:
+        if d and _period_key(d[:4], d[5:7]) <= closed:
+            raise ValueError(f"Η πληρωμή της {d[8:10]}/{d[5:7]}/{d[:4]} πέφτει σε κλειστή περίοδο.")
+    for params in _id_chunks(ids):
+        placeholders = ", ".join(f":{k}" for k in params)
+        locked = conn.execute(
+            text(
+                f"SELECT COUNT(*) FROM journal WHERE company_id = :company_id AND id IN ({placeholders}) "
+                f"AND status_id = (SELECT id FROM {JOURNAL_ENUMS['status']} WHERE name = 'Paid') "
+                f"AND {REPORT_PAID_PERIOD_KEY_SQL} <= :closed_through"
+            ),
+            {**params, "company_id": COMPANY_ID, "closed_through": closed},
+        ).scalar()
+        if locked:
+            raise ValueError(
+                f"{locked} εγγραφές εξοφλήθηκαν σε κλειστή περίοδο (έως {format_period_key(closed)}) και δεν αλλάζουν."
+            )
+
+
+def _amend_closed_status(
+    conn: Connection, ids: Iterable[int], new_status: str, from_status: Optional[str] = None
+) -> None:
+    """Move closed-month rows among `ids` to `new_status` in the frozen counterparty totals.
+
+    Call before the status update. With `from_status`, only rows currently in that status move.
+    """
+    closed = get_closed_through(conn)
+    if not closed:
+        return
+    open_year, open_month = _next_period(closed)
+    base = {
+        "company_id": COMPANY_ID, "closed_through": closed, "open_year": open_year, "open_month": open_month,
+        "new_status": (new_status or "").strip(), "from_status": from_status,
+    }
+    status_filter = "AND COALESCE(TRIM(status), '') = :from_status" if from_status is not None else ""
+    targets = [
+        ("counterparty", "fiscal_year", "period_month", "fiscal_year, period_month, "),
+        ("opening_counterparty", "CAST(:open_year AS INTEGER)", "CAST(:open_month AS INTEGER)", ""),
+    ]
+    for params in _id_chunks(ids):
+        placeholders = ", ".join(f":{k}" for k in params)
+        for kind, year, month, period_group in targets:
+            for sign, status, group in (
+                ("-1", "status", "name, doc_type, status"),
+                ("1", "CAST(:new_status AS VARCHAR(20))", "name, doc_type"),
+            ):
+                sql = _AMEND_STATUS_SQL.format(
+                    year=year, month=month, kind=kind, status=status, sign=sign, ids=placeholders,
+                    from_status=status_filter, group=period_group + group,
+                )
+                conn.execute(text(sql), {**params, **base})
+
+
+def _write_opening_balances(conn: Connection, through: int, company_id: Optional[int] = None) -> None:
+    open_year, open_month = _next_period(through)
+    params = {
+        "company_id": COMPANY_ID if company_id is None else company_id, "open_year": open_year, "open_month": open_month,
+    }
+    conn.execute(
+        text(
+            "DELETE FROM period_snapshots WHERE company_id = :company_id AND kind LIKE 'opening_%' "
+            "AND fiscal_year = :open_year AND period_month = :open_month"
+        ),
+        params,
+    )
+    for kind in PERIOD_OPENING_KINDS:
+        conn.execute(text(PERIOD_OPENING_SQL.format(kind=kind)), {**params, "through": through})
+
+
+COMPANY_CLOSED_THROUGH_SQL = "UPDATE companies SET closed_through = :v WHERE id = :company_id"
+
+
+def close_period(year: int, month: Optional[int] = None, quarter: Optional[int] = None) -> int:
+    """Close every open month up to the end of a month / quarter / year, as one unit of work.
+
+    Writes the month snapshots and the opening balances of the next month, then moves
+    `closed_through`. Returns the number of journal rows that were closed.
+    """
+    through = _period_key(year, _period_months(month, quarter)[1])
+    if through >= _period_key(date.today().year, date.today().month):
+        raise ValueError("Κλείνουν μόνο περίοδοι που έχουν λήξει.")
+    with db_unit_of_work() as conn:
+        after = get_closed_through(conn, for_update=True)
+        if through <= after:
+            raise ValueError(f"Η περίοδος είναι ήδη κλειστή (έως {format_period_key(after)}).")
+        params = {"company_id": COMPANY_ID, "after": after, "through": through}
+        closed_rows = conn.execute(
+            text(f"SELECT COUNT(*) FROM journal WHERE company_id = :company_id AND {_PERIOD_RANGE_SQL}"), params
+        ).scalar()
+        for sql in PERIOD_SNAPSHOT_SQL.values():
+            conn.execute(text(sql), params)
+        _write_opening_balances(conn, through)
+        conn.execute(text(COMPANY_CLOSED_THROUGH_SQL), {"company_id": COMPANY_ID, "v": through})
+    return int(closed_rows or 0)
+
+
+def reopen_period(year: int, month: int) -> None:
+    """Reopen `month`/`year` and every later month (their snapshots are dropped), as one unit of work."""
+    key = _period_key(year, month)
+    keep = _period_key(year - 1, 12) if int(month) == 1 else key - 1
+    company = {"company_id": COMPANY_ID}
+    with db_unit_of_work() as conn:
+        if key > get_closed_through(conn, for_update=True):
+            raise ValueError(f"Η περίοδος {format_period_key(key)} δεν είναι κλειστή.")
+        conn.execute(
+            text(f"DELETE FROM period_snapshots WHERE company_id = :company_id AND {REPORT_PERIOD_KEY_SQL} > :keep"),
+            {**company, "keep": keep},
+        )
+        if not conn.execute(
+            text("SELECT COUNT(*) FROM period_snapshots WHERE company_id = :company_id AND kind = 'vat'"), company
+        ).scalar():
+            keep = 0
+            conn.execute(text("DELETE FROM period_snapshots WHERE company_id = :company_id"), company)
+        else:
+            _write_opening_balances(conn, keep)
+        conn.execute(text(COMPANY_CLOSED_THROUGH_SQL), {**company, "v": keep})
+
+
+def rename_snapshot_name(kind: str, old: str, new: str, conn: Optional[Connection] = None) -> None:
+    """Follow a partner / account rename in the `kind` and `opening_<kind>` snapshots."""
+    _execute_on(
+        conn,
+        "UPDATE period_snapshots SET name = :new "
+        "WHERE company_id = :company_id AND kind IN (:kind, :opening) AND name = :old",
+        {"company_id": COMPANY_ID, "new": new, "old": old, "kind": kind, "opening": f"opening_{kind}"},
+    )
+
+
+# Rev 2: paid totals per account are filed under the payment month (they used the document month).
+PERIOD_SNAPSHOT_REV = 2
+
+
+def _ensure_period_snapshot_rev() -> None:
+    """Re-file the `account` snapshots of every closed company under the current rules, once.
+
+    Rows in closed months could not change, so rebuilding from them reproduces the frozen totals.
+    """
+    current = db_scalar("SELECT value FROM app_meta WHERE key = 'period_snapshot_rev'", default=None)
+    if current is not None and int(current) >= PERIOD_SNAPSHOT_REV:
+        return
+    with db_unit_of_work() as conn:
+        closed = conn.execute(text("SELECT id, closed_through FROM companies WHERE closed_through > 0")).fetchall()
+        for company_id, through in closed:
+            params = {"company_id": company_id, "after": 0, "through": int(through)}
+            conn.execute(
+                text("DELETE FROM period_snapshots WHERE company_id = :company_id AND kind = 'account'"), params
+            )
+            conn.execute(text(PERIOD_SNAPSHOT_SQL["account"]), params)
+            _write_opening_balances(conn, int(through), company_id)
+        conn.execute(
+            text(
+                "INSERT INTO app_meta (key, value) VALUES ('period_snapshot_rev', :v) "
+                "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value"
+            ),
+            {"v": PERIOD_SNAPSHOT_REV},
+        )
+
+
+if not st.session_state.get("period_snapshots_checked"):
+    _ensure_period_snapshot_rev()
+    st.session_state["period_snapshots_checked"] = True
+
+
+def load_vat_snapshot(year: int, first: int, last: int, company_id: Optional[int] = None) -> pd.DataFrame:
+    """Frozen per-doc_type totals of the closed months `first`..`last` of `year`."""
+    return pd.read_sql_query(
+        text(PERIOD_VAT_TOTALS_SQL),
+        ENGINE,
+        params={
+            "company_id": COMPANY_ID if company_id is None else company_id,
+            "year": int(year), "first": int(first), "last": int(last),
+        },
+    )
+
+
+def load_opening_balances(kind: str, name: Optional[str] = None, company_id: Optional[int] = None) -> pd.DataFrame:
+    """Opening balances (`opening_<kind>` rows) of the first open month, optionally for one name."""
+    company_id = COMPANY_ID if company_id is None else company_id
+    closed = get_closed_through(company_id=company_id)
+    if not closed:
+        return pd.DataFrame(columns=PERIOD_BALANCE_COLUMNS)
+    open_year, open_month = _next_period(closed)
+    sql = (
+        f"SELECT {', '.join(PERIOD_BALANCE_COLUMNS)} FROM period_snapshots "
+        "WHERE company_id = :company_id AND kind = :kind AND fiscal_year = :open_year AND period_month = :open_month"
+    )
+    params = {"company_id": company_id, "kind": f"opening_{kind}", "open_year": open_year, "open_month": open_month}
+    if name is not None:
+        sql += " AND name = :name"
+        params["name"] = name
+    return pd.read_sql_query(text(sql), ENGINE, params=params)
+
+
 # --- 4.6 INPUT VALIDATION ---
 def validate_transaction_input(trans_data):
     """Validate transaction data before database insert."""
@@ -1068,146 +4232,1015 @@ def validate_transaction_input(trans_data):
     
     return errors
 
+
+VAT_RATES = [24, 13, 6, 0]
+BATCH_DOC_TYPES = ["Bill", "Expense", "Income", "Transfer", "Cash Withdrawal", "Cash Deposit", "Bank Operation"]
+
+
+def compute_batch_amounts(df: pd.DataFrame) -> pd.DataFrame:
+    """Vectorized VAT/gross for the batch-entry grid (same rounding as `calculate_vat`)."""
+    out = df.copy()
+    net = pd.to_numeric(out["amount_net"], errors="coerce")
+    rate = pd.to_numeric(out["vat_rate"], errors="coerce").fillna(0.0)
+    out["amount_net"] = net
+    out["vat_amount"] = (net * rate / 100.0).round(2)
+    out["amount_gross"] = (net + out["vat_amount"]).round(2)
+    return out
+
+
+def validate_transaction_frame(df: pd.DataFrame) -> pd.Series:
+    """Column-wise version of `validate_transaction_input` for many rows at once.
+
+    Returns one string per row: empty when the row is valid, otherwise the joined error messages.
+    """
+    def _blank(col: str) -> pd.Series:
+        if col not in df.columns:
+            return pd.Series(True, index=df.index)
+        return df[col].fillna("").astype(str).str.strip().eq("")
+
+    net = pd.to_numeric(df.get("amount_net"), errors="coerce")
+    vat = pd.to_numeric(df.get("vat_amount"), errors="coerce").fillna(0.0)
+    gross = pd.to_numeric(df.get("amount_gross"), errors="coerce").fillna(0.0)
+    dates = pd.to_datetime(df.get("doc_date"), errors="coerce")
+    rates = pd.to_numeric(df.get("vat_rate"), errors="coerce")
+
+    checks = [
+        (_blank("counterparty"), "Παραλήπτης/Προμηθευτής είναι υποχρεωτικό"),
+        (_blank("description"), "Περιγραφή είναι υποχρεωτική"),
+        (net.isna(), "Μη έγκυρο καθαρό ποσό"),
+        (net < 0, "Καθαρό ποσό δεν μπορεί να είναι αρνητικό"),
+        (vat < 0, "ΦΠΑ δεν μπορεί να είναι αρνητικό"),
+        (gross < 0, "Σύνολο δεν μπορεί να είναι αρνητικό"),
+        (gross < net.fillna(0.0), "Σύνολο δεν μπορεί να είναι μικρότερο από καθαρό"),
+        (dates.isna(), "Μη έγκυρη ημερομηνία"),
+        (~rates.isin(VAT_RATES), "Μη έγκυρος συντελεστής ΦΠΑ"),
+        (_blank("doc_type"), "Τύπος είναι υποχρεωτικός"),
+    ]
+    errors = pd.Series("", index=df.index, dtype=object)
+    for mask, message in checks:
+        mask = mask.fillna(False).astype(bool)
+        errors = errors.where(~mask, errors + message + "; ")
+    return errors.str.rstrip("; ")
+
+
+def batch_frame_to_rows(df: pd.DataFrame) -> list[Dict[str, Any]]:
+    """Map validated grid rows to journal insert params (payment method derived per row)."""
+    bank = df["bank_account"].fillna("").astype(str).str.strip()
+    status = df["status"].fillna("").astype(str).str.strip().replace("", "Unpaid")
+    is_cash = bank.map(lambda b: bool(b) and _bank_kind_from_name(b) == "cash")
+    payment = pd.Series("Τράπεζα", index=df.index)
+    payment = payment.where(~is_cash, "Μετρητά").where(bank.ne("") | status.ne("Unpaid"), "Επί Πιστώσει")
+    out = pd.DataFrame(
+        {
+            "doc_date": pd.to_datetime(df["doc_date"], errors="coerce").dt.strftime("%Y-%m-%d"),
+            "doc_no": df["doc_no"].fillna("").astype(str).str.strip(),
+            "doc_type": df["doc_type"].fillna("").astype(str).str.strip(),
+            "counterparty": df["counterparty"].fillna("").astype(str).str.strip(),
+            "description": df["description"].fillna("").astype(str).str.strip(),
+            "gl_code": df["gl_code"].fillna("").astype(str).str.split(" - ").str[0].str.strip().replace("", "999"),
+            "amount_net": df["amount_net"].astype(float),
+            "vat_amount": df["vat_amount"].astype(float),
+            "amount_gross": df["amount_gross"].astype(float),
+            "payment_method": payment,
+            "bank_account": bank,
+            "status": status,
+        }
+    )
+    return out.to_dict("records")
+
+# --- Recurring templates (rent, salaries, subscriptions, loan installments) ---
+# A template is a batch-grid row plus a schedule. `generate_recurring` inserts every due
+# occurrence up to a date in one multi-row insert. Each row carries
+# `recurring_key` = "<template id>:<YYYY-MM>" under a unique index, so reruns (or two
+# sessions at once) never write a period twice. Skipped periods (a deleted occurrence, or
+# one skipped before it was written) are kept in `recurring_skips` and not generated again.
+RECURRING_FREQUENCIES = {"monthly": ("Μηνιαία", 1), "quarterly": ("Τριμηνιαία", 3), "yearly": ("Ετήσια", 12)}
+RECURRING_COLUMNS = [
+    "id", "active", "description", "doc_type", "counterparty", "gl_code", "amount_net", "vat_rate",
+    "bank_account", "status", "frequency", "day_of_month", "start_date", "end_date",
+]
+RECURRING_INSERT_SQL = _journal_insert_sql(("recurring_key",), conflict_key="company_id, recurring_key")
+
+
+def load_recurring_templates() -> pd.DataFrame:
+    """The company's recurring templates (read on ENGINE: the editor feeds `save_recurring_templates`)."""
+    df = pd.read_sql_query(
+        text(f"SELECT {', '.join(RECURRING_COLUMNS)} FROM recurring_templates WHERE company_id = :company_id ORDER BY id"),
+        ENGINE,
+        params={"company_id": COMPANY_ID},
+    )
+    for col in ("start_date", "end_date"):
+        df[col] = pd.to_datetime(df[col], errors="coerce", format="ISO8601").dt.date
+    return df.astype({"active": "bool"})
+
+
+def validate_recurring_frame(df: pd.DataFrame) -> pd.Series:
+    """`validate_transaction_frame` on the first occurrence, plus the schedule fields."""
+    errors = validate_transaction_frame(compute_batch_amounts(df.assign(doc_date=df["start_date"])))
+    day = pd.to_numeric(df["day_of_month"], errors="coerce")
+    start = pd.to_datetime(df["start_date"], errors="coerce")
+    end = pd.to_datetime(df["end_date"], errors="coerce")
+    checks = [
+        (~df["frequency"].isin(list(RECURRING_FREQUENCIES)), "Μη έγκυρη συχνότητα"),
+        (day.notna() & ~day.between(1, 31), "Η ημέρα του μήνα πρέπει να είναι 1-31"),
+        (end.notna() & (end < start), "Η λήξη είναι πριν από την έναρξη"),
+    ]
+    for mask, message in checks:
+        mask = mask.fillna(False).astype(bool)
+        errors = errors.where(~mask, errors + "; " + message)
+    return errors.str.strip("; ")
+
+
+def _recurring_params(df: pd.DataFrame) -> list[Dict[str, Any]]:
+    """Template rows as `recurring_templates` params (GL labels cut to the code)."""
+    day = pd.to_numeric(df["day_of_month"], errors="coerce")
+    out = pd.DataFrame(
+        {
+            "id": pd.to_numeric(df["id"], errors="coerce"),
+            "active": df["active"].fillna(True).astype(bool).astype(int),
+            **{
+                col: df[col].fillna("").astype(str).str.strip()
+                for col in ("description", "doc_type", "counterparty", "bank_account", "status", "frequency")
+            },
+            "gl_code": df["gl_code"].fillna("").astype(str).str.split(" - ").str[0].str.strip().replace("", "999"),
+            "amount_net": pd.to_numeric(df["amount_net"], errors="coerce").fillna(0.0).round(2),
+            "vat_rate": pd.to_numeric(df["vat_rate"], errors="coerce").fillna(0.0),
+            "day_of_month": day.astype(object).where(day.notna(), None),
+            **{
+                col: pd.to_datetime(df[col], errors="coerce").dt.strftime("%Y-%m-%d").astype(object)
+                for col in ("start_date", "end_date")
+            },
+        }
+    )
+    out["status"] = out["status"].replace("", "Unpaid")
+    rows = []
+    for row in out.to_dict("records"):
+        row = {k: (None if not isinstance(v, str) and pd.isna(v) else v) for k, v in row.items()}
+        rows.append({**row, **{k: int(row[k]) for k in ("id", "day_of_month") if row[k] is not None}})
+    return rows
+
+
+def save_recurring_templates(original: pd.DataFrame, edited: pd.DataFrame) -> Dict[str, int]:
+    """Apply the template editor changes (by id), as one unit of work.
+
+    Raises ValueError (nothing is written) if an edited row is invalid. Blank new rows are ignored.
+    Returns the number of inserted/updated/deleted templates.
+    """
+    filled = edited[
+        edited["id"].notna()
+        | edited["counterparty"].fillna("").astype(str).str.strip().ne("")
+        | pd.to_numeric(edited["amount_net"], errors="coerce").fillna(0.0).ne(0.0)
+    ]
+    errors = validate_recurring_frame(filled)
+    bad = errors[errors != ""]
+    if not bad.empty:
+        raise ValueError(" | ".join(f"Γραμμή {i + 1}: {e}" for i, e in bad.items()))
+    before = {int(r["id"]): r for r in _recurring_params(original)} if not original.empty else {}
+    after = _recurring_params(filled) if not filled.empty else []
+    company = {"company_id": COMPANY_ID}
+    inserts = [{**company, **{k: v for k, v in r.items() if k != "id"}} for r in after if r["id"] is None]
+    updates = [
+        {**company, **r} for r in after if r["id"] is not None and int(r["id"]) in before and r != before[int(r["id"])]
+    ]
+    kept = {int(r["id"]) for r in after if r["id"] is not None}
+    deletes = [{**company, "id": rid} for rid in before if rid not in kept]
+    cols = [c for c in RECURRING_COLUMNS if c != "id"]
+    with db_unit_of_work() as conn:
+        if inserts:
+            conn.execute(
+                text(
+                    f"INSERT INTO recurring_templates (company_id, {', '.join(cols)}) "
+                    f"VALUES (:company_id, {', '.join(f':{c}' for c in cols)})"
+                ),
+                inserts,
+            )
+        if updates:
+            conn.execute(
+                text(
+                    f"UPDATE recurring_templates SET {', '.join(f'{c} = :{c}' for c in cols)} "
+                    "WHERE id = :id AND company_id = :company_id"
+                ),
+                updates,
+            )
+        if deletes:
+            conn.execute(text("DELETE FROM recurring_templates WHERE id = :id AND company_id = :company_id"), deletes)
+            conn.execute(
+                text(
+                    "DELETE FROM recurring_skips WHERE company_id = :company_id "
+                    "AND recurring_key LIKE CAST(:id AS VARCHAR(20)) || ':%'"
+                ),
+                deletes,
+            )
+    return {"insert": len(inserts), "update": len(updates), "delete": len(deletes)}
+
+
+def recurring_occurrences(templates: pd.DataFrame, up_to: date) -> pd.DataFrame:
+    """Scheduled rows of the active templates from `start_date` through `up_to` (and `end_date`).
+
+    One row per template and period: the template columns plus `doc_date`, `doc_no` and
+    `recurring_key`. The day of month defaults to the start date's and is capped at month end.
+    """
+    last = pd.Timestamp(up_to)
+    frames = []
+    for t in templates[templates["active"].astype(bool)].itertuples(index=False):
+        start = pd.Timestamp(t.start_date) if pd.notna(t.start_date) else None
+        if start is None or t.frequency not in RECURRING_FREQUENCIES:
+            continue
+        end = min(last, pd.Timestamp(t.end_date)) if pd.notna(t.end_date) else last
+        step = RECURRING_FREQUENCIES[t.frequency][1]
+        months = pd.date_range(start.to_period("M").to_timestamp(), end, freq=f"{step}MS")
+        day = int(t.day_of_month) if pd.notna(t.day_of_month) else start.day
+        dates = months + pd.to_timedelta(months.days_in_month.to_series().clip(upper=day).to_numpy() - 1, unit="D")
+        dates = dates[(dates >= start) & (dates <= end)]
+        frames.append(pd.DataFrame({"id": t.id, "doc_date": dates}))
+    if not frames:
+        return pd.DataFrame(columns=[*RECURRING_COLUMNS, "doc_date", "doc_no", "recurring_key"])
+    occ = pd.concat(frames, ignore_index=True).merge(templates.drop(columns=["start_date"]), on="id")
+    occ["doc_no"] = ""
+    occ["recurring_key"] = occ["id"].astype(int).astype(str) + ":" + occ["doc_date"].dt.strftime("%Y-%m")
+    return occ
+
+
+def pending_recurring(up_to: date) -> pd.DataFrame:
+    """Occurrences up to `up_to` not written or skipped yet; `closed` flags those in a closed period."""
+    occ = recurring_occurrences(load_recurring_templates(), up_to)
+    done = pd.read_sql_query(
+        text(
+            "SELECT recurring_key FROM journal WHERE company_id = :company_id AND recurring_key IS NOT NULL "
+            "UNION ALL SELECT recurring_key FROM recurring_skips WHERE company_id = :company_id"
+        ),
+        ENGINE,
+        params={"company_id": COMPANY_ID},
+    )
+    occ = occ[~occ["recurring_key"].isin(done["recurring_key"])].reset_index(drop=True)
+    doc_date = pd.to_datetime(occ["doc_date"])
+    occ["closed"] = (doc_date.dt.year * 100 + doc_date.dt.month) <= get_closed_through()
+    return occ
+
+
+def generate_recurring(up_to: date) -> Dict[str, int]:
+    """Write every pending occurrence in open periods with one `save_journal_batch` call.
+
+    Returns the inserted rows and the occurrences left out because their period is closed.
+    """
+    occ = pending_recurring(up_to)
+    due = occ[~occ["closed"]]
+    rows = batch_frame_to_rows(compute_batch_amounts(due)) if not due.empty else []
+    for row, key in zip(rows, due["recurring_key"]):
+        row["recurring_key"] = key
+    inserted = save_journal_batch(rows, sql=RECURRING_INSERT_SQL) if rows else 0
+    return {"inserted": inserted, "closed": int(occ["closed"].sum())}
+
+
+def skip_recurring(keys: Iterable[str]) -> int:
+    """Mark occurrences (`recurring_key`s) as skipped, so `generate_recurring` leaves their period out."""
+    params = [{"company_id": COMPANY_ID, "k": str(k)} for k in dict.fromkeys(keys)]
+    if not params:
+        return 0
+    with db_unit_of_work() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO recurring_skips (company_id, recurring_key) VALUES (:company_id, :k) "
+                "ON CONFLICT (company_id, recurring_key) DO NOTHING"
+            ),
+            params,
+        )
+    return len(params)
+
+# --- Bank statements + reconciliation ---
+# Statement files (bank CSV export, OFX, CAMT.053 XML) are parsed to STATEMENT_COLUMNS
+# (`amount` signed: credit +, debit -) and stored in `bank_statement_lines`. A line's
+# `fingerprint` (account, date, cents, reference, text and its repeat number in the file)
+# is unique per company, so importing the same file again adds nothing.
+STATEMENT_COLUMNS = ["txn_date", "amount", "description", "reference", "counterparty"]
+# Folded (lower case, no accents) header names of common bank CSV exports.
+STATEMENT_CSV_ALIASES = {
+    "txn_date": ("ημερομηνια", "ημ/νια", "ημερομηνια συναλλαγης", "ημερομηνια λογιστικης", "date", "booking date"),
+    "value_date": ("ημερομηνια αξιας", "ημ/νια αξιας", "valeur", "value date"),
+    "amount": ("ποσο", "amount"),
+    "debit": ("χρεωση", "debit"),
+    "credit": ("πιστωση", "credit"),
+    "description": ("περιγραφη", "αιτιολογια", "description", "details", "narrative"),
+    "reference": ("αναφορα", "αρ. αναφορας", "αριθμος αναφορας", "reference", "ref"),
+    "counterparty": ("επωνυμια", "δικαιουχος", "αντισυμβαλλομενος", "counterparty", "payee", "name"),
+}
+STATEMENT_INSERT_SQL = """INSERT INTO bank_statement_lines
+        (company_id, bank_account, txn_date, amount, description, reference, counterparty, fingerprint)
+    VALUES (:company_id, :bank_account, :txn_date, :amount, :description, :reference, :counterparty, :fingerprint)
+    ON CONFLICT (company_id, fingerprint) DO NOTHING"""
+
+
+def _parse_statement_csv(data: bytes) -> pd.DataFrame:
+    import io
+
+    for encoding in ("utf-8-sig", "cp1253"):
+        try:
+            raw = pd.read_csv(io.BytesIO(data), sep=None, engine="python", dtype=str, encoding=encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    headers = dict(zip(_fold_text(pd.Series(raw.columns)), raw.columns))
+    cols = {
+        key: next((headers[a] for a in aliases if a in headers), None)
+        for key, aliases in STATEMENT_CSV_ALIASES.items()
+    }
+    if not (cols["txn_date"] or cols["value_date"]) or not (cols["amount"] or cols["debit"] or cols["credit"]):
+        raise ValueError("Δεν βρέθηκαν στήλες ημερομηνίας και ποσού στο αρχείο CSV.")
+    if cols["amount"]:
+        amount = _parse_amounts(raw[cols["amount"]])
+    else:
+        zero = pd.Series(0.0, index=raw.index)
+        credit = _parse_amounts(raw[cols["credit"]]).fillna(0.0) if cols["credit"] else zero
+        debit = _parse_amounts(raw[cols["debit"]]).fillna(0.0).abs() if cols["debit"] else zero
+        amount = credit - debit
+    text_col = lambda key: raw[cols[key]].fillna("").astype(str).str.strip() if cols[key] else ""
+    return pd.DataFrame({
+        "txn_date": _parse_dates(raw[cols["txn_date"] or cols["value_date"]]),
+        "amount": amount,
+        "description": text_col("description"),
+        "reference": text_col("reference"),
+        "counterparty": text_col("counterparty"),
+    })
+
+
+def _parse_statement_ofx(data: bytes) -> pd.DataFrame:
+    body = data.decode("utf-8", errors="replace")
+
+    def tag(block: str, name: str) -> str:
+        m = re.search(rf"<{name}>([^<\r\n]*)", block, re.IGNORECASE)
+        return m.group(1).strip() if m else ""
+
+    blocks = re.findall(r"<STMTTRN>(.*?)(?:</STMTTRN>|(?=<STMTTRN>)|(?=</BANKTRANLIST>))", body, re.IGNORECASE | re.DOTALL)
+    raw = pd.DataFrame(
+        [
+            {
+                "txn_date": tag(b, "DTPOSTED"),
+                "amount": tag(b, "TRNAMT"),
+                "description": tag(b, "MEMO") or tag(b, "NAME"),
+                "reference": tag(b, "FITID") or tag(b, "CHECKNUM"),
+                "counterparty": tag(b, "NAME"),
+            }
+            for b in blocks
+        ],
+        columns=STATEMENT_COLUMNS,
+    )
+    return raw.assign(txn_date=_parse_dates(raw["txn_date"]), amount=_parse_amounts(raw["amount"]))
+
+
+def _parse_statement_camt(data: bytes) -> pd.DataFrame:
+    import xml.etree.ElementTree as ET
+
+    def local(el) -> str:
+        return el.tag.rsplit("}", 1)[-1]
+
+    def find(el, path: str) -> str:
+        """Text of the first descendant matching a '/'-separated path of local names."""
+        nodes = [el]
+        for name in path.split("/"):
+            nodes = [c for n in nodes for c in n.iter() if local(c) == name and c is not n]
+            if not nodes:
+                return ""
+        return (nodes[0].text or "").strip()
+
+    rows = []
+    for entry in ET.fromstring(data).iter():
+        if local(entry) != "Ntry":
+            continue
+        debit = find(entry, "CdtDbtInd") == "DBIT"
+        rows.append({
+            "txn_date": find(entry, "BookgDt/Dt") or find(entry, "BookgDt/DtTm") or find(entry, "ValDt/Dt"),
+            "amount": ("-" if debit else "") + find(entry, "Amt"),
+            "description": find(entry, "RmtInf/Ustrd") or find(entry, "AddtlNtryInf"),
+            "reference": find(entry, "Refs/EndToEndId") or find(entry, "AcctSvcrRef"),
+            "counterparty": find(entry, "Cdtr/Nm") if debit else find(entry, "Dbtr/Nm"),
+        })
+    raw = pd.DataFrame(rows, columns=STATEMENT_COLUMNS)
+    return raw.assign(txn_date=_parse_dates(raw["txn_date"]), amount=_parse_amounts(raw["amount"]))
+
+
+def parse_bank_statement(data: bytes, filename: str) -> pd.DataFrame:
+    """Statement file (CSV / OFX / CAMT.053 by extension) to STATEMENT_COLUMNS.
+
+    Lines without a date or a non-zero amount are dropped. Raises ValueError on unknown formats.
+    """
+    ext = os.path.splitext(filename or "")[1].lower()
+    parsers = {".csv": _parse_statement_csv, ".txt": _parse_statement_csv, ".ofx": _parse_statement_ofx,
+               ".qfx": _parse_statement_ofx, ".xml": _parse_statement_camt}
+    if ext not in parsers:
+        raise ValueError(f"Μη υποστηριζόμενη μορφή αρχείου: {ext or filename}")
+    df = parsers[ext](data)
+    df = df[df["txn_date"].notna() & df["amount"].fillna(0.0).ne(0.0)]
+    return df[STATEMENT_COLUMNS].reset_index(drop=True).astype({"amount": "float64"})
+
+
+def import_statement_lines(df: pd.DataFrame, bank_account: str) -> Dict[str, int]:
+    """Store parsed statement lines for one account in one multi-row insert.
+
+    Lines already imported (same fingerprint) are skipped. Returns inserted / skipped counts.
+    """
+    account = (bank_account or "").strip()
+    if not account:
+        raise ValueError("Επιλέξτε τραπεζικό λογαριασμό.")
+    if df.empty:
+        return {"inserted": 0, "skipped": 0}
+    out = pd.DataFrame({
+        "company_id": COMPANY_ID,
+        "bank_account": account,
+        "txn_date": df["txn_date"].dt.strftime("%Y-%m-%d"),
+        "amount": df["amount"].round(2),
+        **{col: df[col].fillna("").astype(str).str.strip() for col in ("description", "reference", "counterparty")},
+    })
+    key = (
+        out["bank_account"] + "|" + out["txn_date"] + "|" + (out["amount"] * 100).round().astype("int64").astype(str)
+        + "|" + out["reference"] + "|" + out["description"]
+    )
+    # Identical lines in one file (two equal fees on a day) stay distinct by their repeat number.
+    key = key + "|" + key.groupby(key).cumcount().astype(str)
+    out["fingerprint"] = key.map(lambda k: hashlib.sha1(k.encode("utf-8")).hexdigest())
+    rows = out.to_dict("records")
+    with db_unit_of_work() as conn:
+        upsert_bank_accounts([account], conn)
+        res = conn.execute(text(STATEMENT_INSERT_SQL), rows)
+        inserted = len(rows) if res.rowcount is None or res.rowcount < 0 else res.rowcount
+    return {"inserted": inserted, "skipped": len(rows) - inserted}
+
+
+# Matching: statement lines and Unpaid Income / Expense / Bill rows are hash-joined on the
+# signed amount in cents (Income = credit, Expense / Bill = debit), kept when the line falls
+# within RECON_DAYS_BEFORE / RECON_DAYS_AFTER of the document date, then scored on the
+# partner name and doc_no found in the line text, date distance and bank_account. Each line
+# and each journal row is used once (best score first). Confirming sets status 'Paid', the
+# statement's bank_account and `paid_date` = the statement date.
+RECON_DAYS_BEFORE = 7
+RECON_DAYS_AFTER = _env_int("ERP_RECON_WINDOW_DAYS", 120)
+RECON_MIN_SCORE = 0.3
+# Proposals at or above this score are preselected for confirmation.
+RECON_AUTO_SCORE = 0.6
+RECON_LINES_SQL = """SELECT l.id, l.bank_account, l.txn_date, l.amount, l.description, l.reference, l.counterparty
+    FROM bank_statement_lines l
+    LEFT JOIN journal j ON j.id = l.journal_id
+    WHERE l.company_id = :company_id AND j.id IS NULL"""
+RECON_ITEMS_SQL = f"""SELECT f.id, f.doc_date, f.doc_no, COALESCE(dt.name, '') AS doc_type,
+        COALESCE(c.name, f.counterparty, '') AS counterparty, f.bank_account, f.amount
+    FROM (
+        SELECT id, doc_date, doc_no, doc_type_id, counterparty_id, {_AGING_PARTNER_SQL} AS counterparty,
+            COALESCE(TRIM(bank_account), '') AS bank_account, {REPORT_GROSS_SQL} AS amount
+        FROM journal
+        WHERE {_AGING_WHERE_SQL} AND doc_date BETWEEN :date_from AND :date_to
+    ) f
+    LEFT JOIN {JOURNAL_ENUMS["doc_type"]} dt ON dt.id = f.doc_type_id
+    LEFT JOIN counterparties c ON c.id = f.counterparty_id"""
+RECON_CONFIRM_SQL = f"""UPDATE journal SET
+        status = {_enum_text_sql("status")},
+        status_id = {_enum_id_sql("status")},
+        bank_account = :bank_account,
+        paid_date = :paid_date
+    WHERE id = :journal_id AND company_id = :company_id
+        AND status_id = (SELECT id FROM {JOURNAL_ENUMS["status"]} WHERE name = 'Unpaid')"""
+
+
+def load_unmatched_lines(bank_account: Optional[str] = None) -> pd.DataFrame:
+    """Statement lines not linked to an existing journal row, oldest first."""
+    sql, params = RECON_LINES_SQL, {"company_id": COMPANY_ID}
+    if bank_account:
+        sql += " AND l.bank_account = :bank_account"
+        params["bank_account"] = bank_account
+    df = pd.read_sql_query(text(sql + " ORDER BY l.txn_date, l.id"), ENGINE, params=params)
+    df["txn_date"] = pd.to_datetime(df["txn_date"], errors="coerce", format="ISO8601")
+    return df.astype({"amount": "float64"})
+
+
+def load_recon_candidates(date_from: date, date_to: date) -> pd.DataFrame:
+    """Open Income / Expense / Bill rows dated in [date_from, date_to] (undated rows never match)."""
+    df = pd.read_sql_query(
+        text(RECON_ITEMS_SQL),
+        ENGINE,
+        params={"company_id": COMPANY_ID, "date_from": date_from.isoformat(), "date_to": date_to.isoformat()},
+    )
+    df["doc_date"] = pd.to_datetime(df["doc_date"], errors="coerce", format="ISO8601")
+    return df.astype({"amount": "float64"})
+
+
+def match_statement_lines(lines: pd.DataFrame, items: pd.DataFrame) -> pd.DataFrame:
+    """Best one-to-one proposals (line_id, journal_id, score, …) for `lines` against open `items`."""
+    cols = [
+        "line_id", "journal_id", "score", "txn_date", "amount", "description", "bank_account",
+        "doc_date", "doc_no", "doc_type", "counterparty",
+    ]
+    if lines.empty or items.empty:
+        return pd.DataFrame(columns=cols)
+    sign = items["doc_type"].eq("Income").map({True: 1, False: -1})
+    pairs = lines.rename(columns={"id": "line_id", "counterparty": "line_counterparty"}).assign(
+        cents=(lines["amount"] * 100).round().astype("int64")
+    ).merge(
+        items.rename(columns={"id": "journal_id", "bank_account": "doc_account", "amount": "doc_amount"}).assign(
+            cents=(items["amount"] * sign * 100).round().astype("int64")
+        ),
+        on="cents",
+    )
+    lag = (pairs["txn_date"] - pairs["doc_date"]).dt.days
+    pairs = pairs[lag.between(-RECON_DAYS_BEFORE, RECON_DAYS_AFTER)].copy()
+    if pairs.empty:
+        return pd.DataFrame(columns=cols)
+    lag = lag[pairs.index]
+
+    line_text = _fold_text(pairs["line_counterparty"] + " " + pairs["description"] + " " + pairs["reference"])
+    line_tokens = line_text.str.split().map(set)
+    partner_tokens = _fold_text(pairs["counterparty"]).str.split().map(lambda t: [w for w in t if len(w) >= 3])
+    name_score = pd.Series(
+        [len([w for w in p if w in t]) / len(p) if p else 0.0 for p, t in zip(partner_tokens, line_tokens)],
+        index=pairs.index,
+    )
+    doc_no = _fold_text(pairs["doc_no"])
+    ref_hit = pd.Series(
+        [len(d) >= 3 and d in t for d, t in zip(doc_no, line_text)], index=pairs.index, dtype="float64"
+    )
+    date_score = 1.0 - (lag.abs() / RECON_DAYS_AFTER).clip(upper=1.0)
+    account_score = pd.Series(0.5, index=pairs.index).where(
+        pairs["doc_account"].eq(""), pairs["doc_account"].eq(pairs["bank_account"]).astype("float64")
+    )
+    pairs["score"] = (0.4 * name_score + 0.2 * ref_hit + 0.3 * date_score + 0.1 * account_score).round(3)
+    pairs = pairs[pairs["score"] >= RECON_MIN_SCORE].sort_values(["score", "txn_date"], ascending=[False, True])
+
+    used_lines, used_docs, keep = set(), set(), []
+    for idx, line_id, journal_id in zip(pairs.index, pairs["line_id"], pairs["journal_id"]):
+        if line_id not in used_lines and journal_id not in used_docs:
+            used_lines.add(line_id)
+            used_docs.add(journal_id)
+            keep.append(idx)
+    return pairs.loc[keep, cols].sort_values(["txn_date", "line_id"], ignore_index=True)
+
+
+def confirm_statement_matches(matches: pd.DataFrame) -> Dict[str, int]:
+    """Mark the matched journal rows Paid (account + payment date from the statement) and link the lines.
+
+    One unit of work. A line is linked only if its journal row was updated: rows that are no
+    longer Unpaid (paid or deleted in the meantime) are left as they are and their lines stay
+    unmatched. Returns the paid rows and the stale matches.
+    """
+    if matches.empty:
+        return {"paid": 0, "stale": 0}
+    params = [
+        {
+            "company_id": COMPANY_ID, "journal_id": int(m.journal_id), "line_id": int(m.line_id), "status": "Paid",
+            "bank_account": m.bank_account, "paid_date": pd.Timestamp(m.txn_date).strftime("%Y-%m-%d"),
+        }
+        for m in matches.itertuples(index=False)
+    ]
+    with db_unit_of_work() as conn:
+        ids = [p["journal_id"] for p in params]
+        assert_open_settlement(conn, ids=ids, paid_dates=[p["paid_date"] for p in params])
+        _amend_closed_status(conn, ids, "Paid", from_status="Unpaid")
+        ensure_journal_enums([{"status": "Paid"}], conn)
+        upsert_bank_accounts({p["bank_account"] for p in params}, conn)
+        # Row by row: the rowcount of each UPDATE tells which lines may be linked.
+        updated = [p for p in params if conn.execute(text(RECON_CONFIRM_SQL), p).rowcount == 1]
+        if updated:
+            conn.execute(
+                text(
+                    "UPDATE bank_statement_lines SET journal_id = :journal_id "
+                    "WHERE id = :line_id AND company_id = :company_id AND journal_id IS NULL"
+                ),
+                updated,
+            )
+    return {"paid": len(updated), "stale": len(params) - len(updated)}
+
 # --- 5. INITIAL DATA LOAD ---
+# Whole database: the first-run setup screen is shown until any company has rows.
 count = db_scalar("SELECT count(*) FROM journal", default=0)
 
+# Imported rows carry a content fingerprint under a unique index, so re-importing a workbook
+# (under any file name, with rows inserted or sorted) only adds unseen rows. `import_source`
+# ("<file>|<sheet>|<excel row>") is kept to report rows edited in place.
+IMPORT_INSERT_SQL = _journal_insert_sql(
+    ("import_source", "import_fingerprint"), conflict_key="company_id, import_fingerprint"
+)
+# Rev 2: the fingerprint no longer includes the file name and row position.
+IMPORT_FINGERPRINT_REV = 2
+
+
+def _imported_pairs(conn: Connection, key: str, values: list[str]) -> Dict[str, str]:
+    """Stored `key` -> the other import column (import_source <-> import_fingerprint), for `values`."""
+    other = "import_source" if key == "import_fingerprint" else "import_fingerprint"
+    found: Dict[str, str] = {}
+    for start in range(0, len(values), BULK_ID_CHUNK):
+        params = {f"s{i}": v for i, v in enumerate(values[start:start + BULK_ID_CHUNK])}
+        placeholders = ", ".join(f":{k}" for k in params)
+        res = conn.execute(
+            text(f"SELECT {key}, {other} FROM journal WHERE company_id = :company_id AND {key} IN ({placeholders})"),
+            {**params, "company_id": COMPANY_ID},
+        )
+        found.update(dict(res.fetchall()))
+    return found
+
+
+def _ensure_import_fingerprint_rev(conn: Connection) -> None:
+    """Re-key the fingerprints of earlier imports to `IMPORT_FINGERPRINT_REV`, once.
+
+    Rows of a workbook that was imported twice under different names keep their old
+    fingerprint (the first copy takes the new one).
+    """
+    rev = conn.execute(text("SELECT value FROM app_meta WHERE key = 'import_fingerprint_rev'")).scalar()
+    if rev is not None and int(rev) >= IMPORT_FINGERPRINT_REV:
+        return
+    df = pd.read_sql_query(
+        text(
+            "SELECT j.id, j.company_id, j.import_source, v.doc_date, v.doc_no, v.doc_type, v.counterparty, "
+            "v.amount_gross FROM journal j JOIN journal_v v ON v.id = j.id WHERE j.import_source IS NOT NULL"
+        ),
+        conn,
+    )
+    if not df.empty:
+        parts = df["import_source"].str.rsplit("|", n=1, expand=True)
+        df["sheet_key"] = parts[0]
+        df["excel_row"] = pd.to_numeric(parts[1], errors="coerce")
+        df["doc_date"] = df["doc_date"].map(lambda d: "" if d is None or pd.isna(d) else str(d)[:10])
+        df = df.sort_values(["company_id", "sheet_key", "excel_row", "id"])
+        df["content"] = [_import_content(r) for r in df.to_dict("records")]
+        df["occurrence"] = df.groupby(["company_id", "sheet_key", "content"]).cumcount() + 1
+        df["fp"] = [_import_fingerprint(c, n) for c, n in zip(df["content"], df["occurrence"])]
+        df = df[~df.duplicated(["company_id", "fp"])]
+        conn.execute(
+            text("UPDATE journal SET import_fingerprint = :fp WHERE id = :id"),
+            [{"fp": fp, "id": int(i)} for i, fp in zip(df["id"], df["fp"])],
+        )
+    conn.execute(
+        text(
+            "INSERT INTO app_meta (key, value) VALUES ('import_fingerprint_rev', :v) "
+            "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value"
+        ),
+        {"v": IMPORT_FINGERPRINT_REV},
+    )
+
 
-def _import_excel_to_db(excel_source) -> int:
-    """Import an Excel file (path or file-like) into the journal table.
+def _write_import_rows(conn: Connection, rows: list[Dict[str, Any]]) -> Dict[str, int]:
+    """Insert the unseen rows of one sheet inside the caller's unit of work.
 
-    Returns the total row count in `journal` after the import.
+    Rows already imported (same fingerprint) are skipped; their `import_source` follows them
+    to the current file / position. A row whose position last held content that is no longer
+    in the sheet was edited in place: it is counted as `changed` and left untouched.
     """
+    fingerprints = [r["import_fingerprint"] for r in rows]
+    known = _imported_pairs(conn, "import_fingerprint", fingerprints)
+    fresh = [r for r in rows if r["import_fingerprint"] not in known]
+    by_source = _imported_pairs(conn, "import_source", [r["import_source"] for r in fresh])
+    in_sheet = set(fingerprints)
+    edited = {
+        r["import_fingerprint"] for r in fresh
+        if r["import_source"] in by_source and by_source[r["import_source"]] not in in_sheet
+    }
+    changed = len(edited)
+    moved = [
+        {"company_id": COMPANY_ID, "fp": r["import_fingerprint"], "src": r["import_source"]}
+        for r in rows if r["import_fingerprint"] in known and known[r["import_fingerprint"]] != r["import_source"]
+    ]
+    if moved:
+        conn.execute(
+            text("UPDATE journal SET import_source = :src WHERE company_id = :company_id AND import_fingerprint = :fp"),
+            moved,
+        )
+    new_rows = [{**r, "company_id": COMPANY_ID} for r in fresh if r["import_fingerprint"] not in edited]
+    inserted = 0
+    if new_rows:
+        assert_open_period(conn, rows=new_rows)
+        ensure_journal_enums(new_rows, conn)
+        res = conn.execute(text(IMPORT_INSERT_SQL), new_rows)
+        inserted = len(new_rows) if res.rowcount is None or res.rowcount < 0 else res.rowcount
+    return {"new": inserted, "skipped": len(rows) - inserted - changed, "changed": changed}
+
+
+def _import_excel_to_db(excel_source) -> Dict[str, int]:
+    """Import one Excel file (path or file-like): its `Journal` sheet, else the first one.
+
+    Returns the `new` / `skipped` / `changed` counts and the company's journal `total` afterwards.
+    """
+    file_name = os.path.basename(str(getattr(excel_source, "name", excel_source)))
     xl = pd.ExcelFile(excel_source, engine="openpyxl")
     sheet = "Journal" if "Journal" in xl.sheet_names else xl.sheet_names[0]
-    df = pd.read_excel(excel_source, sheet_name=sheet)
-    df.columns = df.columns.astype(str).str.strip()
+    rows = _import_frame_rows(pd.read_excel(excel_source, sheet_name=sheet), file_name, sheet)
+    with db_unit_of_work() as conn:
+        _ensure_import_fingerprint_rev(conn)
+        result = _write_import_rows(conn, rows)
+    if result["new"]:
+        # Imported partners are not in the lookup yet: link them by FK.
+        backfill_counterparty_ids()
+    total = db_scalar("SELECT count(*) FROM journal WHERE company_id = :company_id", {"company_id": COMPANY_ID}, default=0)
+    return {**result, "total": int(total or 0)}
+
+
+# Batch import: openpyxl parsing is pure Python (GIL-bound), so sheets are parsed and
+# normalized in worker processes (`import_sheets.prepare_import_sheet`); this process is
+# the single writer. ERP_IMPORT_WORKERS caps the pool (default: one per core; 1 = in-process).
+IMPORT_WORKERS = max(1, _env_int("ERP_IMPORT_WORKERS", 0) or (os.cpu_count() or 1))
+IMPORT_KIND_LABELS = {"cashflow": "Ταμείο (έσοδα / έξοδα)", "journal": "Ημερολόγιο (καθαρό / ΦΠΑ / μικτό)"}
+
+
+def preview_import_sheets(files: list[tuple[str, bytes]]) -> list[Dict[str, Any]]:
+    """First `IMPORT_PREVIEW_ROWS` rows of every sheet, auto-mapped and validated.
+
+    One entry per sheet: file, sheet, headers, mapping, sample, issues (empty for sheets
+    that would not be imported) and `error` (an unreadable file gives one entry with an
+    empty sheet name).
+    """
+    import io
 
-    def _to_float(v) -> float:
-        if v is None or (isinstance(v, float) and pd.isna(v)):
-            return 0.0
-        if isinstance(v, (int, float)):
+    out = []
+    for name, data in files:
+        try:
+            xl = pd.ExcelFile(io.BytesIO(data), engine="openpyxl")
+            sheets = xl.sheet_names
+        except Exception as e:
+            out.append({"file": name, "sheet": "", "error": str(e)})
+            continue
+        for sheet in sheets:
+            sample = _import_frame(xl.parse(sheet, nrows=IMPORT_PREVIEW_ROWS))
+            mapping = auto_map_import_columns(sample.columns)
+            out.append({
+                "file": name,
+                "sheet": sheet,
+                "headers": list(sample.columns),
+                "mapping": mapping,
+                "sample": sample,
+                "issues": validate_import_frame(sample, mapping) if _import_sheet_kind(mapping) else _no_import_issues(),
+                "error": None,
+            })
+    return out
+
+
+@st.cache_resource(show_spinner=False)
+def _process_start_lock():
+    """Serializes worker start-up across sessions (see `_process_map`)."""
+    import threading
+
+    return threading.Lock()
+
+
+def _process_map(fn, tasks: list[tuple], workers: int) -> Iterator[tuple[tuple, bool, Any]]:
+    """Run `fn(*task)` in a process pool; yields (task, ok, result or error text) as they finish.
+
+    The server is multi-threaded, so workers are never forked from it: they start from a
+    `forkserver` (`spawn` where there is none) and unpickle `fn` by reference, so `fn` must
+    live in an importable module, not in this script. With one worker, tasks run in this process.
+    """
+    import multiprocessing
+    import sys
+    import types
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from concurrent.futures.process import BrokenProcessPool
+
+    workers = min(workers, len(tasks))
+    if workers <= 1:
+        for task in tasks:
             try:
-                return float(v)
-            except Exception:
-                return 0.0
-        s = str(v).strip()
-        if not s or s.lower() in {"nan", "none", "<na>"}:
-            return 0.0
-        # Normalize common currency/thousand/decimal formats (€, spaces, 1.234,56, 1,234.56)
-        s = s.replace("€", "").replace(" ", "")
-        if "," in s and "." in s:
-            # If last comma is after last dot => comma decimal
-            if s.rfind(",") > s.rfind("."):
-                s = s.replace(".", "").replace(",", ".")
-            else:
-                s = s.replace(",", "")
-        elif "," in s and "." not in s:
-            s = s.replace(",", ".")
+                yield task, True, fn(*task)
+            except Exception as e:
+                yield task, False, str(e)
+        return
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        # The server imports pandas / openpyxl once; each worker is forked from it.
+        ctx.set_forkserver_preload([fn.__module__])
+    else:
+        ctx = multiprocessing.get_context("spawn")
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+    try:
+        # Workers start inside `submit`. Streamlit installs this script as `__main__`, which a
+        # new worker would re-run as `__mp_main__`; a bare stand-in is shown to them instead
+        # (put back unless a rerun has installed its own `__main__` meanwhile).
+        with _process_start_lock():
+            script_main, stand_in = sys.modules["__main__"], types.ModuleType("__main__")
+            sys.modules["__main__"] = stand_in
+            try:
+                futures = {pool.submit(fn, *task): task for task in tasks}
+            finally:
+                if sys.modules["__main__"] is stand_in:
+                    sys.modules["__main__"] = script_main
+        for future in as_completed(futures):
+            try:
+                yield futures[future], True, future.result()
+            except BrokenProcessPool:
+                raise RuntimeError("Οι διεργασίες εισαγωγής τερματίστηκαν απρόσμενα.") from None
+            except Exception as e:
+                yield futures[future], False, str(e)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def prepare_import_batch(
+    files: list[tuple[str, bytes]],
+    mappings: Optional[Dict[tuple[str, str], Dict[str, Optional[str]]]] = None,
+    progress=None,
+) -> list[Dict[str, Any]]:
+    """Parse, normalize and validate every sheet of many workbooks (`(file name, bytes)` pairs).
+
+    Nothing is written. Sheets run in `_process_map` workers with the column mapping from
+    `mappings[(file, sheet)]` (default: auto-mapped); `progress(done, total)` is called per
+    sheet. Returns one entry per sheet: file, sheet, rows, issues and `error`.
+    """
+    import io
+
+    mappings = mappings or {}
+    prepared: list[Dict[str, Any]] = []
+    tasks: list[tuple] = []
+    for name, data in files:
         try:
-            return float(s)
-        except Exception:
-            return 0.0
+            sheets = pd.ExcelFile(io.BytesIO(data), engine="openpyxl").sheet_names
+        except Exception as e:
+            prepared.append({"file": name, "sheet": "", "rows": [], "issues": None, "error": str(e)})
+            continue
+        tasks += [(name, data, sheet, mappings.get((name, sheet))) for sheet in sheets]
+
+    for n, ((name, _, sheet, _), ok, result) in enumerate(_process_map(prepare_import_sheet, tasks, IMPORT_WORKERS), 1):
+        entry = {"file": name, "sheet": sheet, "rows": [], "issues": None, "error": None}
+        if ok:
+            entry.update(result)
+        else:
+            entry["error"] = result
+        prepared.append(entry)
+        if progress:
+            progress(n, len(tasks))
+    return prepared
 
-    rows = []
 
-    # Format A: legacy/expected "Journal"-style sheet
-    # (used by older versions or user-provided exports)
-    rename_map = {
-        "Date": "DocDate",
-        "Net": "Amount (Net)",
-        "Gross": "Amount (Gross)",
-        "Type": "DocType",
-        "Counterparty": "counterparty",
-        "Bank Account": "bank_account",
-    }
-    df_journal = df.rename(columns=rename_map).copy()
+def write_import_batch(prepared: list[Dict[str, Any]], skip_invalid: bool = True) -> list[Dict[str, Any]]:
+    """Write the sheets of `prepare_import_batch` in one unit of work (see `_write_import_rows`).
 
-    # Format B: bundled finance_data.xlsx (Greek cashflow sheet, e.g. "Ταμείο")
-    is_cashflow = ("Ημερομηνία" in df.columns) and (
-        ("Έσοδα (€)" in df.columns) or ("Έξοδα (€)" in df.columns) or ("Μερίσματα" in df.columns)
-    )
+    With `skip_invalid`, rows that have an error-level issue are left out. Returns one report
+    per sheet: file, sheet, rows, invalid, new / skipped / changed and `error`.
+    """
+    reports = []
+    with db_unit_of_work() as conn:
+        _ensure_import_fingerprint_rev(conn)
+        for entry in prepared:
+            report = {"file": entry["file"], "sheet": entry["sheet"], "rows": len(entry["rows"]), "error": entry["error"]}
+            reports.append(report)
+            if entry["error"]:
+                continue
+            rows = entry["rows"]
+            issues = entry["issues"]
+            if skip_invalid and issues is not None and not issues.empty:
+                bad = {str(r) for r in issues.loc[issues["severity"] == "error", "row"]}
+                rows = [r for r in rows if r["import_source"].rsplit("|", 1)[1] not in bad]
+            report["invalid"] = report["rows"] - len(rows)
+            try:
+                report.update(_write_import_rows(conn, rows))
+            except ValueError as e:  # closed period: checked before anything is written
+                report["error"] = str(e)
+    if any(report.get("new") for report in reports):
+        backfill_counterparty_ids()
+    return reports
 
-    if is_cashflow:
-        for _, r in df.iterrows():
-            parsed_date = pd.to_datetime(r.get("Ημερομηνία"), errors="coerce")
-            d_date = (
-                parsed_date.strftime("%Y-%m-%d")
-                if pd.notna(parsed_date)
-                else date.today().strftime("%Y-%m-%d")
-            )
 
-            income = _to_float(r.get("Έσοδα (€)", 0))
-            expense = _to_float(r.get("Έξοδα (€)", 0))
-            dividends = _to_float(r.get("Μερίσματα", 0))
+@st.cache_resource(show_spinner=False)
+def _import_executor():
+    """Background threads for full-file import validation (see `render_import_preview`)."""
+    from concurrent.futures import ThreadPoolExecutor
 
-            amount_net = income if income else (expense if expense else dividends)
-            doc_type = "Income" if income else ("Expense" if (expense or dividends) else "")
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="erp-import")
 
-            category = str(r.get("Κατηγορία", "")).strip()
-            desc = str(r.get("Περιγραφή", "")).strip()
-            if category and desc:
-                desc = f"[{category}] {desc}"
-            elif category:
-                desc = category
 
-            rows.append(
-                {
-                    "doc_date": d_date,
-                    "doc_no": "",
-                    "doc_type": doc_type,
-                    "counterparty": str(r.get("Στέλεχος", "")).strip(),
-                    "description": desc,
-                    "gl_code": "999",
-                    "amount_net": amount_net,
-                    "vat_amount": 0.0,
-                    "amount_gross": amount_net,
-                    "payment_method": str(r.get("Τρόπος Πληρωμής", "")).strip(),
-                    "bank_account": "",
-                    "status": str(r.get("Έγκριση", "")).strip(),
-                }
+def render_import_preview(uploads, key: str) -> None:
+    """Preview → validation → approval for uploaded .xlsx files; nothing is written before approval.
+
+    The first `IMPORT_PREVIEW_ROWS` rows of each sheet are mapped and checked right away; the
+    whole files go through `prepare_import_batch` in a background thread, polled by a fragment.
+    Editing a column mapping restarts the full check.
+    """
+    state = st.session_state.setdefault(f"{key}_state", {})
+    files_key = tuple(getattr(f, "file_id", f.name) for f in uploads)
+    if state.get("files") != files_key:
+        old = state.get("future")
+        if old is not None:
+            old.cancel()
+        state.clear()
+        state["files"] = files_key
+        state["data"] = [(f.name, f.getvalue()) for f in uploads]
+        with st.spinner("Ανάγνωση δείγματος..."):
+            state["preview"] = preview_import_sheets(state["data"])
+
+    if state.get("reports") is not None:
+        report_df = pd.DataFrame(state["reports"])
+        st.dataframe(
+            report_df.reindex(columns=["file", "sheet", "rows", "invalid", "new", "skipped", "changed", "error"]),
+            hide_index=True,
+            width='stretch',
+            column_config={
+                "file": "Αρχείο",
+                "sheet": "Φύλλο",
+                "rows": "Γραμμές",
+                "invalid": "Με σφάλμα",
+                "new": "Νέες",
+                "skipped": "Ήδη εισηγμένες",
+                "changed": "Αλλαγμένες",
+                "error": "Σφάλμα",
+            },
+        )
+        return
+
+    mappings = {}
+    for i, sh in enumerate(state["preview"]):
+        label = f"{sh['file']} / {sh['sheet']}" if sh["sheet"] else sh["file"]
+        if sh["error"]:
+            st.error(f"{label}: {sh['error']}")
+            continue
+        with st.expander(f"📄 {label}", expanded=len(state["preview"]) == 1):
+            fields = list(IMPORT_COLUMN_ALIASES)
+            edited = st.data_editor(
+                pd.DataFrame({"field": fields, "column": [sh["mapping"][f] or "" for f in fields]}),
+                key=f"{key}_map_{i}",
+                hide_index=True,
+                disabled=["field"],
+                column_config={
+                    "field": "Πεδίο",
+                    "column": st.column_config.SelectboxColumn("Στήλη αρχείου", options=["", *sh["headers"]]),
+                },
             )
-    else:
-        for _, r in df_journal.iterrows():
-            parsed_date = pd.to_datetime(r.get("DocDate"), errors="coerce")
-            d_date = (
-                parsed_date.strftime("%Y-%m-%d")
-                if pd.notna(parsed_date)
-                else date.today().strftime("%Y-%m-%d")
+            mapping = {f: (c or None) for f, c in zip(edited["field"], edited["column"])}
+            mappings[(sh["file"], sh["sheet"])] = mapping
+            kind = _import_sheet_kind(mapping)
+            st.dataframe(sh["sample"].head(20).fillna("").astype(str), width='stretch')
+            if kind is None:
+                st.warning("Το φύλλο δεν θα εισαχθεί: χρειάζεται στήλη ημερομηνίας και ποσού.")
+                continue
+            st.caption(f"Μορφή: {IMPORT_KIND_LABELS[kind]}")
+            issues = sh["issues"] if mapping == sh["mapping"] else validate_import_frame(sh["sample"], mapping)
+            if issues.empty:
+                st.caption(f"✓ Χωρίς προβλήματα στις πρώτες {len(sh['sample'])} γραμμές.")
+            else:
+                st.caption(f"Προβλήματα στις πρώτες {len(sh['sample'])} γραμμές:")
+                st.dataframe(issues, hide_index=True, width='stretch')
+
+    job_key = (files_key, tuple(sorted((k, tuple(sorted(m.items(), key=str))) for k, m in mappings.items())))
+    if state.get("job_key") != job_key:
+        old = state.get("future")
+        if old is not None:
+            old.cancel()
+        progress = state["progress"] = {"done": 0, "total": 0}
+
+        def _progress(done: int, total: int) -> None:
+            progress.update(done=done, total=total)
+
+        state["job_key"] = job_key
+        state["future"] = _import_executor().submit(prepare_import_batch, state["data"], mappings, _progress)
+
+    future = state["future"]
+    polling = not future.done()
+
+    @st.fragment(run_every=1.0 if polling else None)
+    def _full_check() -> None:
+        if not future.done():
+            done, total = state["progress"]["done"], state["progress"]["total"]
+            st.progress(done / total if total else 0.0, text=f"Έλεγχος όλων των γραμμών... {done}/{total or '?'} φύλλα")
+            return
+        if polling:
+            # Finished while polling: re-run the page once, which stops the timer.
+            st.rerun()
+        try:
+            prepared = future.result()
+        except Exception as e:
+            st.error(f"❌ Σφάλμα ελέγχου: {e}")
+            return
+        issues = [
+            entry["issues"].assign(file=entry["file"], sheet=entry["sheet"])
+            for entry in prepared
+            if entry["issues"] is not None and not entry["issues"].empty
+        ]
+        n_rows = sum(len(entry["rows"]) for entry in prepared)
+        failed = [f"- {entry['file']} / {entry['sheet']}: {entry['error']}" for entry in prepared if entry["error"]]
+        if failed:
+            st.warning("Δεν θα εισαχθούν:\n" + "\n".join(failed))
+        if issues:
+            all_issues = pd.concat(issues, ignore_index=True)[["file", "sheet", *IMPORT_ISSUE_COLUMNS]]
+            n_errors = int((all_issues["severity"] == "error").sum())
+            st.caption(f"Έλεγχος ολοκληρώθηκε: {n_rows} γραμμές, {n_errors} σφάλματα, {len(all_issues) - n_errors} προειδοποιήσεις.")
+            st.dataframe(all_issues, hide_index=True, width='stretch')
+        else:
+            st.caption(f"✓ Έλεγχος ολοκληρώθηκε: {n_rows} γραμμές χωρίς προβλήματα.")
+        skip_invalid = st.checkbox("Παράλειψη γραμμών με σφάλματα", value=True, key=f"{key}_skip_invalid")
+        if st.button("✅ Έγκριση & εισαγωγή", type="primary", disabled=not n_rows, key=f"{key}_commit"):
+            try:
+                reports = write_import_batch(prepared, skip_invalid)
+            except Exception as e:
+                st.error(f"❌ Σφάλμα εισαγωγής: {e}")
+                return
+            state["reports"] = reports
+            new = sum(r.get("new", 0) for r in reports)
+            errors = sum(1 for r in reports if r["error"])
+            flash(
+                f"Εισαγωγή: {new} νέες εγγραφές από {len(reports) - errors} φύλλα"
+                + (f", {errors} φύλλα με σφάλμα." if errors else "."),
+                icon="⚠️" if errors else "✅",
             )
-            amount_net = _to_float(r.get("Amount (Net)", 0))
-            vat_amount = _to_float(r.get("VAT Amount", 0))
-            amount_gross = _to_float(r.get("Amount (Gross)", 0))
-            if amount_gross == 0.0:
-                amount_gross = amount_net + vat_amount
+            st.rerun()
 
-            rows.append(
-                {
-                    "doc_date": d_date,
-                    "doc_no": str(r.get("DocNo", "")),
-                    "doc_type": str(r.get("DocType", "")),
-                    "counterparty": str(r.get("counterparty", "")),
-                    "description": str(r.get("Description", "")),
-                    "gl_code": "999",
-                    "amount_net": amount_net,
-                    "vat_amount": vat_amount,
-                    "amount_gross": amount_gross,
-                    "payment_method": str(r.get("Payment Method", "")),
-                    "bank_account": str(r.get("bank_account", "")),
-                    "status": str(r.get("Status", "")),
-                }
-            )
+    _full_check()
 
-    db_executemany(
-        """INSERT INTO journal (
-                doc_date, doc_no, doc_type, counterparty, description, gl_code,
-                amount_net, vat_amount, amount_gross, payment_method, bank_account, status
-            ) VALUES (
-                :doc_date, :doc_no, :doc_type, :counterparty, :description, :gl_code,
-                :amount_net, :vat_amount, :amount_gross, :payment_method, :bank_account, :status
-            )""",
-        rows,
-    )
-    return int(db_scalar("SELECT count(*) FROM journal", default=0) or 0)
+
+def import_result_message(result: Dict[str, int]) -> str:
+    msg = f"Νέες εγγραφές: {result['new']}, ήδη εισηγμένες: {result['skipped']}"
+    if result["changed"]:
+        msg += f", αλλαγμένες στο αρχείο (δεν ενημερώθηκαν): {result['changed']}"
+    return f"{msg}. Εγγραφές στη βάση: {result['total']}"
 
 if count == 0:
     st.title("⚠️ Εγκατάσταση")
@@ -1228,8 +5261,8 @@ if count == 0:
         c2.caption("📦 Βρέθηκε τοπικό αρχείο: finance_data.xlsx")
         if c2.button("Import bundled finance_data.xlsx", width='stretch'):
             try:
-                inserted = _import_excel_to_db(repo_excel)
-                st.success(f"✅ Import ολοκληρώθηκε. Εγγραφές στη βάση: {inserted}")
+                result = _import_excel_to_db(repo_excel)
+                st.success(f"✅ Import ολοκληρώθηκε. {import_result_message(result)}")
                 st.stop()
             except Exception as e:
                 st.error("❌ Error loading bundled Excel")
@@ -1238,21 +5271,32 @@ if count == 0:
     up = c1.file_uploader(
         "Upload Excel (finance_data.xlsx)",
         type=["xlsx"],
-        help="Προτεινόμενο όνομα: finance_data.xlsx (οποιοδήποτε .xlsx γίνεται δεκτό).",
+        accept_multiple_files=True,
+        help="Προτεινόμενο όνομα: finance_data.xlsx (οποιοδήποτε .xlsx γίνεται δεκτό). "
+        "Πριν την εισαγωγή εμφανίζεται προεπισκόπηση και έλεγχος.",
     )
-    if up:
+
+    snap = c1.file_uploader(
+        "Restore snapshot (.zip Parquet)",
+        type=["zip"],
+        help="Αρχείο από Ρυθμίσεις → Σύστημα → Snapshot βάσης. Φορτώνεται μαζικά (χωρίς το Excel import).",
+        key="setup_snapshot",
+    )
+    if snap:
         try:
-            c1.caption(f"📄 Uploaded: {getattr(up, 'name', 'unknown')}")
-            inserted = _import_excel_to_db(up)
-            st.success(f"✅ Import ολοκληρώθηκε. Εγγραφές στη βάση: {inserted}")
-            st.info("Κάνε refresh ή πάτα Start Fresh αν θέλεις κενή βάση.")
+            inserted = import_snapshot(snap)
+            st.success(f"✅ Snapshot φορτώθηκε. Εγγραφές στη βάση: {inserted}")
             st.stop()
         except Exception as e:
-            st.error("❌ Error loading Excel")
+            st.error("❌ Error loading snapshot")
             st.exception(e)
     
+    if up:
+        render_import_preview(up, "setup_import")
+
     if c2.button("🚀 Start Fresh (Blank DB)"):
-        db_execute("DELETE FROM journal")
+        with db_unit_of_work() as conn:
+            conn.execute(text("DELETE FROM journal"))
         st.rerun()
     st.stop()
 
@@ -1285,6 +5329,8 @@ if not st.session_state.logged_in:
     st.stop()
 
 # --- 7. MAIN APP ---
+show_flash_messages()
+
 st.sidebar.markdown(
         """
         <div style="display:flex; align-items:center; gap:10px; margin-bottom:6px;">
@@ -1294,6 +5340,15 @@ st.sidebar.markdown(
         """,
         unsafe_allow_html=True,
 )
+# Company switcher (only with more than one; new companies: Ρυθμίσεις → Σύστημα)
+if len(COMPANIES) > 1:
+    company_ids = list(COMPANIES)
+    company_option = st.sidebar.selectbox(
+        "Εταιρεία", company_ids, index=company_ids.index(COMPANY_ID), format_func=COMPANIES.get
+    )
+    if company_option != COMPANY_ID:
+        st.session_state["company_id"] = company_option
+        st.rerun()
 st.sidebar.divider()
 
 st.sidebar.markdown("<div style='font-weight:700; color:#0b2b4c; margin:0.25rem 0 0.5rem 0;'>Μενού</div>", unsafe_allow_html=True)
@@ -1303,8 +5358,10 @@ menu = st.sidebar.radio("ΜΕΝΟΥ", [
     "Νέα Εγγραφή",
     "ΦΠΑ & Φόροι (Report)",
     "Καρτέλες (Ledgers)",
+    "Ενηλικίωση Υπολοίπων",
     "Αρχείο & Διορθώσεις",
     "Ταμείο & Τράπεζες",
+    "Συμφωνία Τραπεζών",
     "Ρυθμίσεις GL"
 ], label_visibility="collapsed")
 
@@ -1324,97 +5381,151 @@ elif theme_option == "Φωτεινό" and st.session_state.theme == 'dark':
 if menu == "Dashboard":
     st.title("📊 Γενική Εικόνα")
     
+    today = date.today()
+    cy = today.year
+    col_mode, col_years = st.columns([2, 1])
+    dash_mode = col_mode.radio("Προβολή", ["Τρέχον έτος", "Πολυετής τάση"], horizontal=True, key="dash_mode")
+    n_years = 1
+    if dash_mode == "Πολυετής τάση":
+        n_years = col_years.slider("Έτη", min_value=2, max_value=10, value=5, key="dash_years")
+    
+    # Year-to-date vs the same period last year (both up to today's date)
+    ly_today = (pd.Timestamp(today) - pd.DateOffset(years=1)).date()
     with st.spinner("Φόρτωση δεδομένων..."):
-        df = load_journal_data()
+        totals = load_period_totals(cy, before=today + timedelta(days=1), company_id=COMPANY_ID, data_version=DATA_VERSION)
+        totals_ly = load_period_totals(cy - 1, before=ly_today + timedelta(days=1), company_id=COMPANY_ID, data_version=DATA_VERSION)
+        # One extra year so the first rolling 12-month window is complete
+        first_year = cy - n_years if n_years > 1 else cy
+        grp = load_monthly_totals(first_year, cy, company_id=COMPANY_ID, data_version=DATA_VERSION)
     
-    df['doc_date'] = pd.to_datetime(df['doc_date'], errors='coerce')
-    cy = datetime.now().year
-    df_y = df[df['doc_date'].dt.year == cy]
+    def _net(frame, types):
+        return frame[frame['doc_type'].isin(types)]['amount_net'].sum()
     
-    inc = df_y[df_y['doc_type']=='Income']['amount_net'].sum()
-    exp = df_y[df_y['doc_type'].isin(['Expense','Bill'])]['amount_net'].sum()
+    inc, exp = _net(totals, ['Income']), _net(totals, ['Expense', 'Bill'])
+    inc_ly, exp_ly = _net(totals_ly, ['Income']), _net(totals_ly, ['Expense', 'Bill'])
     
     c1, c2, c3 = st.columns(3)
-    c1.metric("Πωλήσεις (YTD)", f"€{inc:,.0f}")
-    c2.metric("Έξοδα (YTD)", f"€{exp:,.0f}")
-    c3.metric("Κέρδος", f"€{inc-exp:,.0f}")
+    c1.metric("Πωλήσεις (YTD)", f"€{inc:,.0f}", delta=f"€{inc-inc_ly:,.0f} vs {cy-1}")
+    c2.metric("Έξοδα (YTD)", f"€{exp:,.0f}", delta=f"€{exp-exp_ly:,.0f} vs {cy-1}", delta_color="inverse")
+    c3.metric("Κέρδος", f"€{inc-exp:,.0f}", delta=f"€{(inc-exp)-(inc_ly-exp_ly):,.0f} vs {cy-1}")
     
     st.divider()
-    st.subheader("📈 Μηνιαία Ανάλυση")
-    monthly = df_y.copy()
-    monthly['mo'] = monthly['doc_date'].dt.strftime('%Y-%m')
-    grp = monthly.groupby(['mo','doc_type'])['amount_net'].sum().reset_index()
-    
-    # Create professional chart
-    fig = px.bar(grp, x='mo', y='amount_net', color='doc_type', barmode='group',
-                 title="Μηνιαία Κίνηση Εσόδων/Εξόδων",
-                 labels={'mo': 'Μήνας', 'amount_net': 'Ποσό (€)', 'doc_type': 'Τύπος'})
-    
-    # Color mapping for professional palette
-    color_map = {
-        'Income': '#10b981',      # Green
-        'Expense': '#ef4444',     # Red
-        'Bill': '#f59e0b'         # Amber
-    }
+    if dash_mode == "Πολυετής τάση":
+        st.subheader(f"📈 Τάση {cy-n_years+1}–{cy}")
+        
+        # Months x (Πωλήσεις, Έξοδα); empty months count as zero in the rolling windows
+        kinds = grp['doc_type'].map({'Income': 'Πωλήσεις', 'Expense': 'Έξοδα', 'Bill': 'Έξοδα'})
+        trend = (
+            grp.assign(kind=kinds).dropna(subset=['kind'])
+            .pivot_table(index='mo', columns='kind', values='amount_net', aggfunc='sum')
+            .reindex(columns=['Πωλήσεις', 'Έξοδα'])
+        )
+        months = pd.period_range(f"{first_year}-01", f"{cy}-{today.month:02d}", freq='M').strftime('%Y-%m')
+        trend = trend.reindex(months).fillna(0.0)
+        trend.columns.name = None
+        trend['Κέρδος'] = trend['Πωλήσεις'] - trend['Έξοδα']
+        
+        yearly = trend.groupby(trend.index.str[:4]).sum()
+        prev = yearly.shift(1)
+        # The current year is year-to-date: compare it with the same days of last year
+        prev.iloc[-1] = [inc_ly, exp_ly, inc_ly - exp_ly]
+        yoy_pct = ((yearly - prev) / prev.abs() * 100).round(1)
+        yearly, yoy_pct = yearly.iloc[-n_years:], yoy_pct.iloc[-n_years:]
+        yearly.index.name = 'Έτος'
+        fig_y = px.bar(
+            yearly.reset_index().melt(id_vars='Έτος', value_vars=['Πωλήσεις', 'Έξοδα'], var_name='Τύπος', value_name='Ποσό'),
+            x='Έτος', y='Ποσό', color='Τύπος', barmode='group',
+            color_discrete_map={'Πωλήσεις': '#10b981', 'Έξοδα': '#ef4444'},
+            labels={'Ποσό': 'Ποσό (€)'}
+        )
+        fig_y.update_layout(plot_bgcolor='#f8f9fa', paper_bgcolor='#ffffff', hovermode='x unified', height=380)
+        st.plotly_chart(fig_y, width='stretch')
+        
+        # Year-over-year change
+        yoy_display = yearly.copy()
+        for col in ['Πωλήσεις', 'Έξοδα', 'Κέρδος']:
+            yoy_display[col] = yearly[col].apply(lambda x: f"€{x:,.0f}")
+            yoy_display[f'{col} Δ%'] = yoy_pct[col].apply(
+                lambda x: "" if pd.isna(x) or abs(x) == float('inf') else f"{x:+.1f}%"
+            )
+        yoy_display = yoy_display.rename(index={str(cy): f"{cy} (YTD)"})
+        st.dataframe(yoy_display, width='stretch')
+        
+        st.subheader("🔁 Κυλιόμενο 12μηνο")
+        rolling = trend.rolling(12).sum().dropna().iloc[-(n_years * 12):]
+        fig_r = px.line(
+            rolling.reset_index(names='Μήνας'), x='Μήνας', y=['Πωλήσεις', 'Έξοδα', 'Κέρδος'],
+            color_discrete_map={'Πωλήσεις': '#10b981', 'Έξοδα': '#ef4444', 'Κέρδος': '#2d5a8c'},
+            labels={'value': 'Σύνολο 12μήνου (€)', 'variable': ''}
+        )
+        fig_r.update_layout(plot_bgcolor='#f8f9fa', paper_bgcolor='#ffffff', hovermode='x unified', height=380)
+        st.plotly_chart(fig_r, width='stretch')
+    else:
+        st.subheader("📈 Μηνιαία Ανάλυση")
+        # Create professional chart
+        fig = px.bar(grp, x='mo', y='amount_net', color='doc_type', barmode='group',
+                     title="Μηνιαία Κίνηση Εσόδων/Εξόδων",
+                     labels={'mo': 'Μήνας', 'amount_net': 'Ποσό (€)', 'doc_type': 'Τύπος'})
     
-    fig.for_each_trace(lambda t: t.update(
-        marker=dict(
-            color=color_map.get(t.name, '#2d5a8c'),
-            line=dict(color='rgba(255,255,255,0.2)', width=1)
-        ),
-        hovertemplate='<b>%{fullData.name}</b><br>Περίοδος: %{x}<br>Ποσό: €%{y:,.0f}<extra></extra>'
-    ))
-    
-    fig.update_layout(
-        plot_bgcolor='#f8f9fa',
-        paper_bgcolor='#ffffff',
-        hovermode='x unified',
-        font=dict(family='Inter, sans-serif', color='#0f172a', size=12),
-        xaxis_title="Περίοδος",
-        yaxis_title="Ποσό (€)",
-        title=None,
-        showlegend=True,
-        legend=dict(
-            x=0.01,
-            y=0.99,
-            bgcolor='rgba(255,255,255,0.95)',
-            bordercolor='#cbd5e0',
-            borderwidth=1,
-            font=dict(size=11, color='#0f172a')
-        ),
-        xaxis=dict(
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='rgba(203, 213, 224, 0.4)',
-            zeroline=False,
-            color='#34568b',
-            tickfont=dict(size=11, color='#0f172a')
-        ),
-        yaxis=dict(
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='rgba(203, 213, 224, 0.4)',
-            zeroline=False,
-            color='#34568b',
-            tickfont=dict(size=11, color='#0f172a')
-        ),
-        margin=dict(l=60, r=20, t=20, b=60),
-        height=400
-    )
+        # Color mapping for professional palette
+        color_map = {
+            'Income': '#10b981',      # Green
+            'Expense': '#ef4444',     # Red
+            'Bill': '#f59e0b'         # Amber
+        }
     
-    st.plotly_chart(fig, width='stretch')
+        fig.for_each_trace(lambda t: t.update(
+            marker=dict(
+                color=color_map.get(t.name, '#2d5a8c'),
+                line=dict(color='rgba(255,255,255,0.2)', width=1)
+            ),
+            hovertemplate='<b>%{fullData.name}</b><br>Περίοδος: %{x}<br>Ποσό: €%{y:,.0f}<extra></extra>'
+        ))
     
-    st.divider()
-    st.subheader("📋 Τελευταίες Εγγραφές")
+        fig.update_layout(
+            plot_bgcolor='#f8f9fa',
+            paper_bgcolor='#ffffff',
+            hovermode='x unified',
+            font=dict(family='Inter, sans-serif', color='#0f172a', size=12),
+            xaxis_title="Περίοδος",
+            yaxis_title="Ποσό (€)",
+            title=None,
+            showlegend=True,
+            legend=dict(
+                x=0.01,
+                y=0.99,
+                bgcolor='rgba(255,255,255,0.95)',
+                bordercolor='#cbd5e0',
+                borderwidth=1,
+                font=dict(size=11, color='#0f172a')
+            ),
+            xaxis=dict(
+                showgrid=True,
+                gridwidth=1,
+                gridcolor='rgba(203, 213, 224, 0.4)',
+                zeroline=False,
+                color='#34568b',
+                tickfont=dict(size=11, color='#0f172a')
+            ),
+            yaxis=dict(
+                showgrid=True,
+                gridwidth=1,
+                gridcolor='rgba(203, 213, 224, 0.4)',
+                zeroline=False,
+                color='#34568b',
+                tickfont=dict(size=11, color='#0f172a')
+            ),
+            margin=dict(l=60, r=20, t=20, b=60),
+            height=400
+        )
     
-    df_display = df.copy()
+        st.plotly_chart(fig, width='stretch')
     
-    # Ensure amounts are clean
-    for col in ['amount_net', 'vat_amount', 'amount_gross']:
-        df_display[col] = pd.to_numeric(df_display[col], errors='coerce').fillna(0.0)
+    st.divider()
+    st.subheader("📋 Τελευταίες Εγγραφές")
     
-    # Sort by date descending BEFORE formatting, then show last 20
-    df_display = df_display.sort_values('doc_date', ascending=False).head(20)
+    # Newest 20 rows, already sorted by the query
+    df_display = load_journal_rows(limit=20, company_id=COMPANY_ID, data_version=DATA_VERSION)
     
     # Format date for display AFTER sorting
     df_display['doc_date'] = df_display['doc_date'].dt.strftime('%d/%m/%Y')
@@ -1436,8 +5547,204 @@ if menu == "Dashboard":
 elif menu == "Νέα Εγγραφή":
     st.title("📝 Νέα Εγγραφή - Συναλλαγές Λογιστηρίου")
 
-    gl_list = load_gl_codes()
-    
+    # Warm the lookup caches in parallel; the per-transaction-type calls below are cache hits.
+    lookups = fetch_concurrently({
+        "gl": lambda: load_gl_codes(COMPANY_ID, DATA_VERSION),
+        "customers": lambda: load_counterparties(("Income", "Cash Deposit"), COMPANY_ID, DATA_VERSION),
+        "suppliers": lambda: load_counterparties(("Expense", "Bill"), COMPANY_ID, DATA_VERSION),
+        "banks": lambda: load_bank_accounts(COMPANY_ID, DATA_VERSION),
+    })
+    gl_list = lookups["gl"]
+
+    entry_mode = st.radio(
+        "Τρόπος Καταχώρησης",
+        ["Μεμονωμένη", "Μαζική (πλέγμα)", "Επαναλαμβανόμενες"],
+        horizontal=True,
+        key="entry_mode",
+    )
+
+    if entry_mode == "Επαναλαμβανόμενες":
+        st.subheader("🔁 Πρότυπα Επαναλαμβανόμενων Συναλλαγών")
+        st.caption(
+            "Ενοίκια, μισθοδοσία, συνδρομές, δόσεις δανείων: ένα πρότυπο ανά συναλλαγή με συχνότητα και ημέρα "
+            "του μήνα (κενή = η ημέρα έναρξης)."
+        )
+        gl_opts = gl_list if gl_list else ["999"]
+        gl_labels = {opt.split(" - ")[0].strip(): opt for opt in gl_opts}
+        templates = load_recurring_templates()
+        templates_view = templates.assign(gl_code=templates["gl_code"].map(lambda c: gl_labels.get(c, c)))
+        edited_templates = st.data_editor(
+            templates_view,
+            num_rows="dynamic",
+            width='stretch',
+            hide_index=True,
+            key="recurring_editor",
+            column_config={
+                "id": st.column_config.NumberColumn("#", format="%d", disabled=True, width="small"),
+                "active": st.column_config.CheckboxColumn("Ενεργό", default=True),
+                "description": st.column_config.TextColumn("Περιγραφή"),
+                "doc_type": st.column_config.SelectboxColumn("Τύπος", options=BATCH_DOC_TYPES, default="Expense"),
+                "counterparty": st.column_config.TextColumn("Συναλλασσόμενος"),
+                "gl_code": st.column_config.SelectboxColumn("GL", options=gl_opts),
+                "amount_net": st.column_config.NumberColumn("Καθαρό €", min_value=0.0, step=0.01, format="%.2f"),
+                "vat_rate": st.column_config.SelectboxColumn("ΦΠΑ %", options=VAT_RATES, default=24),
+                "bank_account": st.column_config.TextColumn("Λογαριασμός"),
+                "status": st.column_config.SelectboxColumn("Κατάσταση", options=["Unpaid", "Paid"], default="Unpaid"),
+                "frequency": st.column_config.SelectboxColumn(
+                    "Συχνότητα",
+                    options=list(RECURRING_FREQUENCIES),
+                    format_func=lambda f: RECURRING_FREQUENCIES[f][0],
+                    default="monthly",
+                ),
+                "day_of_month": st.column_config.NumberColumn("Ημέρα", min_value=1, max_value=31, step=1, format="%d"),
+                "start_date": st.column_config.DateColumn("Έναρξη", format="DD/MM/YYYY", default=date.today()),
+                "end_date": st.column_config.DateColumn("Λήξη", format="DD/MM/YYYY"),
+            },
+        )
+        if st.button("Αποθήκευση Προτύπων", width='stretch'):
+            try:
+                counts = save_recurring_templates(templates, edited_templates)
+                if any(counts.values()):
+                    flash(
+                        f"✓ Πρότυπα: {counts['insert']} νέα, {counts['update']} αλλαγές, "
+                        f"{counts['delete']} διαγραφές."
+                    )
+                    st.rerun()
+                else:
+                    st.info("Δεν υπάρχουν αλλαγές για αποθήκευση.")
+            except ValueError as e:
+                st.error(str(e))
+            except Exception as e:
+                st.error(f"Σφάλμα: {str(e)}")
+
+        st.divider()
+        st.subheader("⚙️ Δημιουργία Εγγραφών")
+        up_to = st.date_input("Έως ημερομηνία", date.today(), key="recurring_up_to")
+        pending = pending_recurring(up_to)
+        due = compute_batch_amounts(pending[~pending["closed"]])
+
+        r1, r2, r3 = st.columns(3)
+        r1.metric("Εκκρεμείς εγγραφές", f"{len(due)}")
+        r2.metric("Σύνολο", f"€{due['amount_gross'].sum():,.2f}")
+        r3.metric("Σε κλειστές περιόδους", f"{int(pending['closed'].sum())}", help="Δεν καταχωρούνται (κλείσιμο περιόδου)")
+        if not due.empty:
+            st.dataframe(
+                pd.DataFrame({
+                    "Ημερ/νία": due["doc_date"].dt.date,
+                    "Περιγραφή": due["description"],
+                    "Συναλλασσόμενος": due["counterparty"],
+                    "Τύπος": due["doc_type"],
+                    "Σύνολο": due["amount_gross"],
+                    "Λογαριασμός": due["bank_account"],
+                }),
+                width='stretch',
+                hide_index=True,
+                column_config={
+                    "Ημερ/νία": st.column_config.DateColumn(format="DD/MM/YYYY"),
+                    "Σύνολο": st.column_config.NumberColumn(format="€%.2f"),
+                },
+            )
+            skip_labels = {
+                k: f"{d:%d/%m/%Y} · {desc or ''} · {cp or ''}"
+                for k, d, desc, cp in zip(due["recurring_key"], due["doc_date"], due["description"], due["counterparty"])
+            }
+            s1, s2 = st.columns([3, 1])
+            to_skip = s1.multiselect(
+                "Παράλειψη περιόδου",
+                options=list(skip_labels),
+                format_func=skip_labels.get,
+                key="recurring_skip",
+                help="Η περίοδος δεν θα δημιουργηθεί (ούτε αργότερα). Το ίδιο ισχύει όταν διαγράφεται μια εγγραφή προτύπου.",
+            )
+            if s2.button("Παράλειψη", width='stretch', disabled=not to_skip):
+                flash(f"Παραλείφθηκαν {skip_recurring(to_skip)} περίοδοι.")
+                st.rerun()
+        if st.button(f"ΔΗΜΙΟΥΡΓΙΑ {len(due)} ΕΓΓΡΑΦΩΝ", type="primary", width='stretch', disabled=due.empty):
+            try:
+                result = generate_recurring(up_to)
+                flash(f"Καταχωρήθηκαν {result['inserted']} επαναλαμβανόμενες εγγραφές.")
+                st.rerun()
+            except ValueError as e:
+                st.error(str(e))
+            except Exception as e:
+                st.error(f"❌ Σφάλμα κατά την αποθήκευση: {str(e)}")
+        st.stop()
+
+    if entry_mode == "Μαζική (πλέγμα)":
+        st.subheader("🧾 Μαζική Καταχώρηση Παραστατικών")
+        st.caption(
+            "Συμπληρώστε ή επικολλήστε (Ctrl+V από Excel) γραμμές. ΦΠΑ και σύνολο υπολογίζονται αυτόματα. "
+            "Αποθηκεύονται μόνο οι έγκυρες γραμμές, όλες μαζί σε μία συναλλαγή."
+        )
+        gl_opts = gl_list if gl_list else ["999"]
+        if "batch_grid_nonce" not in st.session_state:
+            st.session_state.batch_grid_nonce = 0
+        seed = pd.DataFrame(
+            {
+                "doc_date": [date.today()] * 5,
+                "doc_no": [""] * 5,
+                "doc_type": ["Bill"] * 5,
+                "counterparty": [""] * 5,
+                "description": [""] * 5,
+                "gl_code": [gl_opts[0]] * 5,
+                "amount_net": [0.0] * 5,
+                "vat_rate": [24] * 5,
+                "bank_account": [""] * 5,
+                "status": ["Unpaid"] * 5,
+            }
+        )
+        grid = st.data_editor(
+            seed,
+            num_rows="dynamic",
+            width='stretch',
+            hide_index=True,
+            key=f"batch_grid_{st.session_state.batch_grid_nonce}",
+            column_config={
+                "doc_date": st.column_config.DateColumn("Ημερομηνία", format="DD/MM/YYYY", required=True),
+                "doc_no": st.column_config.TextColumn("Αρ. Παρ/κου"),
+                "doc_type": st.column_config.SelectboxColumn("Τύπος", options=BATCH_DOC_TYPES, required=True),
+                "counterparty": st.column_config.TextColumn("Συναλλασσόμενος"),
+                "description": st.column_config.TextColumn("Περιγραφή"),
+                "gl_code": st.column_config.SelectboxColumn("GL", options=gl_opts),
+                "amount_net": st.column_config.NumberColumn("Καθαρό €", min_value=0.0, step=0.01, format="%.2f"),
+                "vat_rate": st.column_config.SelectboxColumn("ΦΠΑ %", options=VAT_RATES, required=True),
+                "bank_account": st.column_config.TextColumn("Λογαριασμός"),
+                "status": st.column_config.SelectboxColumn("Κατάσταση", options=["Unpaid", "Paid"], required=True),
+            },
+        )
+
+        # Ignore untouched seed rows (no counterparty and no amount)
+        filled = grid[
+            grid["counterparty"].fillna("").astype(str).str.strip().ne("")
+            | pd.to_numeric(grid["amount_net"], errors="coerce").fillna(0.0).ne(0.0)
+        ]
+        computed = compute_batch_amounts(filled)
+        computed["errors"] = validate_transaction_frame(computed)
+        valid = computed[computed["errors"] == ""]
+        invalid = computed[computed["errors"] != ""]
+
+        b1, b2, b3 = st.columns(3)
+        b1.metric("Έγκυρες γραμμές", f"{len(valid)}")
+        b2.metric("Με σφάλματα", f"{len(invalid)}")
+        b3.metric("Σύνολο έγκυρων", f"€{valid['amount_gross'].sum():,.2f}")
+
+        if not invalid.empty:
+            err_view = invalid[["counterparty", "amount_net", "errors"]].copy()
+            err_view.insert(0, "Γραμμή", invalid.index + 1)
+            err_view.columns = ["Γραμμή", "Συναλλασσόμενος", "Καθαρό", "Σφάλματα"]
+            st.dataframe(err_view, width='stretch', hide_index=True)
+
+        if st.button(f"ΑΠΟΘΗΚΕΥΣΗ {len(valid)} ΕΓΓΡΑΦΩΝ", type="primary", width='stretch', disabled=valid.empty):
+            try:
+                saved = save_journal_batch(batch_frame_to_rows(valid))
+                flash(f"Καταχωρήθηκαν {saved} εγγραφές.")
+                # New editor key => fresh grid for the next batch
+                st.session_state.batch_grid_nonce += 1
+                st.rerun()
+            except Exception as e:
+                st.error(f"❌ Σφάλμα κατά την αποθήκευση: {str(e)}")
+        st.stop()
+
     # Initialize VAT calculator state for this section
     if 'vat_calc_active' not in st.session_state:
         st.session_state.vat_calc_active = True
@@ -1474,7 +5781,7 @@ elif menu == "Νέα Εγγραφή":
         # Transaction-specific fields
         if trans_type == "💰 Εισπράξεις (Πωλήσεις)":
             st.subheader("📊 Στοιχεία Εισπράξης")
-            customers = load_counterparties(("Income", "Cash Deposit"))
+            customers = load_counterparties(("Income", "Cash Deposit"), COMPANY_ID, DATA_VERSION)
             if customers:
                 sel_customer = st.selectbox(
                     "Πελάτης (επιλογή)",
@@ -1518,7 +5825,7 @@ elif menu == "Νέα Εγγραφή":
             )
             status = "Unpaid" if "Εκκρεμής" in status_label else "Paid"
             if pay == "Τράπεζα":
-                bank_accounts = load_bank_accounts()
+                bank_accounts = load_bank_accounts(COMPANY_ID, DATA_VERSION)
                 if bank_accounts:
                     sel_bank = p2.selectbox(
                         "Λογαριασμός (επιλογή)",
@@ -1541,7 +5848,7 @@ elif menu == "Νέα Εγγραφή":
         
         elif trans_type == "💸 Πληρωμές (Έξοδα)":
             st.subheader("📊 Στοιχεία Πληρωμής")
-            suppliers = load_counterparties(("Expense", "Bill"))
+            suppliers = load_counterparties(("Expense", "Bill"), COMPANY_ID, DATA_VERSION)
             if suppliers:
                 sel_supplier = st.selectbox(
                     "Προμηθευτής (επιλογή)",
@@ -1585,7 +5892,7 @@ elif menu == "Νέα Εγγραφή":
             )
             status = "Unpaid" if "Εκκρεμής" in status_label else "Paid"
             if pay == "Τράπεζα":
-                bank_accounts = load_bank_accounts()
+                bank_accounts = load_bank_accounts(COMPANY_ID, DATA_VERSION)
                 if bank_accounts:
                     sel_bank = p2.selectbox(
                         "Λογαριασμός (επιλογή)",
@@ -1608,7 +5915,7 @@ elif menu == "Νέα Εγγραφή":
         
         elif trans_type == "📄 Τιμολόγια Αγορών":
             st.subheader("📊 Στοιχεία Τιμολογίου Αγοράς")
-            suppliers = load_counterparties(("Expense", "Bill"))
+            suppliers = load_counterparties(("Expense", "Bill"), COMPANY_ID, DATA_VERSION)
             if suppliers:
                 sel_supplier = st.selectbox(
                     "Προμηθευτής (επιλογή)",
@@ -1651,7 +5958,7 @@ elif menu == "Νέα Εγγραφή":
                 key="status_bill",
             )
             status = "Unpaid" if "Εκκρεμής" in status_label else "Paid"
-            bank_accounts = load_bank_accounts()
+            bank_accounts = load_bank_accounts(COMPANY_ID, DATA_VERSION)
             if bank_accounts:
                 sel_bank = p2.selectbox(
                     "Λογαριασμός (επιλογή)",
@@ -1672,7 +5979,7 @@ elif menu == "Νέα Εγγραφή":
             st.subheader("💳 Μεταφορά Ποσού μεταξύ Λογαριασμών")
             partner = st.text_input("Περιγραφή", "Μεταφορά χρημάτων")
             
-            transfer_accounts = load_bank_accounts()
+            transfer_accounts = load_bank_accounts(COMPANY_ID, DATA_VERSION)
             if not transfer_accounts:
                 transfer_accounts = ["Ταμείο"]
             from_acc = st.selectbox("Από Λογαριασμό", transfer_accounts, key="transfer_from")
@@ -1741,7 +6048,7 @@ elif menu == "Νέα Εγγραφή":
         
         else:  # Άλλη Συναλλαγή
             st.subheader("📊 Στοιχεία Συναλλαγής")
-            partners = load_counterparties(None)
+            partners = load_counterparties(None, COMPANY_ID, DATA_VERSION)
             if partners:
                 sel_partner = st.selectbox(
                     "Συναλλασσόμενος (επιλογή)",
@@ -1780,7 +6087,7 @@ elif menu == "Νέα Εγγραφή":
                 key="status_other",
             )
             status = "Unpaid" if "Εκκρεμής" in status_label else "Paid"
-            bank_accounts = load_bank_accounts()
+            bank_accounts = load_bank_accounts(COMPANY_ID, DATA_VERSION)
             if bank_accounts:
                 sel_bank = st.selectbox(
                     "Λογαριασμός (επιλογή)",
@@ -1857,14 +6164,8 @@ elif menu == "Νέα Εγγραφή":
                     gl_val = gl_choice.split(" - ")[0] if gl_choice else "999"
                     doc_date_iso = d_date.strftime('%Y-%m-%d') if hasattr(d_date, 'strftime') else str(d_date)
 
-                    db_execute(
-                        """INSERT INTO journal (
-                                doc_date, doc_no, doc_type, counterparty, description, gl_code,
-                                amount_net, vat_amount, amount_gross, payment_method, bank_account, status
-                            ) VALUES (
-                                :doc_date, :doc_no, :doc_type, :counterparty, :description, :gl_code,
-                                :amount_net, :vat_amount, :amount_gross, :payment_method, :bank_account, :status
-                            )""",
+                    # Journal insert + lookup upserts + data-version bump in ONE transaction.
+                    save_journal_entry(
                         {
                             "doc_date": doc_date_iso,
                             "doc_no": d_no,
@@ -1880,24 +6181,13 @@ elif menu == "Νέα Εγγραφή":
                             "status": status,
                         },
                     )
-                    # Keep Settings lookup lists in sync (so you can edit/delete there)
-                    try:
-                        upsert_counterparty(partner, _counterparty_kind_for_doc_type(d_type))
-                    except Exception:
-                        pass
-                    try:
-                        if bank and str(bank).strip():
-                            upsert_bank_account(bank, _bank_kind_from_name(bank))
-                    except Exception:
-                        pass
-                    st.cache_data.clear()  # Clear cache after new transaction
-                    st.success("✅ Καταχωρήθηκε με επιτυχία!")
+                    # Non-blocking confirmation (shown as a toast after the rerun)
+                    flash("Καταχωρήθηκε με επιτυχία!")
                     # Reset values
                     st.session_state.calc_net = 0.0
                     st.session_state.calc_vat_val = 0.0
                     st.session_state.calc_gross = 0.0
                     st.session_state.calc_vat_rate = 24
-                    time.sleep(0.5)
                     st.rerun()
                 except Exception as e:
                     st.error(f"❌ Σφάλμα κατά την αποθήκευση: {str(e)}")
@@ -1908,12 +6198,6 @@ elif menu == "Νέα Εγγραφή":
 elif menu == "ΦΠΑ & Φόροι (Report)":
     st.title("📊 Αναλυτική Έκθεση ΦΠΑ & Φόρων")
 
-    df = load_journal_data()
-    
-    # Convert date to datetime and clean data
-    df['doc_date'] = pd.to_datetime(df['doc_date'], errors='coerce')
-    df = clean_dataframe(df)
-    
     # 1. ΠΕΡΙΟΔΟΣ ΕΠΙΛΟΓΗΣ
     st.subheader("📅 Επιλογή Περιόδου")
     col_type, col_yr, col_mo = st.columns(3)
@@ -1923,43 +6207,41 @@ elif menu == "ΦΠΑ & Φόροι (Report)":
     
     if period_type == "Μηνιαία":
         sel_month = col_mo.selectbox("Μήνας", range(1, 13), index=datetime.now().month - 1)
-        mask = (df['doc_date'].dt.year == sel_year) & (df['doc_date'].dt.month == sel_month)
+        period = {"year": int(sel_year), "month": sel_month}
         period_label = f"{sel_month:02d}/{sel_year}"
     elif period_type == "Τριμηνιαία":
         sel_quarter = col_mo.selectbox("Τρίμηνο", [1, 2, 3, 4])
-        start_month = (sel_quarter - 1) * 3 + 1
-        end_month = sel_quarter * 3
-        mask = (df['doc_date'].dt.year == sel_year) & (df['doc_date'].dt.month.isin(range(start_month, end_month + 1)))
+        period = {"year": int(sel_year), "quarter": sel_quarter}
         period_label = f"Τ{sel_quarter}/{sel_year}"
     else:
-        mask = (df['doc_date'].dt.year == sel_year)
+        period = {"year": int(sel_year)}
         period_label = str(sel_year)
     
-    df_period = df[mask].copy()
-    
-    # Ensure all numeric columns are properly formatted
-    for col in ['amount_net', 'vat_amount', 'amount_gross']:
-        df_period[col] = pd.to_numeric(df_period[col], errors='coerce').fillna(0.0)
-    
-    # Ensure amount_gross = amount_net + vat_amount if missing
-    df_period.loc[df_period['amount_gross'] == 0, 'amount_gross'] = df_period['amount_net'] + df_period['vat_amount']
+    # Per doc_type totals (net / VAT / gross, gross falling back to net + VAT)
+    totals = load_period_totals(**period, company_id=COMPANY_ID, data_version=DATA_VERSION)
     
-    if df_period.empty:
+    if totals.empty:
         st.warning(f"⚠️ Δεν βρέθηκαν δεδομένα για την περίοδο {period_label}")
         st.stop()
     
     # 2. ΚΎΡΙΑ ΣΤΟΙΧΕΊΑ ΠΕΡΙΌΔΟΥ
     st.divider()
     st.subheader(f"📈 Σύνοψη Περιόδου {period_label}")
+    first_month, last_month = _period_months(period.get("month"), period.get("quarter"))
+    closed_to = closed_month_of(sel_year)
+    if closed_to >= last_month:
+        st.caption("🔒 Κλειστή περίοδος: τα σύνολα προέρχονται από το στιγμιότυπο κλεισίματος.")
+    elif closed_to >= first_month:
+        st.caption(f"🔒 Οι μήνες έως {closed_to:02d}/{sel_year} είναι κλειστοί (στιγμιότυπο κλεισίματος).")
     
     # Calculations
-    income_net = df_period[df_period['doc_type'] == 'Income']['amount_net'].sum()
-    income_vat = df_period[df_period['doc_type'] == 'Income']['vat_amount'].sum()
-    income_gross = df_period[df_period['doc_type'] == 'Income']['amount_gross'].sum()
+    income_net = totals[totals['doc_type'] == 'Income']['amount_net'].sum()
+    income_vat = totals[totals['doc_type'] == 'Income']['vat_amount'].sum()
+    income_gross = totals[totals['doc_type'] == 'Income']['amount_gross'].sum()
     
-    expense_net = df_period[df_period['doc_type'].isin(['Expense', 'Bill'])]['amount_net'].sum()
-    expense_vat = df_period[df_period['doc_type'].isin(['Expense', 'Bill'])]['vat_amount'].sum()
-    expense_gross = df_period[df_period['doc_type'].isin(['Expense', 'Bill'])]['amount_gross'].sum()
+    expense_net = totals[totals['doc_type'].isin(['Expense', 'Bill'])]['amount_net'].sum()
+    expense_vat = totals[totals['doc_type'].isin(['Expense', 'Bill'])]['vat_amount'].sum()
+    expense_gross = totals[totals['doc_type'].isin(['Expense', 'Bill'])]['amount_gross'].sum()
     
     net_profit = income_net - expense_net
     
@@ -1968,7 +6250,7 @@ elif menu == "ΦΠΑ & Φόροι (Report)":
     m1.metric("Πωλήσεις (Καθαρό)", f"€{income_net:,.2f}", help="Σύνολο καθαρών εσόδων")
     m2.metric("Αγορές (Καθαρό)", f"€{expense_net:,.2f}", help="Σύνολο καθαρών εξόδων")
     m3.metric("Κέρδος Χρήσης", f"€{net_profit:,.2f}", help="Πωλήσεις - Αγορές")
-    m4.metric("Συναλλαγές", f"{len(df_period)}", help="Σύνολο καταχωρήσεων")
+    m4.metric("Συναλλαγές", f"{int(totals['n'].sum())}", help="Σύνολο καταχωρήσεων")
     
     # 3. ΑΝΑΛΥΣΗ ΦΠΑ
     st.divider()
@@ -1994,11 +6276,7 @@ elif menu == "ΦΠΑ & Φόροι (Report)":
         
         # VAT Table by type
         st.write("**Ανάλυση κατά τύπο συναλλαγής:**")
-        vat_summary = df_period.groupby('doc_type').agg({
-            'amount_net': 'sum',
-            'vat_amount': 'sum',
-            'amount_gross': 'sum'
-        }).round(2)
+        vat_summary = totals.set_index('doc_type')[['amount_net', 'vat_amount', 'amount_gross']].round(2)
         vat_summary.columns = ['Καθαρό', 'ΦΠΑ', 'Σύνολο']
         vat_summary['ΦΠΑ %'] = (vat_summary['ΦΠΑ'] / vat_summary['Καθαρό'] * 100).round(1)
         # Replace .applymap with lambda
@@ -2040,9 +6318,8 @@ elif menu == "ΦΠΑ & Φόροι (Report)":
     with tab_data:
         st.write("**Λεπτομέρειες Συναλλαγών Περιόδου**")
         
-        df_display = df_period.copy()
+        df_display = load_journal_rows(**period, company_id=COMPANY_ID, data_version=DATA_VERSION)
         df_display['doc_date'] = df_display['doc_date'].dt.strftime('%d/%m/%Y')
-        df_display = df_display.sort_values('doc_date', ascending=False)
         
         # Select and rename columns
         cols_to_show = ['doc_date', 'doc_no', 'doc_type', 'counterparty', 'description', 
@@ -2071,8 +6348,12 @@ elif menu == "Καρτέλες (Ledgers)":
     st.title("📇 Καρτέλες Συναλλασσομένων")
 
     partners_df = pd.read_sql_query(
-        text("SELECT DISTINCT counterparty FROM journal WHERE counterparty IS NOT NULL AND counterparty != ''"),
-        ENGINE,
+        text(
+            "SELECT DISTINCT counterparty FROM journal_v "
+            "WHERE company_id = :company_id AND counterparty IS NOT NULL AND counterparty != ''"
+        ),
+        READ_ENGINE,
+        params={"company_id": COMPANY_ID},
     )
     partners = sorted(partners_df['counterparty'].tolist())
     
@@ -2085,18 +6366,34 @@ elif menu == "Καρτέλες (Ledgers)":
     sel = st.selectbox("Επιλογή Συναλλασσόμενου", partners, help="Επιλέξτε τον συναλλασσόμενο για να δείτε τις συναλλαγές του")
     
     if sel:
+        # Closed periods are summarized by the opening-balance snapshot unless asked for.
+        closed_through = get_closed_through()
+        show_closed = bool(closed_through) and st.toggle(
+            f"🔒 Εμφάνιση κλειστών περιόδων (έως {format_period_key(closed_through)})",
+            value=False,
+            key="ledger_show_closed",
+        )
+        opening = pd.DataFrame(columns=PERIOD_BALANCE_COLUMNS)
+        ledger_sql = (
+            "SELECT * FROM journal_v WHERE company_id = :company_id "
+            "AND (counterparty_id = (SELECT id FROM counterparties WHERE company_id = :company_id AND name = :counterparty) "
+            "OR (counterparty_id IS NULL AND counterparty = :counterparty))"
+        )
+        if closed_through and not show_closed:
+            opening = load_opening_balances("counterparty", sel)
+            ledger_sql += f" AND {REPORT_OPEN_SQL}"
         df = pd.read_sql_query(
-            text("SELECT * FROM journal WHERE counterparty = :counterparty ORDER BY doc_date DESC"),
-            ENGINE,
-            params={"counterparty": sel},
+            text(ledger_sql + " ORDER BY doc_date DESC"),
+            READ_ENGINE,
+            params={"company_id": COMPANY_ID, "counterparty": sel, "closed_through": closed_through},
         )
         
-        if df.empty:
+        if df.empty and opening.empty:
             st.warning("⚠️ Δεν υπάρχουν συναλλαγές για τον επιλεγμένο συναλλασσόμενο")
             st.stop()
         
-        # Convert date and clean data
-        df['doc_date'] = pd.to_datetime(df['doc_date'], errors='coerce')
+        # Convert date (stored as ISO) and clean data
+        df['doc_date'] = pd.to_datetime(df['doc_date'], errors='coerce', format='ISO8601')
         df = clean_dataframe(df)
         
         # Date and type filters
@@ -2145,17 +6442,24 @@ elif menu == "Καρτέλες (Ledgers)":
         # Ensure amount_gross = amount_net + vat_amount if missing
         df_filtered.loc[df_filtered['amount_gross'] == 0, 'amount_gross'] = df_filtered['amount_net'] + df_filtered['vat_amount']
         
-        if df_filtered.empty:
+        if df_filtered.empty and opening.empty:
             st.warning("⚠️ Δεν βρέθηκαν συναλλαγές για τα επιλεγμένα κριτήρια")
         else:
             st.divider()
             st.subheader(f"📊 Καρτέλα: {sel}")
             
-            # Calculations
-            total_income = df_filtered[df_filtered['doc_type'] == 'Income']['amount_gross'].sum()
-            total_expense = df_filtered[df_filtered['doc_type'].isin(['Expense', 'Bill'])]['amount_gross'].sum()
-            unpaid_amount = df_filtered[df_filtered['status'] == 'Unpaid']['amount_gross'].sum()
-            paid_amount = df_filtered[df_filtered['status'] == 'Paid']['amount_gross'].sum()
+            # Totals include the opening balance of the closed periods (if hidden)
+            totals_df = df_filtered[['doc_type', 'status', 'amount_net', 'vat_amount', 'amount_gross']]
+            if not opening.empty:
+                st.caption(
+                    f"🔒 Περιλαμβάνεται η απογραφή των κλειστών περιόδων έως {format_period_key(closed_through)} "
+                    f"({int(opening['n'].sum())} εγγραφές)."
+                )
+                totals_df = pd.concat([totals_df, opening[totals_df.columns]], ignore_index=True)
+            total_income = totals_df[totals_df['doc_type'] == 'Income']['amount_gross'].sum()
+            total_expense = totals_df[totals_df['doc_type'].isin(['Expense', 'Bill'])]['amount_gross'].sum()
+            unpaid_amount = totals_df[totals_df['status'] == 'Unpaid']['amount_gross'].sum()
+            paid_amount = totals_df[totals_df['status'] == 'Paid']['amount_gross'].sum()
             
             # KPI Cards
             k1, k2, k3, k4, k5 = st.columns(5)
@@ -2189,7 +6493,7 @@ elif menu == "Καρτέλες (Ledgers)":
             st.divider()
             # Summary by transaction type
             st.subheader("📊 Ανάλυση κατά Τύπο")
-            summary = df_filtered.groupby('doc_type').agg({
+            summary = totals_df.groupby('doc_type').agg({
                 'amount_net': 'sum',
                 'vat_amount': 'sum',
                 'amount_gross': 'sum'
@@ -2213,21 +6517,105 @@ elif menu == "Καρτέλες (Ledgers)":
                 mime="text/csv"
             )
 
+# --- AGING ---
+elif menu == "Ενηλικίωση Υπολοίπων":
+    st.title("⏳ Ενηλικίωση Υπολοίπων")
+    st.caption("Ανοιχτές (Unpaid) εγγραφές ανά ηλικία σε ημέρες από την ημερομηνία παραστατικού.")
+
+    side = st.radio(
+        "Υπόλοιπα",
+        list(AGING_SIDES),
+        format_func=lambda x: "📥 Πελάτες (Εισπρακτέα)" if x == "receivable" else "📤 Προμηθευτές (Πληρωτέα)",
+        horizontal=True,
+        key="aging_side",
+    )
+    aging = load_aging(date.today(), COMPANY_ID, DATA_VERSION)
+    aging = aging[aging["side"] == side].reset_index(drop=True)
+
+    if aging.empty:
+        st.info("📭 Δεν υπάρχουν ανοιχτά υπόλοιπα")
+        st.stop()
+
+    # Bucket totals
+    cols = st.columns(len(AGING_BUCKETS) + 1)
+    for col, (key, label) in zip(cols, AGING_BUCKETS.items()):
+        col.metric(f"{label} ημέρες", f"€{aging[key].sum():,.2f}")
+    cols[-1].metric("Σύνολο", f"€{aging['total'].sum():,.2f}", help=f"{int(aging['n'].sum())} ανοιχτές εγγραφές")
+
+    st.divider()
+    st.subheader("👥 Ανά Συναλλασσόμενο")
+    grid = pd.DataFrame({
+        "Συναλλασσόμενος": aging["counterparty"].replace("", "—"),
+        **{label: aging[key] for key, label in AGING_BUCKETS.items()},
+        "Σύνολο": aging["total"],
+        "Εγγραφές": aging["n"],
+        "Παλαιότερη": aging["oldest"].dt.date,
+    })
+    money = st.column_config.NumberColumn(format="€%.2f")
+    event = st.dataframe(
+        grid,
+        width='stretch',
+        hide_index=True,
+        on_select="rerun",
+        selection_mode="single-row",
+        key=f"aging_grid_{side}",
+        column_config={
+            **{label: money for label in AGING_BUCKETS.values()},
+            "Σύνολο": money,
+            "Παλαιότερη": st.column_config.DateColumn(format="DD/MM/YYYY"),
+        },
+    )
+
+    # Drill-down: the open items behind the selected line
+    sel_rows = [i for i in event.selection.rows if 0 <= i < len(aging)]
+    if not sel_rows:
+        st.caption("Επιλέξτε γραμμή για να δείτε τις ανοιχτές εγγραφές.")
+    else:
+        line = aging.iloc[sel_rows[0]]
+        st.subheader(f"📋 Ανοιχτές εγγραφές: {line['counterparty'] or '—'}")
+        items = load_open_items(side, line["counterparty_id"], line["counterparty"], COMPANY_ID, DATA_VERSION)
+        age = (pd.Timestamp(date.today()) - items["doc_date"]).dt.days
+        items_view = pd.DataFrame({
+            "#": items["id"],
+            "Ημερ/νία": items["doc_date"].dt.date,
+            "Ημέρες": age,
+            "Κλίμακα": pd.cut(
+                age.fillna(10**6), [-10**6, 30, 60, 90, 10**7], labels=list(AGING_BUCKETS.values())
+            ).astype(str),
+            "Αρ. Παρ/κου": items["doc_no"],
+            "Τύπος": items["doc_type"],
+            "Περιγραφή": items["description"],
+            "Ποσό": items["amount_gross"],
+        })
+        st.dataframe(
+            items_view,
+            width='stretch',
+            hide_index=True,
+            column_config={
+                "#": st.column_config.NumberColumn(format="%d", width="small"),
+                "Ημερ/νία": st.column_config.DateColumn(format="DD/MM/YYYY"),
+                "Ημέρες": st.column_config.NumberColumn(format="%d"),
+                "Ποσό": money,
+            },
+        )
+
 # --- ARCHIVE ---
 elif menu == "Αρχείο & Διορθώσεις":
     st.title("📚 Αρχείο & Διορθώσεις")
 
     with st.spinner("Φόρτωση αρχείου..."):
-        df = load_journal_data()
+        df = load_journal_data(COMPANY_ID, DATA_VERSION)
     
     if df.empty:
         st.info("📭 Δεν υπάρχουν καταχωρήσεις στο αρχείο")
         st.stop()
     
-    # Cleaning and conversion
-    df['doc_date'] = pd.to_datetime(df['doc_date'], errors='coerce')
+    # Cleaning (doc_date is already parsed by the loader)
     df = clean_dataframe(df)
     df['id'] = df['id'].astype(int)  # ΣΗΜΑΝΤΙΚΟ: Μετατροπή id σε int
+    # Rows of closed periods are read-only (the write helpers refuse them too)
+    closed_through = get_closed_through()
+    df['locked'] = (df['doc_date'].dt.year * 100 + df['doc_date'].dt.month) <= closed_through
     
     st.subheader("📋 Όλες οι Εγγραφές")
 
@@ -2337,11 +6725,7 @@ elif menu == "Αρχείο & Διορθώσεις":
     mask = mask & (df['amount_gross'] >= amount_min) & (df['amount_gross'] <= amount_max)
     
     if search_term:
-        mask = mask & (
-            (df['counterparty'].str.contains(search_term, case=False, na=False)) |
-            (df['description'].str.contains(search_term, case=False, na=False)) |
-            (df['doc_no'].str.contains(search_term, case=False, na=False))
-        )
+        mask = mask & journal_search_mask(df, search_term)
     
     df_filtered = df[mask].copy()
     
@@ -2358,52 +6742,194 @@ elif menu == "Αρχείο & Διορθώσεις":
     if df_filtered.empty:
         st.warning("⚠️ Δεν βρέθηκαν εγγραφές")
     else:
-        st.markdown(f"**Σύνολο:** {len(df_filtered)} εγγραφών")
+        sum_col, fmt_col, exp_col = st.columns([2, 1, 1])
+        sum_col.markdown(f"**Σύνολο:** {len(df_filtered)} εγγραφών")
+        export_fmt = fmt_col.selectbox(
+            "Μορφή εξαγωγής", ["XLSX", "CSV"], key="arch_export_fmt", label_visibility="collapsed"
+        )
+        # Same filters as the list, re-run in SQL and streamed to a file on click.
+        export_filters = {
+            "date_from": date_from,
+            "date_to": date_to,
+            "amount_min": amount_min,
+            "amount_max": amount_max,
+            "doc_types": selected_type,
+            "search": search_term,
+            "sort_by": sort_by,
+        }
+        exp_col.download_button(
+            "📤 Εξαγωγή",
+            data=journal_export_download(export_filters, export_fmt.lower()),
+            file_name=f"journal_{date_from}_{date_to}.{export_fmt.lower()}",
+            mime="text/csv" if export_fmt == "CSV" else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore",
+            key="arch_export",
+            width='stretch',
+        )
         st.divider()
         
         if display_mode == "Λίστα":
-            # ΑΠΛΗ ΛΙΣΤΑ with pagination
-            PAGE_SIZE = 20
+            # ΑΠΛΗ ΛΙΣΤΑ with pagination.
+            # One selectable grid per page (instead of a container + buttons per row)
+            # keeps the widget tree small, so larger pages stay fast.
+            page_sizes = [50, 100, 250, 500]
+            PAGE_SIZE = st.selectbox("Εγγραφές ανά σελίδα", page_sizes, index=1, key="arch_page_size")
             total_pages = max(1, (len(df_filtered) + PAGE_SIZE - 1) // PAGE_SIZE)
             if "arch_page" not in st.session_state:
                 st.session_state.arch_page = 0
             st.session_state.arch_page = min(st.session_state.arch_page, total_pages - 1)
-            
+
             start_idx = st.session_state.arch_page * PAGE_SIZE
             end_idx = min(start_idx + PAGE_SIZE, len(df_filtered))
             page_df = df_filtered.iloc[start_idx:end_idx]
-            
-            for row in page_df.itertuples(index=False):
-                rid = int(row.id)
-                ddate = row.doc_date.strftime('%d/%m/%Y')
-                cparty = row.counterparty if row.counterparty else '—'
-                dtype = row.doc_type
-                status = row.status
-                amount = row.amount_gross
-                
-                # Icons
-                type_icon = {'Income': '📥', 'Expense': '📤', 'Bill': '📋', 'Transfer': '🔄'}.get(dtype, '📍')
-                status_text = "✅ Πληρωμένη" if status == "Paid" else "⏳ Εκκρεμής"
-                
-                with st.container(border=True):
-                    st.markdown(f"{type_icon} **{cparty}** • {ddate} • **€{amount:,.2f}**")
-                    st.caption(f"{dtype} | {status_text}")
-                    
-                    col_edit, col_del, col_id = st.columns([2, 2, 1])
-                    with col_edit:
-                        if st.button("Επεξεργασία", key=f"list_edit_{rid}", width='stretch'):
-                            st.session_state["arch_next_display"] = "Λεπτομέρειες"
-                            st.session_state["arch_focus_id"] = rid
+
+            type_icons = {'Income': '📥', 'Expense': '📤', 'Bill': '📋', 'Transfer': '🔄'}
+            grid = pd.DataFrame(
+                {
+                    "id": page_df["id"].astype(int).to_numpy(),
+                    "doc_date": page_df["doc_date"].dt.date.to_numpy(),
+                    "doc_type": [f"{type_icons.get(t, '📍')} {t}" for t in page_df["doc_type"]],
+                    "counterparty": page_df["counterparty"].replace("", "—").to_numpy(),
+                    "description": page_df["description"].to_numpy(),
+                    "amount_net": page_df["amount_net"].to_numpy(),
+                    "vat_amount": page_df["vat_amount"].to_numpy(),
+                    "amount_gross": page_df["amount_gross"].to_numpy(),
+                    "status": [
+                        ("🔒 " if locked else "") + ("✅ Πληρωμένη" if s == "Paid" else "⏳ Εκκρεμής")
+                        for s, locked in zip(page_df["status"], page_df["locked"])
+                    ],
+                    "bank_account": page_df["bank_account"].to_numpy(),
+                }
+            )
+
+            # Key per page/size: row positions of a selection only make sense for the page they came from.
+            event = st.dataframe(
+                grid,
+                width='stretch',
+                hide_index=True,
+                on_select="rerun",
+                selection_mode="multi-row",
+                key=f"arch_grid_{st.session_state.arch_page}_{PAGE_SIZE}",
+                column_config={
+                    "id": st.column_config.NumberColumn("#", format="%d", width="small"),
+                    "doc_date": st.column_config.DateColumn("Ημερ/νία", format="DD/MM/YYYY"),
+                    "doc_type": st.column_config.TextColumn("Τύπος"),
+                    "counterparty": st.column_config.TextColumn("Συναλλασσόμενος"),
+                    "description": st.column_config.TextColumn("Περιγραφή"),
+                    "amount_net": st.column_config.NumberColumn("Καθαρό", format="€%.2f"),
+                    "vat_amount": st.column_config.NumberColumn("ΦΠΑ", format="€%.2f"),
+                    "amount_gross": st.column_config.NumberColumn("Σύνολο", format="€%.2f"),
+                    "status": st.column_config.TextColumn("Κατάσταση"),
+                    "bank_account": st.column_config.TextColumn("Λογαριασμός"),
+                },
+            )
+            sel_rows = [i for i in event.selection.rows if 0 <= i < len(grid)]
+            sel_ids = [int(grid["id"].iloc[i]) for i in sel_rows]
+            locked_ids = set(df_filtered.loc[df_filtered["locked"], "id"].astype(int))
+            sel_locked = bool(locked_ids.intersection(sel_ids))
+
+            # Action bar: acts on the grid selection
+            act_info, act_edit, act_del = st.columns([2, 1, 1])
+            with act_info:
+                if sel_ids:
+                    sel_total = float(grid["amount_gross"].iloc[sel_rows].sum())
+                    st.caption(f"Επιλεγμένες: {len(sel_ids)} • Σύνολο €{sel_total:,.2f}")
+                    if sel_locked:
+                        st.caption(f"🔒 Η επιλογή περιέχει εγγραφές κλειστής περιόδου (έως {format_period_key(closed_through)}).")
+                else:
+                    st.caption("Επιλέξτε γραμμές από τον πίνακα για επεξεργασία ή διαγραφή.")
+            with act_edit:
+                if st.button("Επεξεργασία", key="list_edit", width='stretch', disabled=(len(sel_ids) != 1 or sel_locked)):
+                    st.session_state["arch_next_display"] = "Λεπτομέρειες"
+                    st.session_state["arch_focus_id"] = sel_ids[0]
+                    st.rerun()
+            with act_del:
+                if st.button("Διαγραφή", key="list_del", width='stretch', disabled=(not sel_ids or sel_locked)):
+                    st.session_state["arch_confirm_delete"] = sel_ids
+                    st.rerun()
+
+            visible_ids = set(df_filtered["id"].astype(int))
+            pending_del = [i for i in st.session_state.get("arch_confirm_delete", []) if i in visible_ids]
+            if pending_del:
+                st.error(f"⚠️ Διαγραφή {len(pending_del)} εγγραφών; Η ενέργεια δεν αναιρείται.")
+                col_yes, col_no = st.columns(2)
+                with col_yes:
+                    if st.button("✅ Ναι, διαγραφή", key="list_del_yes", width='stretch', type="primary"):
+                        try:
+                            deleted = bulk_delete_journal(pending_del)
+                            st.session_state.pop("arch_confirm_delete", None)
+                            flash(f"Διαγράφηκαν {deleted} εγγραφές.", icon="🗑️")
                             st.rerun()
-                    with col_del:
-                        if st.button("Διαγραφή", key=f"list_del_{rid}", width='stretch'):
-                            db_execute("DELETE FROM journal WHERE id = :id", {"id": rid})
-                            st.success("Διαγράφηκε!")
-                            time.sleep(0.3)
+                        except Exception as e:
+                            st.error(f"❌ Σφάλμα κατά τη διαγραφή: {str(e)}")
+                with col_no:
+                    if st.button("❌ Ακύρωση", key="list_del_no", width='stretch', type="secondary"):
+                        st.session_state.pop("arch_confirm_delete", None)
+                        st.rerun()
+
+            # Bulk actions: one set-based statement (per id chunk) and one cache invalidation
+            if st.toggle("⚡ Μαζικές Ενέργειες", value=False, key="arch_bulk_toggle"):
+                all_ids = df_filtered.loc[~df_filtered["locked"], "id"].astype(int).tolist()
+                if locked_ids:
+                    st.caption(f"🔒 Εξαιρούνται {len(locked_ids)} εγγραφές κλειστών περιόδων.")
+                with st.container(border=True):
+                    scope = st.radio(
+                        "Εφαρμογή σε",
+                        ["selection", "filter"],
+                        format_func=lambda x: (
+                            f"Επιλεγμένες γραμμές ({len(sel_ids)})" if x == "selection"
+                            else f"Όλες τις εγγραφές του φίλτρου ({len(all_ids)})"
+                        ),
+                        horizontal=True,
+                        key="arch_bulk_scope",
+                    )
+                    target_ids = [i for i in sel_ids if i not in locked_ids] if scope == "selection" else all_ids
+                    bulk_action = st.selectbox(
+                        "Ενέργεια",
+                        ["Ορισμός Κατάστασης", "Ορισμός Λογαριασμού", "Ορισμός GL", "Διαγραφή"],
+                        key="arch_bulk_action",
+                    )
+                    changes: Dict[str, Any] = {}
+                    if bulk_action == "Ορισμός Κατάστασης":
+                        changes["status"] = st.selectbox("Νέα Κατάσταση", ["Paid", "Unpaid"], key="arch_bulk_status")
+                    elif bulk_action == "Ορισμός Λογαριασμού":
+                        bulk_banks = load_bank_accounts(COMPANY_ID, DATA_VERSION)
+                        sel_bulk_bank = st.selectbox(
+                            "Νέος Λογαριασμός", ["(Κενό)", "(Νέος Λογαριασμός)"] + bulk_banks, key="arch_bulk_bank"
+                        )
+                        if sel_bulk_bank == "(Κενό)":
+                            changes["bank_account"] = ""
+                        elif sel_bulk_bank == "(Νέος Λογαριασμός)":
+                            changes["bank_account"] = st.text_input("Όνομα Λογαριασμού", key="arch_bulk_bank_new").strip()
+                        else:
+                            changes["bank_account"] = sel_bulk_bank
+                    elif bulk_action == "Ορισμός GL":
+                        bulk_gl = st.selectbox("Νέο GL", load_gl_codes(COMPANY_ID, DATA_VERSION) or ["999"], key="arch_bulk_gl")
+                        changes["gl_code"] = str(bulk_gl).split(" - ")[0]
+
+                    target_total = float(df_filtered[df_filtered["id"].isin(target_ids)]["amount_gross"].sum()) if target_ids else 0.0
+                    st.caption(f"Προεπισκόπηση: θα επηρεαστούν **{len(target_ids)}** εγγραφές (σύνολο €{target_total:,.2f}).")
+                    confirmed = True
+                    if bulk_action == "Διαγραφή":
+                        confirmed = st.checkbox("Επιβεβαιώνω τη μαζική διαγραφή", key="arch_bulk_confirm")
+                    if st.button(
+                        "Εφαρμογή",
+                        key="arch_bulk_apply",
+                        type="primary",
+                        width='stretch',
+                        disabled=(not target_ids or not confirmed),
+                    ):
+                        try:
+                            if bulk_action == "Διαγραφή":
+                                n = bulk_delete_journal(target_ids)
+                                flash(f"Διαγράφηκαν {n} εγγραφές.", icon="🗑️")
+                            else:
+                                n = bulk_update_journal(target_ids, changes)
+                                flash(f"Ενημερώθηκαν {n} εγγραφές.")
                             st.rerun()
-                    with col_id:
-                        st.caption(f"#{rid}")
-            
+                        except Exception as e:
+                            st.error(f"❌ Σφάλμα μαζικής ενέργειας: {str(e)}")
+
             # Pagination controls
             if total_pages > 1:
                 st.divider()
@@ -2450,9 +6976,7 @@ elif menu == "Αρχείο & Διορθώσεις":
             # Nice label per id
             label_by_id = {}
             try:
-                tmp = df_filtered.copy()
-                tmp["doc_date"] = pd.to_datetime(tmp["doc_date"], errors="coerce")
-                for r in tmp.itertuples(index=False):
+                for r in df_filtered.itertuples(index=False):
                     rid0 = int(r.id)
                     d = r.doc_date.strftime('%d/%m/%Y') if hasattr(r.doc_date, "strftime") and pd.notna(r.doc_date) else "—"
                     cp = r.counterparty if getattr(r, "counterparty", None) else "—"
@@ -2490,6 +7014,8 @@ elif menu == "Αρχείο & Διορθώσεις":
                     st.write(f"**Σύνολο:** €{row.amount_gross:,.2f}")
                 
                 st.write(f"**Περιγραφή:** {row.description if row.description else '—'}")
+                if row.locked:
+                    st.info(f"🔒 Η εγγραφή ανήκει σε κλειστή περίοδο (έως {format_period_key(closed_through)}) και δεν διορθώνεται.")
                 
                 st.divider()
                 st.subheader("Διόρθωση")
@@ -2512,7 +7038,7 @@ elif menu == "Αρχείο & Διορθώσεις":
                     pays = ["Τράπεζα", "Μετρητά", "Επί Πιστώσει"]
                     cur_pay = row.payment_method if row.payment_method in pays else pays[0]
                     new_pay = st.selectbox("Πληρωμή", pays, index=pays.index(cur_pay), key=f"ed_py_{rid}")
-                    bank_accounts = load_bank_accounts()
+                    bank_accounts = load_bank_accounts(COMPANY_ID, DATA_VERSION)
                     cur_bank = str(row.bank_account or "").strip()
                     bank_opts = ["(Κενό)", "(Νέος Λογαριασμός)"] + bank_accounts
                     if cur_bank and cur_bank in bank_accounts:
@@ -2542,7 +7068,7 @@ elif menu == "Αρχείο & Διορθώσεις":
                     new_stat = st.selectbox("Κατάσταση", stats, 
                                            index=stats.index(row.status) if row.status in stats else 1,
                                            key=f"ed_st_{rid}")
-                    gl_list = load_gl_codes()
+                    gl_list = load_gl_codes(COMPANY_ID, DATA_VERSION)
                     cur_gl = str(row.gl_code or "").strip()
                     gl_opts = gl_list if gl_list else ["999"]
                     # Map stored code to display option
@@ -2567,7 +7093,7 @@ elif menu == "Αρχείο & Διορθώσεις":
                 
                 col_upd, col_del = st.columns(2)
                 with col_upd:
-                    if st.button("Ενημέρωση", key=f"det_upd_{rid}", width='stretch', type="primary"):
+                    if st.button("Ενημέρωση", key=f"det_upd_{rid}", width='stretch', type="primary", disabled=bool(row.locked)):
                         # Validate updated data
                         upd_data = {
                             'partner': new_partner,
@@ -2582,21 +7108,7 @@ elif menu == "Αρχείο & Διορθώσεις":
                                 st.error(f"❌ {error}")
                         else:
                             try:
-                                db_execute(
-                                    """UPDATE journal SET
-                                            doc_date = :doc_date,
-                                            doc_no = :doc_no,
-                                            doc_type = :doc_type,
-                                            counterparty = :counterparty,
-                                            description = :description,
-                                            gl_code = :gl_code,
-                                            amount_net = :amount_net,
-                                            vat_amount = :vat_amount,
-                                            amount_gross = :amount_gross,
-                                            payment_method = :payment_method,
-                                            bank_account = :bank_account,
-                                            status = :status
-                                        WHERE id = :id""",
+                                update_journal_entry(
                                     {
                                         "doc_date": new_date.strftime('%Y-%m-%d') if hasattr(new_date, 'strftime') else str(new_date),
                                         "doc_no": new_docno,
@@ -2613,7 +7125,6 @@ elif menu == "Αρχείο & Διορθώσεις":
                                         "id": rid,
                                     },
                                 )
-                                st.cache_data.clear()  # Clear cache after update
                                 st.session_state.pop("arch_focus_id", None)
                                 st.success("✓ Ενημερώθηκε!")
                                 time.sleep(0.3)
@@ -2621,10 +7132,9 @@ elif menu == "Αρχείο & Διορθώσεις":
                             except Exception as e:
                                 st.error(f"❌ Σφάλμα κατά την ενημέρωση: {str(e)}")
                 with col_del:
-                    if st.button("Διαγραφή", key=f"det_del_{rid}", width='stretch', type="secondary"):
+                    if st.button("Διαγραφή", key=f"det_del_{rid}", width='stretch', type="secondary", disabled=bool(row.locked)):
                         try:
-                            db_execute("DELETE FROM journal WHERE id = :id", {"id": rid})
-                            st.cache_data.clear()  # Clear cache after delete
+                            bulk_delete_journal([rid])
                             st.session_state.pop("arch_focus_id", None)
                             st.session_state.pop("arch_detail_id", None)
                             st.error("✗ Διαγράφηκε!")
@@ -2637,26 +7147,23 @@ elif menu == "Αρχείο & Διορθώσεις":
 elif menu == "Ταμείο & Τράπεζες":
     st.title("💵 Διαχείριση Διαθεσίμων")
 
-    df_all = load_journal_data()
-    
-    df_all['doc_date'] = pd.to_datetime(df_all['doc_date'], errors='coerce')
-    df_all = clean_dataframe(df_all)
-    
-    # Filter only paid transactions
-    df = df_all[df_all['status'] == 'Paid'].copy()
+    # Paid transactions only, aggregated per account and doc_type
+    df = load_cash_positions(COMPANY_ID, DATA_VERSION)
     
     if df.empty:
         st.warning("⚠️ Δεν υπάρχουν πληρωμένες συναλλαγές")
         st.stop()
     
     # Calculate cash flow
-    df['flow'] = df.apply(
-        lambda x: x['amount_gross'] if x['doc_type'] == 'Income' else -x['amount_gross'],
-        axis=1
-    )
-    df['bank_account'] = df['bank_account'].fillna('Ταμείο').astype(str)
+    df['flow'] = df['amount_gross'].where(df['doc_type'] == 'Income', -df['amount_gross'])
     
     st.subheader("📊 Σύνοψη Διαθεσίμων")
+    closed_through = get_closed_through()
+    if closed_through:
+        st.caption(
+            f"🔒 Οι κλειστές περίοδοι (έως {format_period_key(closed_through)}) μετρούν με τα υπόλοιπα "
+            "του στιγμιότυπου κλεισίματος."
+        )
     
     # Separate cash and bank accounts
     cash_mask = df['bank_account'].str.contains("Ταμείο|Cash|Μετρητά", case=False, na=False)
@@ -2719,7 +7226,7 @@ elif menu == "Ταμείο & Τράπεζες":
             'Υπόλοιπο': f"€{balance:,.2f}",
             'Εισροές': f"€{acc_df[acc_df['doc_type']=='Income']['amount_gross'].sum():,.2f}",
             'Εκροές': f"€{acc_df[acc_df['doc_type'].isin(['Expense','Bill','Cash Withdrawal'])]['amount_gross'].sum():,.2f}",
-            'Συναλλαγές': len(acc_df)
+            'Συναλλαγές': int(acc_df['n'].sum())
         })
     
     if account_summary:
@@ -2731,9 +7238,6 @@ elif menu == "Ταμείο & Τράπεζες":
     # Cash flow trends
     st.subheader("📈 Τάσεις Ταμείου - Τελευταίες Συναλλαγές")
     
-    # Sort by date descending
-    df_sorted = df.sort_values('doc_date', ascending=False)
-    
     # Show recent transactions
     recent = st.selectbox(
         "Εμφάνιση τελευταίων:",
@@ -2742,7 +7246,8 @@ elif menu == "Ταμείο & Τράπεζες":
         key="treasury_recent"
     )
     
-    df_recent = df_sorted.head(recent).sort_values('doc_date', ascending=True).copy()
+    df_recent = load_journal_rows(status='Paid', limit=recent, company_id=COMPANY_ID, data_version=DATA_VERSION)
+    df_recent = df_recent.sort_values('doc_date', ascending=True)
     df_recent['doc_date_str'] = df_recent['doc_date'].dt.strftime('%d/%m/%Y')
     
     # Create display dataframe
@@ -2769,11 +7274,7 @@ elif menu == "Ταμείο & Τράπεζες":
     st.divider()
     st.subheader("📊 Ιστορικό Υπολοίπων (Ανά Μήνα)")
     
-    df_monthly = df.copy()
-    df_monthly['month'] = df_monthly['doc_date'].dt.to_period('M')
-    monthly_flow = df_monthly.groupby('month')['flow'].sum().reset_index()
-    monthly_flow['month'] = monthly_flow['month'].astype(str)
-    monthly_flow = monthly_flow.sort_values('month')
+    monthly_flow = load_monthly_cash_flow(COMPANY_ID, DATA_VERSION)
     
     if not monthly_flow.empty:
         # Calculate cumulative balance
@@ -2801,8 +7302,95 @@ elif menu == "Ταμείο & Τράπεζες":
         
         st.plotly_chart(fig, width='stretch')
         
-        st.info(f"📌 **Τελευταία ενημέρωση:** {df['doc_date'].max().strftime('%d/%m/%Y')}")
+        st.info(f"📌 **Τελευταία ενημέρωση:** {df['last_date'].max().strftime('%d/%m/%Y')}")
     
+    st.divider()
+    st.subheader("🔮 Πρόβλεψη Ταμειακών Ροών")
+    horizon = st.radio(
+        "Ορίζοντας",
+        list(FORECAST_HORIZONS),
+        format_func=lambda h: f"{FORECAST_HORIZONS[h]} {'εβδομάδες' if h == 'weeks' else 'μήνες'}",
+        horizontal=True,
+        key="treasury_forecast_horizon",
+    )
+    forecast = load_cash_forecast(horizon, date.today(), COMPANY_ID, DATA_VERSION)
+    forecast["bank_account"] = forecast["bank_account"].replace("", FORECAST_UNALLOCATED)
+    forecast["period_label"] = forecast["start"].dt.strftime("%d/%m" if horizon == "weeks" else "%m/%Y")
+    by_period = forecast.groupby("start", as_index=False).agg(
+        period_label=("period_label", "first"), inflow=("inflow", "sum"),
+        outflow=("outflow", "sum"), balance=("balance", "sum"),
+    )
+    low = by_period.loc[by_period["balance"].idxmin()]
+
+    f1, f2, f3, f4 = st.columns(4)
+    f1.metric("📥 Αναμενόμενες Εισπράξεις", f"€{by_period['inflow'].sum():,.2f}")
+    f2.metric("📤 Αναμενόμενες Πληρωμές", f"€{by_period['outflow'].sum():,.2f}")
+    f3.metric(
+        "📉 Χαμηλότερο Υπόλοιπο",
+        f"€{low['balance']:,.2f}",
+        help=f"Περίοδος από {low['start']:%d/%m/%Y}",
+    )
+    f4.metric(
+        "🏁 Υπόλοιπο Τέλους",
+        f"€{by_period['balance'].iloc[-1]:,.2f}",
+        delta=f"€{by_period['balance'].iloc[-1] - total_available:,.2f}",
+    )
+
+    fig_fc = px.line(
+        forecast,
+        x='period_label',
+        y='balance',
+        color='bank_account',
+        markers=True,
+        title='Προβλεπόμενο Υπόλοιπο ανά Λογαριασμό',
+        labels={'period_label': 'Περίοδος', 'balance': 'Υπόλοιπο (€)', 'bank_account': 'Λογαριασμός'},
+    )
+    fig_fc.update_layout(plot_bgcolor='#f8f9fa', paper_bgcolor='#ffffff', hovermode='x unified', height=400)
+    st.plotly_chart(fig_fc, width='stretch')
+
+    # The unallocated line is not an account: a negative balance there is only the unassigned payments.
+    accounts = forecast[forecast["bank_account"] != FORECAST_UNALLOCATED]
+    negative = accounts[accounts["balance"] < 0].groupby("bank_account")["start"].min()
+    for account, start in negative.items():
+        st.warning(f"⚠️ {account}: αρνητικό υπόλοιπο από την περίοδο {start:%d/%m/%Y}")
+
+    balances = forecast.pivot(index="bank_account", columns="start", values="balance")
+    balances.columns = [f"{c:%d/%m}" if horizon == "weeks" else f"{c:%m/%Y}" for c in balances.columns]
+    st.dataframe(
+        balances.reset_index().rename(columns={"bank_account": "Λογαριασμός"}),
+        width='stretch',
+        hide_index=True,
+        column_config={c: st.column_config.NumberColumn(format="€%.2f") for c in balances.columns},
+    )
+
+    with st.expander("📋 Αναλυτικά αναμενόμενες κινήσεις"):
+        events = load_forecast_events(date.today(), COMPANY_ID, DATA_VERSION)
+        events = events[events["date"] < _forecast_bounds(horizon, date.today())[-1]]
+        st.dataframe(
+            pd.DataFrame({
+                "Ημερ/νία": events["date"].dt.date,
+                "Πηγή": events["source"].map(FORECAST_SOURCES),
+                "Λογαριασμός": events["bank_account"].replace("", FORECAST_UNALLOCATED),
+                "Τύπος": events["doc_type"],
+                "Συναλλασσόμενος": events["counterparty"].replace("", "—"),
+                "Ποσό": events["amount"],
+            }),
+            width='stretch',
+            hide_index=True,
+            column_config={
+                "Ημερ/νία": st.column_config.DateColumn(format="DD/MM/YYYY"),
+                "Ποσό": st.column_config.NumberColumn(format="€%.2f"),
+            },
+        )
+    st.caption(
+        "Ανοιχτά παραστατικά: ημερομηνία παραστατικού + μέσος χρόνος εξόφλησης του συναλλασσόμενου "
+        f"(ή {FORECAST_TERMS_DAYS} ημέρες χωρίς ιστορικό). Ληξιπρόθεσμα μετρούν στην τρέχουσα περίοδο. "
+        "Χωρίς λογαριασμό: ο λογαριασμός από τον οποίο εξοφλείται συνήθως ο συναλλασσόμενος, αλλιώς "
+        f"η γραμμή «{FORECAST_UNALLOCATED}». "
+        f"Επαναλαμβανόμενες: πληρωμές σε τουλάχιστον {FORECAST_RECURRING_MIN} από τους τελευταίους "
+        f"{FORECAST_RECURRING_MONTHS} μήνες με σταθερό ποσό."
+    )
+
     st.divider()
     st.subheader("💡 Σημειώσεις")
     st.markdown("""
@@ -2812,26 +7400,171 @@ elif menu == "Ταμείο & Τράπεζες":
     - **Εμφανίζονται μόνο** πληρωμένες συναλλαγές (Status = Paid)
     """)
 
+# --- BANK RECONCILIATION ---
+elif menu == "Συμφωνία Τραπεζών":
+    st.title("🔗 Συμφωνία Τραπεζών")
+    st.caption(
+        "Εισαγωγή κινήσεων από αρχεία τράπεζας (CSV, OFX, CAMT.053) και αντιστοίχιση με τις ανοιχτές (Unpaid) "
+        "εγγραφές: ίδιο ποσό, ημερομηνία κοντά στο παραστατικό, συναλλασσόμενος / αριθμός παραστατικού στην αιτιολογία."
+    )
+
+    st.subheader("📥 Εισαγωγή Κινήσεων")
+    bank_options = [b for b in load_bank_accounts(COMPANY_ID, DATA_VERSION) if _bank_kind_from_name(b) != "cash"]
+    i1, i2 = st.columns([2, 1])
+    statement_file = i1.file_uploader("Αρχείο κινήσεων", type=["csv", "txt", "ofx", "qfx", "xml"], key="recon_file")
+    statement_account = i2.selectbox(
+        "Λογαριασμός", bank_options + ["➕ Νέος..."] if bank_options else ["➕ Νέος..."], key="recon_account"
+    )
+    if statement_account == "➕ Νέος...":
+        statement_account = i2.text_input("Όνομα λογαριασμού", key="recon_account_new")
+    if statement_file is not None:
+        try:
+            parsed = parse_bank_statement(statement_file.getvalue(), statement_file.name)
+            p1, p2, p3 = st.columns(3)
+            p1.metric("Κινήσεις", f"{len(parsed)}")
+            p2.metric("Πιστώσεις", f"€{parsed['amount'].clip(lower=0).sum():,.2f}")
+            p3.metric("Χρεώσεις", f"€{-parsed['amount'].clip(upper=0).sum():,.2f}")
+            with st.expander("Προεπισκόπηση"):
+                st.dataframe(parsed.head(50), width='stretch', hide_index=True)
+            if st.button("Εισαγωγή κινήσεων", type="primary", disabled=parsed.empty, key="recon_import"):
+                counts = import_statement_lines(parsed, statement_account)
+                flash(f"Εισήχθησαν {counts['inserted']} κινήσεις ({counts['skipped']} υπήρχαν ήδη).")
+                st.rerun()
+        except ValueError as e:
+            st.error(str(e))
+        except Exception as e:
+            st.error(f"❌ Σφάλμα ανάγνωσης αρχείου: {str(e)}")
+
+    st.divider()
+    st.subheader("🔍 Προτεινόμενες Αντιστοιχίσεις")
+    lines = load_unmatched_lines()
+    if lines.empty:
+        st.info("📭 Δεν υπάρχουν ασυμφωνημένες κινήσεις")
+        st.stop()
+    items = load_recon_candidates(
+        (lines["txn_date"].min() - pd.Timedelta(days=RECON_DAYS_AFTER)).date(),
+        (lines["txn_date"].max() + pd.Timedelta(days=RECON_DAYS_BEFORE)).date(),
+    )
+    proposals = match_statement_lines(lines, items)
+
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Ασυμφωνημένες κινήσεις", f"{len(lines)}")
+    m2.metric("Προτάσεις", f"{len(proposals)}")
+    m3.metric("Ανοιχτές εγγραφές (παράθυρο)", f"{len(items)}")
+
+    if proposals.empty:
+        st.info("Δεν βρέθηκαν εγγραφές με ίδιο ποσό στο χρονικό παράθυρο.")
+    else:
+        grid = pd.DataFrame({
+            "Επιβεβαίωση": proposals["score"] >= RECON_AUTO_SCORE,
+            "Βαθμός": proposals["score"],
+            "Ημ/νία Κίνησης": proposals["txn_date"].dt.date,
+            "Ποσό": proposals["amount"],
+            "Αιτιολογία": proposals["description"],
+            "Λογαριασμός": proposals["bank_account"],
+            "Ημ/νία Παρ/κού": proposals["doc_date"].dt.date,
+            "Αρ. Παρ/κου": proposals["doc_no"],
+            "Τύπος": proposals["doc_type"],
+            "Συναλλασσόμενος": proposals["counterparty"],
+        })
+        edited_grid = st.data_editor(
+            grid,
+            width='stretch',
+            hide_index=True,
+            disabled=[c for c in grid.columns if c != "Επιβεβαίωση"],
+            key=f"recon_grid_{DATA_VERSION}",
+            column_config={
+                "Επιβεβαίωση": st.column_config.CheckboxColumn(),
+                "Βαθμός": st.column_config.ProgressColumn(min_value=0.0, max_value=1.0, format="%.2f"),
+                "Ημ/νία Κίνησης": st.column_config.DateColumn(format="DD/MM/YYYY"),
+                "Ημ/νία Παρ/κού": st.column_config.DateColumn(format="DD/MM/YYYY"),
+                "Ποσό": st.column_config.NumberColumn(format="€%.2f"),
+            },
+        )
+        selected = proposals[edited_grid["Επιβεβαίωση"].to_numpy()]
+        if st.button(
+            f"ΕΠΙΒΕΒΑΙΩΣΗ {len(selected)} ΑΝΤΙΣΤΟΙΧΙΣΕΩΝ", type="primary", width='stretch', disabled=selected.empty
+        ):
+            try:
+                confirmed = confirm_statement_matches(selected)
+                message = f"Εξοφλήθηκαν {confirmed['paid']} εγγραφές από κινήσεις τράπεζας."
+                if confirmed["stale"]:
+                    message += (
+                        f" {confirmed['stale']} αντιστοιχίσεις δεν εφαρμόστηκαν: η εγγραφή δεν είναι πλέον "
+                        "απλήρωτη (οι κινήσεις παραμένουν ασυμφωνημένες)."
+                    )
+                flash(message, "⚠️" if confirmed["stale"] else "✅")
+                st.rerun()
+            except ValueError as e:
+                st.error(str(e))
+            except Exception as e:
+                st.error(f"❌ Σφάλμα κατά την αποθήκευση: {str(e)}")
+
+    with st.expander(f"📄 Ασυμφωνημένες κινήσεις ({len(lines)})"):
+        st.dataframe(
+            pd.DataFrame({
+                "Ημερ/νία": lines["txn_date"].dt.date,
+                "Λογαριασμός": lines["bank_account"],
+                "Ποσό": lines["amount"],
+                "Αιτιολογία": lines["description"],
+                "Αναφορά": lines["reference"],
+            }),
+            width='stretch',
+            hide_index=True,
+            column_config={
+                "Ημερ/νία": st.column_config.DateColumn(format="DD/MM/YYYY"),
+                "Ποσό": st.column_config.NumberColumn(format="€%.2f"),
+            },
+        )
+
 # --- SETTINGS ---
 elif menu == "Ρυθμίσεις GL":
     st.title("⚙️ Διαχείριση Ρυθμίσεων")
     
     
     # Create tabs for different settings
-    tab_gl, tab_customers, tab_suppliers, tab_banks, tab_system = st.tabs([
+    tab_gl, tab_customers, tab_suppliers, tab_banks, tab_close, tab_system = st.tabs([
         "📚 GL Codes", 
         "👥 Πελάτες", 
         "🏭 Προμηθευτές",
         "🏦 Τραπεζικοί Λογαριασμοί",
+        "🔒 Κλείσιμο Περιόδων",
         "⚙️ Σύστημα"
     ])
+
+    # Every tab renders on each run: fetch their lists and counts in one parallel round trip.
+    company = {"company_id": COMPANY_ID}
+    settings_data = fetch_concurrently({
+        "gl": lambda: pd.read_sql_query(
+            text("SELECT code, description FROM gl_codes WHERE company_id = :company_id ORDER BY code"),
+            ENGINE,
+            params=company,
+        ),
+        "customers": lambda: pd.read_sql_query(
+            text("SELECT name FROM counterparties WHERE company_id = :company_id AND kind = 'customer' ORDER BY name"),
+            ENGINE,
+            params=company,
+        ),
+        "suppliers": lambda: pd.read_sql_query(
+            text("SELECT name FROM counterparties WHERE company_id = :company_id AND kind = 'supplier' ORDER BY name"),
+            ENGINE,
+            params=company,
+        ),
+        "accounts": lambda: pd.read_sql_query(
+            text("SELECT name, kind FROM bank_accounts WHERE company_id = :company_id ORDER BY name"),
+            ENGINE,
+            params=company,
+        ),
+        "total_records": lambda: int(db_scalar("SELECT COUNT(*) FROM journal WHERE company_id = :company_id", company, default=0)),
+        "gl_count": lambda: int(db_scalar("SELECT COUNT(*) FROM gl_codes WHERE company_id = :company_id", company, default=0)),
+    })
     
     # --- TAB 1: GL CODES ---
     with tab_gl:
         st.subheader("📚 Λογαριασμοί GL (Γενικό Καθολικό)")
         
         # Load GL codes
-        df_gl = pd.read_sql_query(text("SELECT * FROM gl_codes ORDER BY code"), ENGINE)
+        df_gl = settings_data["gl"]
         df_gl['code'] = df_gl['code'].astype(str)
         
         # Show current GL codes
@@ -2845,24 +7578,17 @@ elif menu == "Ρυθμίσεις GL":
             
             if st.button("Αποθήκευση GL Codes", width='stretch', type="primary"):
                 try:
-                    db_execute("DELETE FROM gl_codes")
-                    rows = [
-                        {
-                            "code": str(r.get('code', '')).strip(),
-                            "description": str(r.get('description', '')).strip(),
-                        }
-                        for _, r in edited_gl.iterrows()
-                        if str(r.get('code', '')).strip()
-                    ]
-                    if rows:
-                        db_executemany(
-                            "INSERT INTO gl_codes (code, description) VALUES (:code, :description)",
-                            rows,
+                    counts = save_gl_codes_diff(df_gl, edited_gl)
+                    if any(counts.values()):
+                        flash(
+                            f"✓ GL Codes αποθηκεύτηκαν: {counts['insert']} νέοι, "
+                            f"{counts['update']} αλλαγές, {counts['delete']} διαγραφές."
                         )
-                    st.cache_data.clear()
-                    st.success("✓ GL Codes αποθηκεύτηκαν!")
-                    time.sleep(0.5)
-                    st.rerun()
+                        st.rerun()
+                    else:
+                        st.info("Δεν υπάρχουν αλλαγές για αποθήκευση.")
+                except ValueError as e:
+                    st.error(str(e))
                 except Exception as e:
                     st.error(f"Σφάλμα: {str(e)}")
         
@@ -2874,13 +7600,15 @@ elif menu == "Ρυθμίσεις GL":
             if st.button("Προσθήκη GL", width='stretch'):
                 if new_code and new_desc:
                     try:
-                        db_execute(
-                            "INSERT INTO gl_codes (code, description) VALUES (:code, :description)",
-                            {"code": str(new_code).strip(), "description": str(new_desc).strip()},
-                        )
-                        st.cache_data.clear()
-                        st.success("✓ Προστέθηκε!")
-                        time.sleep(0.3)
+                        with db_unit_of_work() as conn:
+                            conn.execute(
+                                text(
+                                    "INSERT INTO gl_codes (company_id, code, description) "
+                                    "VALUES (:company_id, :code, :description)"
+                                ),
+                                {"company_id": COMPANY_ID, "code": str(new_code).strip(), "description": str(new_desc).strip()},
+                            )
+                        flash("✓ Προστέθηκε!")
                         st.rerun()
                     except Exception as e:
                         st.error(f"Σφάλμα: {str(e)}")
@@ -2890,10 +7618,7 @@ elif menu == "Ρυθμίσεις GL":
     # --- TAB 2: CUSTOMERS ---
     with tab_customers:
         st.subheader("👥 Διαχείριση Πελατών")
-        df_customers = pd.read_sql_query(
-            text("SELECT name FROM counterparties WHERE kind = 'customer' ORDER BY name"),
-            ENGINE,
-        )
+        df_customers = settings_data["customers"]
         customers = df_customers["name"].tolist() if not df_customers.empty else []
         
         st.write(f"**Σύνολο Πελατών:** {len(customers)}")
@@ -2916,10 +7641,9 @@ elif menu == "Ρυθμίσεις GL":
                 if customer_name:
                     try:
                         customer_name = str(customer_name).strip()
-                        upsert_counterparty(customer_name, "customer")
-                        st.cache_data.clear()
-                        st.success(f"✓ Πελάτης '{customer_name}' προστέθηκε!")
-                        time.sleep(0.3)
+                        with db_unit_of_work() as conn:
+                            upsert_counterparty(customer_name, "customer", conn=conn)
+                        flash(f"✓ Πελάτης '{customer_name}' προστέθηκε!")
                         st.rerun()
                     except Exception as e:
                         st.error(f"Σφάλμα: {str(e)}")
@@ -2940,19 +7664,9 @@ elif menu == "Ρυθμίσεις GL":
                             if not nn:
                                 st.warning("Το νέο όνομα δεν μπορεί να είναι κενό")
                             else:
-                                if old != nn:
-                                    db_execute(
-                                        "UPDATE journal SET counterparty = :nn WHERE counterparty = :old",
-                                        {"nn": nn, "old": old},
-                                    )
-                                    db_execute(
-                                        "DELETE FROM counterparties WHERE name = :old",
-                                        {"old": old},
-                                    )
-                                upsert_counterparty(nn, "customer")
-                                st.cache_data.clear()
-                                st.success("✓ Ενημερώθηκε!")
-                                time.sleep(0.3)
+                                # Single-row rename (or merge) via counterparty_id
+                                rename_counterparty(old, nn, "customer")
+                                flash("✓ Ενημερώθηκε!")
                                 st.rerun()
                         except Exception as e:
                             st.error(f"Σφάλμα: {str(e)}")
@@ -2960,10 +7674,8 @@ elif menu == "Ρυθμίσεις GL":
                     if st.button("Διαγραφή από λίστα", width='stretch', type="secondary", key="cust_del"):
                         try:
                             nm = str(sel_customer).strip()
-                            db_execute("DELETE FROM counterparties WHERE name = :n", {"n": nm})
-                            st.cache_data.clear()
-                            st.success("✓ Διαγράφηκε από τη λίστα.")
-                            time.sleep(0.3)
+                            delete_counterparty(nm)
+                            flash("✓ Διαγράφηκε από τη λίστα.")
                             st.rerun()
                         except Exception as e:
                             st.error(f"Σφάλμα: {str(e)}")
@@ -2973,10 +7685,7 @@ elif menu == "Ρυθμίσεις GL":
     # --- TAB 3: SUPPLIERS ---
     with tab_suppliers:
         st.subheader("🏭 Διαχείριση Προμηθευτών")
-        df_suppliers = pd.read_sql_query(
-            text("SELECT name FROM counterparties WHERE kind = 'supplier' ORDER BY name"),
-            ENGINE,
-        )
+        df_suppliers = settings_data["suppliers"]
         suppliers = df_suppliers["name"].tolist() if not df_suppliers.empty else []
         
         st.write(f"**Σύνολο Προμηθευτών:** {len(suppliers)}")
@@ -2999,10 +7708,9 @@ elif menu == "Ρυθμίσεις GL":
                 if supplier_name:
                     try:
                         supplier_name = str(supplier_name).strip()
-                        upsert_counterparty(supplier_name, "supplier")
-                        st.cache_data.clear()
-                        st.success(f"✓ Προμηθευτής '{supplier_name}' προστέθηκε!")
-                        time.sleep(0.3)
+                        with db_unit_of_work() as conn:
+                            upsert_counterparty(supplier_name, "supplier", conn=conn)
+                        flash(f"✓ Προμηθευτής '{supplier_name}' προστέθηκε!")
                         st.rerun()
                     except Exception as e:
                         st.error(f"Σφάλμα: {str(e)}")
@@ -3023,19 +7731,9 @@ elif menu == "Ρυθμίσεις GL":
                             if not nn:
                                 st.warning("Το νέο όνομα δεν μπορεί να είναι κενό")
                             else:
-                                if old != nn:
-                                    db_execute(
-                                        "UPDATE journal SET counterparty = :nn WHERE counterparty = :old",
-                                        {"nn": nn, "old": old},
-                                    )
-                                    db_execute(
-                                        "DELETE FROM counterparties WHERE name = :old",
-                                        {"old": old},
-                                    )
-                                upsert_counterparty(nn, "supplier")
-                                st.cache_data.clear()
-                                st.success("✓ Ενημερώθηκε!")
-                                time.sleep(0.3)
+                                # Single-row rename (or merge) via counterparty_id
+                                rename_counterparty(old, nn, "supplier")
+                                flash("✓ Ενημερώθηκε!")
                                 st.rerun()
                         except Exception as e:
                             st.error(f"Σφάλμα: {str(e)}")
@@ -3043,10 +7741,8 @@ elif menu == "Ρυθμίσεις GL":
                     if st.button("Διαγραφή από λίστα", width='stretch', type="secondary", key="sup_del"):
                         try:
                             nm = str(sel_supplier).strip()
-                            db_execute("DELETE FROM counterparties WHERE name = :n", {"n": nm})
-                            st.cache_data.clear()
-                            st.success("✓ Διαγράφηκε από τη λίστα.")
-                            time.sleep(0.3)
+                            delete_counterparty(nm)
+                            flash("✓ Διαγράφηκε από τη λίστα.")
                             st.rerun()
                         except Exception as e:
                             st.error(f"Σφάλμα: {str(e)}")
@@ -3056,10 +7752,7 @@ elif menu == "Ρυθμίσεις GL":
     # --- TAB 4: BANK ACCOUNTS ---
     with tab_banks:
         st.subheader("🏦 Διαχείριση Τραπεζικών Λογαριασμών")
-        df_accounts = pd.read_sql_query(
-            text("SELECT name, kind FROM bank_accounts ORDER BY name"),
-            ENGINE,
-        )
+        df_accounts = settings_data["accounts"]
         accounts = df_accounts["name"].tolist() if not df_accounts.empty else []
         
         st.write(f"**Σύνολο Λογαριασμών:** {len(accounts)}")
@@ -3087,10 +7780,9 @@ elif menu == "Ρυθμίσεις GL":
                     full_account = f"{account_type} - {account_name}"
                     try:
                         full_account = str(full_account).strip()
-                        upsert_bank_account(full_account, "cash" if account_type == "Ταμείο" else "bank")
-                        st.cache_data.clear()
-                        st.success(f"✓ Λογαριασμός '{full_account}' δημιουργήθηκε!")
-                        time.sleep(0.3)
+                        with db_unit_of_work() as conn:
+                            upsert_bank_account(full_account, "cash" if account_type == "Ταμείο" else "bank", conn=conn)
+                        flash(f"✓ Λογαριασμός '{full_account}' δημιουργήθηκε!")
                         st.rerun()
                     except Exception as e:
                         st.error(f"Σφάλμα: {str(e)}")
@@ -3123,16 +7815,9 @@ elif menu == "Ρυθμίσεις GL":
                             if not nn:
                                 st.warning("Το νέο όνομα δεν μπορεί να είναι κενό")
                             else:
-                                if old != nn:
-                                    db_execute(
-                                        "UPDATE journal SET bank_account = :nn WHERE bank_account = :old",
-                                        {"nn": nn, "old": old},
-                                    )
-                                    db_execute("DELETE FROM bank_accounts WHERE name = :old", {"old": old})
-                                upsert_bank_account(nn, kd)
-                                st.cache_data.clear()
-                                st.success("✓ Ενημερώθηκε!")
-                                time.sleep(0.3)
+                                # Journal, statement lines, lookup and snapshots in one transaction
+                                rename_bank_account(old, nn, kd)
+                                flash("✓ Ενημερώθηκε!")
                                 st.rerun()
                         except Exception as e:
                             st.error(f"Σφάλμα: {str(e)}")
@@ -3140,10 +7825,12 @@ elif menu == "Ρυθμίσεις GL":
                     if st.button("Διαγραφή από λίστα", width='stretch', type="secondary", key="bank_del"):
                         try:
                             nm = str(sel_account).strip()
-                            db_execute("DELETE FROM bank_accounts WHERE name = :n", {"n": nm})
-                            st.cache_data.clear()
-                            st.success("✓ Διαγράφηκε από τη λίστα.")
-                            time.sleep(0.3)
+                            with db_unit_of_work() as conn:
+                                conn.execute(
+                                    text("DELETE FROM bank_accounts WHERE company_id = :company_id AND name = :n"),
+                                    {"company_id": COMPANY_ID, "n": nm},
+                                )
+                            flash("✓ Διαγράφηκε από τη λίστα.")
                             st.rerun()
                         except Exception as e:
                             st.error(f"Σφάλμα: {str(e)}")
@@ -3151,6 +7838,84 @@ elif menu == "Ρυθμίσεις GL":
                 st.info("Δεν υπάρχουν λογαριασμοί για αφαίρεση")
     
     # --- TAB 5: SYSTEM ---
+    # --- TAB: PERIOD CLOSE ---
+    with tab_close:
+        st.subheader("🔒 Κλείσιμο Περιόδων")
+        st.caption(
+            "Το κλείσιμο κλειδώνει τις εγγραφές έως το τέλος της περιόδου και αποθηκεύει στιγμιότυπα "
+            "(ΦΠΑ, υπόλοιπα λογαριασμών και συναλλασσομένων). Οι αναφορές διαβάζουν τα στιγμιότυπα."
+        )
+        closed_through = get_closed_through()
+        if closed_through:
+            st.info(f"Κλειστές περίοδοι έως **{format_period_key(closed_through)}**.")
+        else:
+            st.info("Δεν υπάρχουν κλειστές περίοδοι.")
+
+        cl_type, cl_year, cl_sub = st.columns(3)
+        close_type = cl_type.selectbox("Κλείσιμο", ["Μήνας", "Τρίμηνο", "Έτος"], key="close_type")
+        close_year = int(cl_year.number_input(
+            "Έτος", min_value=2000, max_value=2100, value=date.today().year - 1, key="close_year"
+        ))
+        close_period_args: Dict[str, Any] = {"year": close_year}
+        if close_type == "Μήνας":
+            close_period_args["month"] = cl_sub.selectbox("Μήνας", range(1, 13), key="close_month")
+        elif close_type == "Τρίμηνο":
+            close_period_args["quarter"] = cl_sub.selectbox("Τρίμηνο", [1, 2, 3, 4], key="close_quarter")
+        close_end = _period_key(close_year, _period_months(close_period_args.get("month"), close_period_args.get("quarter"))[1])
+        st.caption(f"Θα κλείσουν όλοι οι ανοιχτοί μήνες έως {format_period_key(close_end)}.")
+        close_ok = st.checkbox("Επιβεβαιώνω το κλείσιμο", key="close_confirm")
+        if st.button("🔒 Κλείσιμο Περιόδου", type="primary", disabled=not close_ok, key="close_apply"):
+            try:
+                n = close_period(**close_period_args)
+                flash(f"Η περίοδος έκλεισε έως {format_period_key(close_end)} ({n} εγγραφές).", icon="🔒")
+                st.rerun()
+            except Exception as e:
+                st.error(f"❌ Σφάλμα κλεισίματος: {str(e)}")
+
+        if closed_through:
+            st.divider()
+            st.write("**Κλειστοί μήνες (στιγμιότυπο ΦΠΑ):**")
+            closed_months = pd.read_sql_query(
+                text(
+                    "SELECT fiscal_year, period_month, SUM(n) AS n, SUM(amount_net) AS amount_net, "
+                    "SUM(vat_amount) AS vat_amount FROM period_snapshots WHERE company_id = :company_id AND kind = 'vat' "
+                    "GROUP BY fiscal_year, period_month ORDER BY fiscal_year DESC, period_month DESC"
+                ),
+                ENGINE,
+                params={"company_id": COMPANY_ID},
+            )
+            closed_view = pd.DataFrame({
+                "Περίοδος": _month_labels(closed_months),
+                "Εγγραφές": closed_months["n"].astype(int),
+                "Καθαρό": closed_months["amount_net"].astype(float),
+                "ΦΠΑ": closed_months["vat_amount"].astype(float),
+            })
+            st.dataframe(
+                closed_view,
+                width='stretch',
+                hide_index=True,
+                column_config={
+                    "Καθαρό": st.column_config.NumberColumn(format="€%.2f"),
+                    "ΦΠΑ": st.column_config.NumberColumn(format="€%.2f"),
+                },
+            )
+
+            st.write("**Άνοιγμα Περιόδου:**")
+            st.caption("Ανοίγει ο μήνας και όλοι οι επόμενοι κλειστοί μήνες· τα στιγμιότυπά τους διαγράφονται.")
+            ro_year, ro_month = st.columns(2)
+            reopen_year = int(ro_year.number_input(
+                "Έτος", min_value=2000, max_value=2100, value=closed_through // 100, key="reopen_year"
+            ))
+            reopen_month = ro_month.selectbox("Μήνας", range(1, 13), index=closed_through % 100 - 1, key="reopen_month")
+            reopen_ok = st.checkbox("Επιβεβαιώνω το άνοιγμα", key="reopen_confirm")
+            if st.button("🔓 Άνοιγμα", disabled=not reopen_ok, key="reopen_apply"):
+                try:
+                    reopen_period(reopen_year, reopen_month)
+                    flash(f"Η περίοδος {reopen_month:02d}/{reopen_year} άνοιξε.", icon="🔓")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"❌ Σφάλμα: {str(e)}")
+
     with tab_system:
         st.subheader("⚙️ Ρυθμίσεις Συστήματος")
 
@@ -3168,20 +7933,98 @@ elif menu == "Ρυθμίσεις GL":
                 st.code(f"Βάση: Postgres (Supabase)\nHost: {host}\nDB: {dbn}\nsslmode: {sslmode}")
             else:
                 st.code(f"Βάση: SQLite\nDB file: {DB_FILE}")
+                if SQLITE_PROFILE["enabled"]:
+                    journal_mode = db_scalar("PRAGMA journal_mode", default="?")
+                    st.caption(
+                        f"SQLite profile: journal_mode={journal_mode}, synchronous={SQLITE_PROFILE['synchronous']}, "
+                        f"cache={SQLITE_PROFILE['cache_size_kb']} KiB, mmap={SQLITE_PROFILE['mmap_size_mb']} MiB, "
+                        f"busy_timeout={SQLITE_PROFILE['busy_timeout_ms']} ms, "
+                        f"checkpoint κάθε {SQLITE_PROFILE['checkpoint_seconds']} s"
+                    )
+                    if st.button("WAL checkpoint + optimize τώρα", key="sys_sqlite_checkpoint"):
+                        if sqlite_maintenance(force=True):
+                            st.success("✓ Ολοκληρώθηκε.")
+                        else:
+                            st.warning("Δεν ήταν δυνατή η εκτέλεση τώρα.")
                 st.warning(
                     "SQLite είναι τοπικό αρχείο. Για 100% μόνιμη αποθήκευση (ειδικά σε Streamlit Cloud) χρησιμοποίησε Postgres/Supabase μέσω `DATABASE_URL`."
                 )
         except Exception:
             pass
+
+        if REPLICA_ENGINE is not None or READ_MIRROR_FILE:
+            source = {"mirror": "τοπικό mirror", "replica": "replica (DATABASE_READ_URL)"}.get(READ_ROUTE, "κύρια βάση")
+            st.caption(f"Αναγνώσεις αναφορών: {source}")
+        stats = _query_stats()
+        with stats["lock"]:
+            query_rows = [
+                {"Βάση": role, "Ερωτήματα": row["queries"], "ms": round(row["total_ms"], 1), "Τελευταίο": row["last"]}
+                for role, row in sorted(stats["roles"].items())
+            ]
+        if query_rows:
+            st.dataframe(pd.DataFrame(query_rows), hide_index=True, width='stretch')
         
-        # Get database statistics
-        total_records = int(db_scalar("SELECT COUNT(*) FROM journal", default=0))
-        gl_count = int(db_scalar("SELECT COUNT(*) FROM gl_codes", default=0))
+        # Get database statistics (session company)
+        total_records = settings_data["total_records"]
+        gl_count = settings_data["gl_count"]
         
         stat1, stat2 = st.columns(2)
         stat1.metric("📝 Σύνολο Εγγραφών", f"{total_records}")
         stat2.metric("📚 GL Codes", f"{gl_count}")
 
+        st.download_button(
+            "💾 Snapshot βάσης (Parquet)",
+            data=snapshot_download(),
+            file_name=f"erp_snapshot_{date.today().isoformat()}.zip",
+            mime="application/zip",
+            on_click="ignore",
+            key="sys_snapshot",
+            help=(
+                "Ημερολόγιο, πίνακες αναφοράς, επαναλαμβανόμενες εγγραφές και κλειστές περίοδοι της εταιρείας "
+                "σε Parquet. Φορτώνεται ξανά σε εταιρεία χωρίς εγγραφές."
+            ),
+        )
+
+        reimport = st.file_uploader(
+            "📥 Εισαγωγή Excel (ένα ή περισσότερα αρχεία, όλα τα φύλλα)",
+            type=["xlsx"],
+            accept_multiple_files=True,
+            key="sys_reimport",
+            help="Προστίθενται μόνο οι γραμμές που δεν έχουν εισαχθεί ήδη (ίδιο αρχείο / φύλλο / γραμμή και περιεχόμενο).",
+        )
+        if reimport:
+            render_import_preview(reimport, "sys_import")
+
+        if not total_records:
+            snap = st.file_uploader("📦 Φόρτωση Snapshot (.zip)", type=["zip"], key="sys_snapshot_load")
+            if snap and st.button("Φόρτωση Snapshot", key="sys_snapshot_apply"):
+                try:
+                    flash(f"Snapshot φορτώθηκε: {import_snapshot(snap)} εγγραφές.")
+                    st.rerun()
+                except ValueError as e:
+                    st.error(str(e))
+
+        st.divider()
+
+        st.write("**🏢 Εταιρείες:**")
+        st.caption(
+            "Κάθε εταιρεία έχει δικό της ημερολόγιο, λογαριασμούς GL, συναλλασσόμενους, "
+            "τραπεζικούς λογαριασμούς και κλειστές περιόδους. Επιλογή από το πλευρικό μενού."
+        )
+        st.dataframe(
+            pd.DataFrame({"Εταιρεία": list(COMPANIES.values())}, index=list(COMPANIES)),
+            width='stretch',
+        )
+        with st.form("sys_new_company", clear_on_submit=True):
+            new_company = st.text_input("Νέα εταιρεία", placeholder="π.χ. Εταιρεία Β ΙΚΕ")
+            if st.form_submit_button("➕ Δημιουργία"):
+                try:
+                    st.session_state["company_id"] = create_company(new_company)
+                    flash(f"Η εταιρεία {new_company.strip()} δημιουργήθηκε.", icon="🏢")
+                    st.rerun()
+                except ValueError as e:
+                    st.error(str(e))
+
         st.divider()
 
         show_shortcuts = st.toggle("⌨️ Συντομεύσεις Πληκτρολογίου", value=False, key="sys_shortcuts_toggle")
@@ -3194,7 +8037,7 @@ elif menu == "Ρυθμίσεις GL":
             - `Ctrl + F`: Εστίαση στο πεδίο αναζήτησης
 
             **🧭 Πλοήγηση:**
-            - `Alt + 1-7`: Άμεση μετάβαση στο μενού
+            - `Alt + 1-9`: Άμεση μετάβαση στο μενού
             """)
         
         st.divider()
@@ -3208,33 +8051,22 @@ elif menu == "Ρυθμίσεις GL":
             st.session_state.confirm_reset = False
         
         if not st.session_state.confirm_reset:
-            if st.button("Διαγραφή ΌΛΩΝ των δεδομένων (Reset DB)", width='stretch', type="secondary"):
+            if st.button("Διαγραφή ΌΛΩΝ των δεδομένων της εταιρείας (Reset)", width='stretch', type="secondary"):
                 st.session_state.confirm_reset = True
                 st.rerun()
         else:
-            st.error("⚠️ Είστε σίγουροι; Θα διαγραφούν ΟΛΑ τα δεδομένα!")
+            st.error(f"⚠️ Είστε σίγουροι; Θα διαγραφούν ΟΛΑ τα δεδομένα της εταιρείας {COMPANIES.get(COMPANY_ID)}!")
             col_yes, col_no = st.columns(2)
             with col_yes:
                 if st.button("✅ Ναι, διαγραφή όλων", width='stretch', type="primary"):
                     try:
-                        db_execute("DELETE FROM journal")
-                        db_execute("DELETE FROM gl_codes")
-                        try:
-                            db_execute("DELETE FROM counterparties")
-                        except Exception:
-                            pass
-                        try:
-                            db_execute("DELETE FROM bank_accounts")
-                        except Exception:
-                            pass
-                        st.session_state["db_initialized"] = False
-                        init_db()
-                        st.session_state["db_initialized"] = True
-                        st.cache_data.clear()
+                        with db_unit_of_work() as conn:
+                            for table in COMPANY_TABLES:
+                                conn.execute(text(f"DELETE FROM {table} WHERE company_id = :company_id"), company)
+                            conn.execute(text(COMPANY_CLOSED_THROUGH_SQL), {**company, "v": 0})
+                            insert_default_gl_codes(conn, COMPANY_ID)
                         st.session_state.confirm_reset = False
-                        st.error("✗ Η βάση καθαρίστηκε πλήρως!")
-                        st.info("Η εφαρμογή ξανα-αρχικοποίησε τα βασικά GL codes.")
-                        time.sleep(2)
+                        flash("✗ Η βάση καθαρίστηκε πλήρως! Τα βασικά GL codes αρχικοποιήθηκαν ξανά.", icon="🗑️")
                         st.rerun()
                     except Exception as e:
                         st.error(f"Σφάλμα: {str(e)}")
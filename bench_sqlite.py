@@ -0,0 +1,167 @@
+"""Write/read contention on SQLite: the app's connection profile vs SQLite defaults.
+
+Stand-alone (no Streamlit): writer threads save small batches of journal rows while
+reader threads run a year's GROUP BY, like concurrent sessions saving and opening the
+Dashboard. Each mode gets a fresh database file with the same rows.
+
+    python bench_sqlite.py [--rows 200000] [--seconds 10] [--writers 2] [--readers 4]
+
+"profile" applies the same pragmas as `app._apply_sqlite_pragmas` and reads the same
+ERP_SQLITE_* variables; "default" is what the app used before (rollback journal,
+synchronous=FULL, the driver's 5 s lock wait).
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, "")).strip())
+    except ValueError:
+        return default
+
+
+PROFILE_PRAGMAS = [
+    f"PRAGMA journal_mode={os.getenv('ERP_SQLITE_JOURNAL_MODE', 'WAL').strip().upper() or 'WAL'}",
+    f"PRAGMA synchronous={os.getenv('ERP_SQLITE_SYNCHRONOUS', 'NORMAL').strip().upper() or 'NORMAL'}",
+    f"PRAGMA cache_size=-{max(0, _env_int('ERP_SQLITE_CACHE_SIZE_KB', 65536))}",
+    f"PRAGMA mmap_size={max(0, _env_int('ERP_SQLITE_MMAP_SIZE_MB', 256)) * 1024 * 1024}",
+    f"PRAGMA busy_timeout={max(0, _env_int('ERP_SQLITE_BUSY_TIMEOUT_MS', 5000))}",
+    "PRAGMA temp_store=MEMORY",
+]
+MODES = {
+    "default": ["PRAGMA journal_mode=DELETE", "PRAGMA synchronous=FULL"],
+    "profile": PROFILE_PRAGMAS,
+}
+DOC_TYPES = ["Income", "Expense", "Bill"]
+SCHEMA = """CREATE TABLE journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, company_id INTEGER NOT NULL, doc_date TEXT,
+    doc_type TEXT, counterparty TEXT, status TEXT,
+    amount_net REAL, vat_amount REAL, amount_gross REAL
+);
+CREATE INDEX idx_journal_company_doc_date ON journal(company_id, doc_date);"""
+INSERT_SQL = (
+    "INSERT INTO journal (company_id, doc_date, doc_type, counterparty, status, amount_net, vat_amount, amount_gross) "
+    "VALUES (1, ?, ?, ?, ?, ?, ?, ?)"
+)
+# Dashboard-style totals for one year.
+READ_SQL = """SELECT doc_type, COUNT(*), SUM(amount_net), SUM(vat_amount), SUM(amount_gross)
+    FROM journal WHERE company_id = 1 AND doc_date >= ? AND doc_date < ? GROUP BY doc_type"""
+
+
+def _row(rng: random.Random) -> tuple:
+    net = round(rng.uniform(10, 5000), 2)
+    day = date(2020, 1, 1) + timedelta(days=rng.randrange(6 * 365))
+    return (
+        day.isoformat(), rng.choice(DOC_TYPES), f"Partner {rng.randrange(500)}",
+        rng.choice(["Paid", "Unpaid"]), net, round(net * 0.24, 2), round(net * 1.24, 2),
+    )
+
+
+def _connect(path: str, mode: str) -> sqlite3.Connection:
+    # 5 s driver lock wait in both modes, as SQLAlchemy's pysqlite engine had before the profile.
+    con = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+    for pragma in MODES[mode]:
+        con.execute(pragma)
+    return con
+
+
+def _prefill(path: str, rows: int) -> None:
+    rng = random.Random(42)
+    con = sqlite3.connect(path)
+    con.executescript(SCHEMA)
+    with con:
+        con.executemany(INSERT_SQL, (_row(rng) for _ in range(rows)))
+    con.close()
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return float("nan")
+    return statistics.quantiles(values, n=100)[int(q) - 1] if len(values) > 1 else values[0]
+
+
+def run_mode(mode: str, args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="erp_bench_")
+    path = os.path.join(workdir, f"{mode}.db")
+    _prefill(path, args.rows)
+    stop = threading.Event()
+    lock = threading.Lock()
+    result = {"write_ms": [], "read_ms": [], "write_errors": 0, "read_errors": 0}
+
+    def writer(seed: int) -> None:
+        rng, con = random.Random(seed), _connect(path, mode)
+        while not stop.is_set():
+            batch = [_row(rng) for _ in range(args.batch)]
+            started = time.perf_counter()
+            try:
+                with con:
+                    con.executemany(INSERT_SQL, batch)
+            except sqlite3.OperationalError:
+                with lock:
+                    result["write_errors"] += 1
+                continue
+            with lock:
+                result["write_ms"].append((time.perf_counter() - started) * 1000.0)
+        con.close()
+
+    def reader(seed: int) -> None:
+        rng, con = random.Random(seed), _connect(path, mode)
+        while not stop.is_set():
+            year = rng.randrange(2020, 2026)
+            started = time.perf_counter()
+            try:
+                con.execute(READ_SQL, (f"{year}-01-01", f"{year + 1}-01-01")).fetchall()
+            except sqlite3.OperationalError:
+                with lock:
+                    result["read_errors"] += 1
+                continue
+            with lock:
+                result["read_ms"].append((time.perf_counter() - started) * 1000.0)
+        con.close()
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    threads += [threading.Thread(target=reader, args=(100 + i,)) for i in range(args.readers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+    os.rmdir(workdir)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000, help="journal rows before the run")
+    parser.add_argument("--seconds", type=float, default=10.0, help="run time per mode")
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=5, help="rows per write transaction")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    print(f"{args.rows} rows, {args.writers} writers x {args.batch} rows, {args.readers} readers, {args.seconds:g} s per mode")
+    print(f"{'mode':<8} {'commits/s':>9} {'write p50':>9} {'write p95':>9} {'reads/s':>8} {'read p50':>8} {'read p95':>8} {'errors':>6}")
+    for mode in args.modes:
+        r = run_mode(mode, args)
+        w, rd = r["write_ms"], r["read_ms"]
+        print(
+            f"{mode:<8} {len(w) / args.seconds:>9.1f} {_percentile(w, 50):>7.1f}ms {_percentile(w, 95):>7.1f}ms "
+            f"{len(rd) / args.seconds:>8.1f} {_percentile(rd, 50):>6.1f}ms {_percentile(rd, 95):>6.1f}ms "
+            f"{r['write_errors'] + r['read_errors']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
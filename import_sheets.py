@@ -0,0 +1,267 @@
+"""Excel import: sheet parsing, column mapping, validation and row fingerprints.
+
+Pure pandas (no Streamlit, no database), so `app.prepare_import_batch` can run
+`prepare_import_sheet` in spawned / forkserver worker processes that import this
+module by name. The app writes the rows (`_write_import_rows`) and stamps the company.
+"""
+import hashlib
+import re
+import unicodedata
+from datetime import date
+from typing import Any, Dict, Iterable, Optional
+
+import pandas as pd
+
+# Year-first text (ISO, 2024/03/05, 2024.3.5) is never read day-first.
+_YEAR_FIRST_DATE_RE = re.compile(r"^(\d{4})[./-](\d{1,2})[./-](\d{1,2})(?!\d)")
+# Numeric day-first text; ambiguous when both leading parts could be the month.
+_DAY_FIRST_DATE_RE = re.compile(r"^(\d{1,2})[./-](\d{1,2})[./-](\d{2}|\d{4})(?!\d)")
+
+
+def _fold_text(values: pd.Series) -> pd.Series:
+    """Lower case, accents removed, punctuation to spaces (for header and name matching)."""
+    def fold(v: str) -> str:
+        v = unicodedata.normalize("NFD", v.lower())
+        return " ".join(re.sub(r"[^\w/.]+", " ", "".join(c for c in v if not unicodedata.combining(c))).split())
+
+    return values.fillna("").astype(str).map(fold)
+
+
+def _parse_amounts(values: pd.Series) -> pd.Series:
+    """Amounts in either notation ("1.234,56", "-1,234.56", "1234.56") to floats."""
+    s = values.fillna("").astype(str).str.replace(r"[^\d,.\-+]", "", regex=True)
+    comma_decimal = s.str.rfind(",") > s.str.rfind(".")
+    s = s.where(~comma_decimal, s.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    s = s.where(comma_decimal, s.str.replace(",", "", regex=False))
+    return pd.to_numeric(s, errors="coerce")
+
+
+def _parse_dates(values: pd.Series) -> pd.Series:
+    """Year-first (ISO, 2024/03/05), YYYYMMDD (OFX) or day-first dates to Timestamps (NaT when unparseable)."""
+    s = values.fillna("").astype(str).str.strip()
+    parts = s.str.extract(_YEAR_FIRST_DATE_RE)
+    iso = parts[0].notna()
+    compact = s.str.match(r"^\d{8}")
+    out = pd.to_datetime(
+        pd.DataFrame({"year": parts[0], "month": parts[1], "day": parts[2]}).astype(float), errors="coerce"
+    )
+    out = out.fillna(pd.to_datetime(s.where(compact).str[:8], errors="coerce", format="%Y%m%d"))
+    return out.fillna(pd.to_datetime(s.where(~iso & ~compact), errors="coerce", dayfirst=True, format="mixed"))
+
+
+def _import_content(row: Dict[str, Any]) -> str:
+    """Date, doc_no, doc_type, partner and gross (in cents) of an imported row."""
+    parts = [
+        str(row.get("doc_date") or ""),
+        *(str(row.get(c) or "").strip() for c in ("doc_no", "doc_type", "counterparty")),
+        str(int(round(float(row.get("amount_gross") or 0.0) * 100))),
+    ]
+    return "\x1f".join(parts)
+
+
+def _import_fingerprint(content: str, occurrence: int) -> str:
+    """sha1 of the row content and its repeat number within the sheet (1 for the first copy)."""
+    return hashlib.sha1(f"{content}\x1f{occurrence}".encode("utf-8")).hexdigest()
+
+
+# Sheet header -> journal field: folded alias first (see `_fold_text`), else the most similar
+# header. "income" / "expense" / "dividends" are the cashflow layout of the bundled workbook.
+IMPORT_COLUMN_ALIASES = {
+    "doc_date": ("ημερομηνια", "ημ/νια", "ημερομηνια παραστατικου", "docdate", "date", "doc date"),
+    "doc_no": ("αρ. παραστατικου", "αριθμος παραστατικου", "παραστατικο", "docno", "doc no", "invoice no"),
+    "doc_type": ("τυπος", "τυπος παραστατικου", "doctype", "doc type", "type"),
+    "counterparty": ("στελεχος", "συναλλασσομενος", "πελατης/προμηθευτης", "επωνυμια", "counterparty", "partner"),
+    "description": ("περιγραφη", "αιτιολογια", "description"),
+    "category": ("κατηγορια", "category"),
+    "gl_code": ("κωδικος gl", "λογαριασμος gl", "gl", "gl_code", "gl code"),
+    "amount_net": ("καθαρο", "καθαρη αξια", "amount net", "net"),
+    "vat_amount": ("φπα", "ποσο φπα", "vat amount", "vat"),
+    "amount_gross": ("συνολο", "μικτο", "amount gross", "gross"),
+    "income": ("εσοδα", "income"),
+    "expense": ("εξοδα", "expense", "expenses"),
+    "dividends": ("μερισματα", "dividends"),
+    "payment_method": ("τροπος πληρωμης", "payment method"),
+    "bank_account": ("τραπεζα", "λογαριασμος τραπεζας", "bank account", "bank_account"),
+    "status": ("εγκριση", "κατασταση", "status"),
+}
+IMPORT_MAP_MIN_SCORE = 0.8
+IMPORT_AMOUNT_FIELDS = ("amount_net", "vat_amount", "amount_gross", "income", "expense", "dividends")
+# Rows shown and checked before the whole sheet has been read (see `preview_import_sheets`).
+IMPORT_PREVIEW_ROWS = 200
+IMPORT_ISSUE_COLUMNS = ["row", "field", "value", "problem", "severity"]
+
+
+def auto_map_import_columns(headers: Iterable[Any]) -> Dict[str, Optional[str]]:
+    """field -> sheet header (None when unmapped); each header is used at most once.
+
+    Exact aliases score 1.0, other headers their `difflib` similarity to the closest alias;
+    pairs below `IMPORT_MAP_MIN_SCORE` are ignored and the best pairs are taken first.
+    """
+    import difflib
+
+    headers = [str(h).strip() for h in headers]
+    folded = dict(zip(headers, _fold_text(pd.Series(headers, dtype=object))))
+    scored = []
+    for field, aliases in IMPORT_COLUMN_ALIASES.items():
+        for header, key in folded.items():
+            if not key:
+                continue
+            score = max(1.0 if key == a else difflib.SequenceMatcher(None, key, a).ratio() for a in aliases)
+            if score >= IMPORT_MAP_MIN_SCORE:
+                scored.append((score, field, header))
+    mapping: Dict[str, Optional[str]] = dict.fromkeys(IMPORT_COLUMN_ALIASES)
+    used = set()
+    for _, field, header in sorted(scored, key=lambda t: -t[0]):
+        if mapping[field] is None and header not in used:
+            mapping[field] = header
+            used.add(header)
+    return mapping
+
+
+def _import_sheet_kind(mapping: Dict[str, Optional[str]]) -> Optional[str]:
+    """"cashflow" (income / expense columns), "journal" (net / gross columns) or None."""
+    if not mapping.get("doc_date"):
+        return None
+    if any(mapping.get(f) for f in ("income", "expense", "dividends")):
+        return "cashflow"
+    if mapping.get("amount_net") or mapping.get("amount_gross"):
+        return "journal"
+    return None
+
+
+def _import_frame(df: pd.DataFrame) -> pd.DataFrame:
+    df.columns = df.columns.astype(str).str.strip()
+    # Formatted-but-empty rows (typically below the data) are not transactions.
+    return df.dropna(how="all")
+
+
+def _import_amounts(values: pd.Series) -> pd.Series:
+    """Numbers as-is, text through `_parse_amounts` (€, 1.234,56 / 1,234.56); NaN when invalid."""
+    num = pd.to_numeric(values, errors="coerce")
+    return num.fillna(_parse_amounts(values.where(num.isna())))
+
+
+def _import_columns(df: pd.DataFrame, mapping: Dict[str, Optional[str]]):
+    """(raw, text, amount) accessors for mapped fields; unmapped ones read as blank / 0."""
+    blank = pd.Series(None, index=df.index, dtype=object)
+
+    def raw(field: str) -> pd.Series:
+        return df[mapping[field]] if mapping.get(field) in df.columns else blank
+
+    def text_of(field: str) -> pd.Series:
+        return raw(field).fillna("").astype(str).str.strip()
+
+    def amount(field: str) -> pd.Series:
+        return _import_amounts(raw(field)).fillna(0.0)
+
+    return raw, text_of, amount
+
+
+def _no_import_issues() -> pd.DataFrame:
+    return pd.DataFrame(columns=IMPORT_ISSUE_COLUMNS)
+
+
+def validate_import_frame(df: pd.DataFrame, mapping: Dict[str, Optional[str]]) -> pd.DataFrame:
+    """Problems per sheet row (`IMPORT_ISSUE_COLUMNS`; row = Excel row number).
+
+    Errors: unreadable dates, non-numeric amounts. Warnings: missing dates (imported as
+    today), gross that differs from net + VAT.
+    """
+    df = _import_frame(df)
+    raw, text_of, amount = _import_columns(df, mapping)
+    issues = []
+
+    def add(mask: pd.Series, field: str, values: pd.Series, problem: str, severity: str) -> None:
+        if mask.any():
+            issues.append(pd.DataFrame({
+                "row": df.index[mask] + 2,
+                "field": field,
+                "value": values[mask].astype(str).to_numpy(),
+                "problem": problem,
+                "severity": severity,
+            }))
+
+    if mapping.get("doc_date"):
+        dates, shown = _parse_dates(raw("doc_date")), text_of("doc_date")
+        add(dates.isna() & (shown != ""), "doc_date", shown, "Μη έγκυρη ημερομηνία", "error")
+        add(shown == "", "doc_date", shown, "Χωρίς ημερομηνία (θα καταχωρηθεί σήμερα)", "warning")
+    for field in IMPORT_AMOUNT_FIELDS:
+        if mapping.get(field):
+            shown = text_of(field)
+            add(_import_amounts(raw(field)).isna() & (shown != ""), field, shown, "Μη αριθμητικό ποσό", "error")
+    if mapping.get("amount_gross") and (mapping.get("amount_net") or mapping.get("vat_amount")):
+        net, vat, gross = amount("amount_net"), amount("vat_amount"), amount("amount_gross")
+        add(
+            (gross != 0) & ((gross - net - vat).abs() > 0.01),
+            "amount_gross",
+            gross.map("{:.2f}".format) + " ≠ " + (net + vat).map("{:.2f}".format),
+            "Μικτό ≠ Καθαρό + ΦΠΑ",
+            "warning",
+        )
+    if not issues:
+        return _no_import_issues()
+    return pd.concat(issues, ignore_index=True).sort_values("row", kind="stable", ignore_index=True)
+
+
+def _import_frame_rows(
+    df: pd.DataFrame, file_name: str, sheet: str, mapping: Optional[Dict[str, Optional[str]]] = None
+) -> list[Dict[str, Any]]:
+    """Sheet -> journal rows (ISO `doc_date`) stamped with `import_source` / `import_fingerprint`.
+
+    Columns come from `mapping` (default: `auto_map_import_columns`). Cashflow sheets take the
+    amount from income / expense / dividends and the type from which one is set.
+    """
+    df = _import_frame(df)
+    mapping = mapping or auto_map_import_columns(df.columns)
+    kind = _import_sheet_kind(mapping)
+    if kind is None:
+        raise ValueError("Άγνωστη μορφή φύλλου (λείπουν στήλες ημερομηνίας / ποσών).")
+    raw, text_of, amount = _import_columns(df, mapping)
+
+    dates = _parse_dates(raw("doc_date"))
+    out = pd.DataFrame({"doc_date": dates.dt.strftime("%Y-%m-%d").fillna(date.today().isoformat())}, index=df.index)
+    out["doc_no"] = text_of("doc_no")
+    if kind == "cashflow":
+        income, expense, dividends = amount("income"), amount("expense"), amount("dividends")
+        out["doc_type"] = ""
+        out.loc[(expense != 0) | (dividends != 0), "doc_type"] = "Expense"
+        out.loc[income != 0, "doc_type"] = "Income"
+        out["amount_net"] = income.where(income != 0, expense.where(expense != 0, dividends))
+        out["vat_amount"] = 0.0
+        out["amount_gross"] = out["amount_net"]
+    else:
+        out["doc_type"] = text_of("doc_type")
+        out["amount_net"], out["vat_amount"], gross = amount("amount_net"), amount("vat_amount"), amount("amount_gross")
+        out["amount_gross"] = gross.where(gross != 0, out["amount_net"] + out["vat_amount"])
+    out["counterparty"] = text_of("counterparty")
+    category, desc = text_of("category"), text_of("description")
+    out["description"] = (
+        ("[" + category + "] " + desc).where(desc != "", category).where(category != "", desc)
+    )
+    out["gl_code"] = text_of("gl_code").replace("", "999")
+    out["payment_method"] = text_of("payment_method")
+    out["bank_account"] = text_of("bank_account")
+    out["status"] = text_of("status")
+
+    rows = out.to_dict("records")
+    # One row per non-blank sheet row, in order: Excel row = frame index + 2 (header on row 1).
+    # Undated rows fall back to today; the fingerprint keeps them undated so reruns match.
+    # Identical rows within the sheet are told apart by their repeat number.
+    repeats: Dict[str, int] = {}
+    for row, has_date, excel_row in zip(rows, dates.notna(), df.index + 2):
+        row["import_source"] = f"{file_name}|{sheet}|{excel_row}"
+        content = _import_content(row if has_date else {**row, "doc_date": ""})
+        repeats[content] = repeats.get(content, 0) + 1
+        row["import_fingerprint"] = _import_fingerprint(content, repeats[content])
+    return rows
+
+
+def prepare_import_sheet(
+    file_name: str, data: bytes, sheet: str, mapping: Optional[Dict[str, Optional[str]]]
+) -> Dict[str, Any]:
+    """One sheet of an uploaded workbook -> {"rows": `_import_frame_rows`, "issues": `validate_import_frame`}."""
+    import io
+
+    df = _import_frame(pd.read_excel(io.BytesIO(data), sheet_name=sheet, engine="openpyxl"))
+    mapping = mapping or auto_map_import_columns(df.columns)
+    return {"rows": _import_frame_rows(df, file_name, sheet, mapping), "issues": validate_import_frame(df, mapping)}